@@ -0,0 +1,650 @@
+"""
+Асинхронный движок Telegram-бота (asyncio)
+Те же команды и логика, что и в bot.py, но обработчики и HTTP-запросы
+к GigaChat и ProxyAPI неблокирующие, а число одновременных запросов
+ограничено отдельно для ответов и для генерации картинок
+"""
+
+import asyncio
+import contextvars
+import os
+from io import BytesIO
+
+import aiohttp
+from telebot.async_telebot import AsyncTeleBot
+from telebot.asyncio_helper import ApiTelegramException
+from telebot.util import smart_split
+
+import bot as core
+from coalescer import AsyncMessageCoalescer
+from image_cache import CachedImage
+from openai import APIConnectionError
+from resilience import UpstreamUnavailable, upstream_status
+from singleflight import AsyncSingleFlight, fingerprint
+from streaming import STREAM_DONE, TELEGRAM_MESSAGE_LIMIT, EditThrottle, parse_sse_line
+from transport import create_async_proxyapi_client
+
+# Лимиты одновременных запросов по стадиям
+CHAT_CONCURRENCY = int(os.getenv('CHAT_CONCURRENCY', '32'))
+IMAGE_CONCURRENCY = int(os.getenv('IMAGE_CONCURRENCY', '4'))
+
+# Инициализация асинхронного бота
+bot = AsyncTeleBot(core.TELEGRAM_BOT_TOKEN)
+
+# Ресурсы, которые создаются внутри event loop (см. _run)
+_session = None
+_proxyapi_client = None
+_chat_limit = None
+_image_limit = None
+
+# Ссылки на фоновые задачи генерации картинок, чтобы их не собрал GC
+_background_tasks = set()
+
+# Сколько генераций картинок ждёт или выполняется (см. bot.IMAGE_QUEUE_LIMIT)
+_pending_images = 0
+
+# Политики запросов (см. bot.gigachat_policy): общие лимиты и выключатели,
+# сетевые ошибки - aiohttp и асинхронного клиента ProxyAPI
+gigachat_policy = core.gigachat_policy.with_transient_errors(
+    (aiohttp.ClientConnectionError, asyncio.TimeoutError))
+image_policy = core.image_policy.with_transient_errors((APIConnectionError,))
+
+# Ошибки запроса к GigaChat, после которых пользователь получает ERROR_ANSWER
+GIGACHAT_ERRORS = (aiohttp.ClientError, asyncio.TimeoutError, UpstreamUnavailable)
+
+# Объединение одновременных одинаковых запросов (см. bot.SINGLE_FLIGHT)
+inflight = AsyncSingleFlight() if core.SINGLE_FLIGHT else None
+
+
+async def deduplicate(kind, fn, *args):
+    """Асинхронный аналог bot.deduplicate: fn - корутинная функция"""
+    if not inflight:
+        return await fn(*args)
+    return await inflight.do(kind, fingerprint(*args), lambda: fn(*args))
+
+
+async def run_blocking(fn, *args):
+    """
+    Выполняет блокирующий вызов в пуле потоков: история и кеш ответов берут
+    блокировки потоков, а при HISTORY_BACKEND=sqlite пишут на диск - медленная
+    запись не должна останавливать event loop и все диалоги вместе с ним.
+    Вызов выполняется в контексте текущего сообщения (трассировка)
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, contextvars.copy_context().run, fn, *args)
+
+
+async def get_access_token():
+    """
+    Возвращает токен GigaChat из общего кеша bot.token_manager
+    Действующий токен берётся из кеша сразу; запрос нового (раз в ~30 минут)
+    выполняется в пуле потоков, чтобы не блокировать event loop
+    """
+    token = core.token_manager.cached_token()
+    if token:
+        return token
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, core.get_gigachat_access_token)
+
+
+async def refreshed_token(error, access_token):
+    """Асинхронный аналог bot.refreshed_token: новый токен после ответа 401 или None"""
+    if upstream_status(error) != 401:
+        return None
+    fresh_token = await get_access_token()
+    return fresh_token if fresh_token and fresh_token != access_token else None
+
+
+async def _post_gigachat(access_token, payload):
+    """
+    Отправляет запрос к chat/completions GigaChat по политике и возвращает JSON ответа
+    После 401 запрос один раз повторяется с новым токеном
+    """
+    try:
+        return await gigachat_policy.call_async(lambda: _post_gigachat_once(access_token, payload))
+    except aiohttp.ClientResponseError as e:
+        fresh_token = await refreshed_token(e, access_token)
+        if not fresh_token:
+            raise
+    return await gigachat_policy.call_async(lambda: _post_gigachat_once(fresh_token, payload))
+
+
+@core.metrics.timed('gigachat_request')
+async def _post_gigachat_once(access_token, payload):
+    """Одна попытка запроса к chat/completions"""
+    async with _chat_limit:
+        async with _session.post(core.GIGACHAT_CHAT_URL,
+                                 headers=core.gigachat_headers(access_token),
+                                 json=payload, ssl=False) as response:
+            if response.status == 401:
+                # Токен отозван или истёк раньше срока - следующий запрос получит новый
+                core.token_manager.invalidate()
+            response.raise_for_status()
+            result = await response.json()
+            core.metrics.record_usage(result.get('usage'))
+            return result
+
+
+async def ask_gigachat(question, message_history=None):
+    """Асинхронный аналог bot.ask_gigachat"""
+    if core.response_cache:
+        cached = await run_blocking(core.response_cache.get, question, message_history)
+        if cached is not None:
+            return cached
+
+    return await deduplicate('chat', _ask_gigachat, question, message_history)
+
+
+@core.metrics.timed('ask_gigachat')
+async def _ask_gigachat(question, message_history=None):
+    access_token = await get_access_token()
+    if not access_token:
+        return core.NO_ACCESS_ANSWER
+
+    payload = core.build_chat_payload(question, message_history)
+
+    try:
+        result = await _post_gigachat(access_token, payload)
+        if 'choices' in result and len(result['choices']) > 0:
+            content = core.extract_message_content(result)
+            if not content:
+                return 'Не удалось получить ответ'
+            if core.response_cache:
+                await run_blocking(core.response_cache.put, question, message_history, content)
+            return content
+        return core.BAD_FORMAT_ANSWER
+
+    except GIGACHAT_ERRORS as e:
+        print(f"❌ Ошибка при запросе к GigaChat: {e}")
+        return core.ERROR_ANSWER
+
+
+async def stream_gigachat(question, message_history=None):
+    """Асинхронный аналог bot.stream_gigachat: отдаёт фрагменты ответа по мере генерации"""
+    access_token = await get_access_token()
+    if not access_token:
+        raise aiohttp.ClientError("нет токена доступа GigaChat")
+
+    payload = core.build_chat_payload(question, message_history)
+    payload["stream"] = True
+
+    async with _chat_limit:
+        try:
+            response = await _open_gigachat_stream(access_token, payload)
+        except aiohttp.ClientResponseError as e:
+            # Токен истёк раньше срока - один повтор с новым
+            fresh_token = await refreshed_token(e, access_token)
+            if not fresh_token:
+                raise
+            response = await _open_gigachat_stream(fresh_token, payload)
+
+        async with response:
+            # StreamReader отдаёт поток построчно
+            async for line in response.content:
+                delta = parse_sse_line(line)
+                if delta is STREAM_DONE:
+                    break
+                if delta:
+                    yield delta
+
+
+async def _open_gigachat_stream(access_token, payload):
+    """Асинхронный аналог bot._open_gigachat_stream"""
+    headers = core.gigachat_headers(access_token)
+    headers['Accept'] = 'text/event-stream'
+
+    # Поток не повторяется, но выключатель и лимит частоты действуют и здесь
+    delay = gigachat_policy.admit()
+    if delay:
+        await asyncio.sleep(delay)
+    try:
+        response = await _session.post(core.GIGACHAT_CHAT_URL, headers=headers,
+                                       json=payload, ssl=False)
+        if response.status == 401:
+            core.token_manager.invalidate()
+        response.raise_for_status()
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        gigachat_policy.record(e)
+        raise
+    gigachat_policy.record()
+    return response
+
+
+async def generate_image_prompt(question, history=None):
+    """Асинхронный аналог bot.generate_image_prompt"""
+    return await deduplicate('image_prompt', _generate_image_prompt, question, history)
+
+
+@core.metrics.timed('image_prompt')
+async def _generate_image_prompt(question, history=None):
+    access_token = await get_access_token()
+    if not access_token:
+        return None
+
+    payload = core.build_image_prompt_payload(question, history)
+
+    try:
+        result = await _post_gigachat(access_token, payload)
+        prompt = core.extract_message_content(result)
+        return prompt.strip() if prompt is not None else None
+
+    except GIGACHAT_ERRORS as e:
+        print(f"❌ Ошибка при генерации промпта: {e}")
+        return None
+
+
+async def ask_gigachat_combined(question, message_history=None):
+    """Асинхронный аналог bot.ask_gigachat_combined"""
+    return await deduplicate('combined', _ask_gigachat_combined, question, message_history)
+
+
+@core.metrics.timed('combined')
+async def _ask_gigachat_combined(question, message_history=None):
+    access_token = await get_access_token()
+    if not access_token:
+        return core.NO_ACCESS_ANSWER, None
+
+    payload = core.build_combined_payload(question, message_history)
+
+    try:
+        result = await _post_gigachat(access_token, payload)
+        return core.parse_combined_response(core.extract_message_content(result))
+
+    except GIGACHAT_ERRORS as e:
+        print(f"❌ Ошибка при запросе к GigaChat: {e}")
+        return core.ERROR_ANSWER, None
+
+
+async def answer_with_image_prompt(question, history=None):
+    """Асинхронный аналог bot.answer_with_image_prompt"""
+    if core.COMBINED_COMPLETION:
+        cached = None
+        if core.response_cache:
+            cached = await run_blocking(core.response_cache.get, question, history)
+        if cached is None:
+            combined = await ask_gigachat_combined(question, history)
+            if combined is not None:
+                answer, image_prompt = combined
+                if image_prompt is None and answer not in core.COMBINED_FAILURE_ANSWERS:
+                    print("⚠️  В совмещённом ответе GigaChat нет описания картинки, запрашиваем его отдельно")
+                    image_prompt = await generate_image_prompt(question, history)
+                if core.response_cache and image_prompt:
+                    await run_blocking(core.response_cache.put, question, history, answer)
+                return answer, image_prompt
+            print("⚠️  Пустой совмещённый ответ GigaChat, делаем два запроса")
+        else:
+            return cached, await generate_image_prompt(question, history)
+
+    answer, image_prompt = await asyncio.gather(
+        ask_gigachat(question, history),
+        generate_image_prompt(question, history),
+    )
+    return answer, image_prompt
+
+
+async def generate_image_proxyapi(prompt):
+    """Асинхронный аналог bot.generate_image_proxyapi, возвращает bytes изображения"""
+    if not _proxyapi_client:
+        return None
+
+    return await deduplicate('image', _generate_image_proxyapi, prompt)
+
+
+@core.metrics.timed('image_generation')
+async def _generate_image_proxyapi(prompt):
+    try:
+        async with _image_limit:
+            result = await image_policy.call_async(lambda: _request_image_once(prompt))
+
+        # Декодирование и пережатие - в пуле потоков, не в event loop
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, core.prepare_image, result.data[0].b64_json)
+
+    except Exception as e:
+        print(f"❌ Ошибка при генерации изображения ProxyAPI: {e}")
+        return None
+
+
+@core.metrics.timed('proxyapi_request')
+async def _request_image_once(prompt):
+    """Одна попытка запроса картинки к ProxyAPI"""
+    return await _proxyapi_client.images.generate(model="gpt-image-1", prompt=prompt)
+
+
+@bot.message_handler(commands=['start'])
+async def send_welcome(message):
+    """Обработчик команды /start"""
+    await bot.reply_to(message, core.WELCOME_TEXT)
+
+
+@bot.message_handler(commands=['help'])
+async def send_help(message):
+    """Обработчик команды /help"""
+    await bot.reply_to(message, core.HELP_TEXT)
+
+
+@bot.message_handler(commands=['clear'])
+async def clear_history(message):
+    """Обработчик команды /clear - очищает историю сообщений"""
+    user_id = message.from_user.id
+    if await run_blocking(core.clear_user_history, user_id):
+        await bot.reply_to(message, "✅ История сообщений очищена!")
+    else:
+        await bot.reply_to(message, "ℹ️ История сообщений пуста.")
+
+
+async def find_category_image(user_question):
+    """Асинхронный аналог bot.find_category_image"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, core.find_category_image, user_question)
+
+
+async def get_image(user_question, image_prompt):
+    """Асинхронный аналог bot.get_image: кеш на диске, иначе генерация через ProxyAPI"""
+    loop = asyncio.get_running_loop()
+    category = (core.detect_category(user_question, image_prompt)
+                if core.IMAGE_CACHE_BY_CATEGORY else None)
+    if core.image_cache:
+        cached = await loop.run_in_executor(None, core.image_cache.lookup, image_prompt, category)
+        if cached:
+            return cached
+
+    global _pending_images
+    _pending_images += 1
+    try:
+        image_data = await generate_image_proxyapi(image_prompt)
+    finally:
+        _pending_images -= 1
+    if not image_data:
+        return None
+    if core.image_cache:
+        return await loop.run_in_executor(None, core.image_cache.store,
+                                          image_prompt, category, image_data)
+    return CachedImage(data=image_data)
+
+
+def wants_image(user_question):
+    """bot.wants_image с учётом очереди генераций: при переполнении - только текст"""
+    if _pending_images >= core.IMAGE_QUEUE_LIMIT:
+        print(f"🖼  Картинка: нет (очередь картинок: {_pending_images}) - {user_question[:60]!r}")
+        return False
+    return core.wants_image(user_question)
+
+
+@core.metrics.timed('send_photo')
+async def send_image(chat_id, image, **kwargs):
+    """Асинхронный аналог bot.send_image: повторно картинка уходит по file_id"""
+    if image.file_id:
+        try:
+            return await bot.send_photo(chat_id, image.file_id, **kwargs)
+        except ApiTelegramException as e:
+            print(f"⚠️  file_id картинки больше не принимается, загружаем заново: {e}")
+            core.image_cache.forget_file_id(image.blob)
+
+    loop = asyncio.get_running_loop()
+    image_data = await loop.run_in_executor(None, image.read)
+    sent = await bot.send_photo(chat_id, BytesIO(image_data), **kwargs)
+    if core.image_cache and image.blob and sent.photo:
+        core.image_cache.remember_file_id(image.blob, sent.photo[-1].file_id)
+    return sent
+
+
+async def _reply_sequential(message, user_question, history, turn=None):
+    """Последовательный режим: картинка с подписью одним сообщением"""
+    image = None
+    image_prompt = None
+    need_prompt = False
+    if wants_image(user_question):
+        image = await find_category_image(user_question)
+        need_prompt = image is None
+
+    if need_prompt:
+        answer, image_prompt = await answer_with_image_prompt(user_question, history)
+    else:
+        answer = await ask_gigachat(user_question, history)
+
+    if core.superseded(turn):
+        return
+
+    if image_prompt:
+        await bot.send_chat_action(message.chat.id, 'upload_photo')
+        image = await get_image(user_question, image_prompt)
+
+    await run_blocking(core.remember_turn, message.from_user.id, user_question, answer)
+
+    if image:
+        await send_image(message.chat.id, image, caption=core.make_caption(answer))
+    else:
+        await bot.reply_to(message, answer)
+
+
+async def _deliver_image(chat_id, user_question, image, image_prompt, reply_to_message_id):
+    """
+    Отправляет картинку ответом на уже отправленный текст: готовую из кеша
+    или сгенерированную по промпту (строке или задаче, которая его вернёт)
+    """
+    try:
+        if image is None:
+            if asyncio.isfuture(image_prompt):
+                image_prompt = await image_prompt
+            if not image_prompt:
+                return
+            await bot.send_chat_action(chat_id, 'upload_photo')
+            image = await get_image(user_question, image_prompt)
+        if image:
+            await send_image(chat_id, image, reply_to_message_id=reply_to_message_id)
+    except Exception as e:
+        print(f"❌ Ошибка при отправке изображения: {e}")
+
+
+async def edit_streamed_text(sent, text):
+    """Правит сообщение с потоковым ответом, не прерываясь на ошибках Telegram"""
+    try:
+        await bot.edit_message_text(text, sent.chat.id, sent.message_id)
+    except ApiTelegramException as e:
+        print(f"⚠️  Не удалось обновить сообщение: {e}")
+
+
+@core.metrics.timed('gigachat_stream')
+async def stream_answer(message, user_question, history):
+    """Асинхронный аналог bot.stream_answer, возвращает (answer, отправленное сообщение)"""
+    if core.response_cache:
+        cached = await run_blocking(core.response_cache.get, user_question, history)
+        if cached is not None:
+            return cached, await bot.reply_to(message, cached)
+
+    sent = await bot.reply_to(message, core.STREAM_PLACEHOLDER)
+    throttle = EditThrottle(interval=core.STREAM_EDIT_INTERVAL)
+    try:
+        async for delta in stream_gigachat(user_question, history):
+            text = throttle.feed(delta)
+            if text:
+                await edit_streamed_text(sent, text)
+        answer = throttle.text or 'Не удалось получить ответ'
+        if core.response_cache and throttle.text:
+            await run_blocking(core.response_cache.put, user_question, history, throttle.text)
+    except GIGACHAT_ERRORS as e:
+        print(f"❌ Ошибка при потоковом запросе к GigaChat: {e}")
+        answer = throttle.text or core.ERROR_ANSWER
+
+    parts = smart_split(answer, TELEGRAM_MESSAGE_LIMIT)
+    await edit_streamed_text(sent, parts[0])
+    for part in parts[1:]:
+        await bot.send_message(sent.chat.id, part)
+    return answer, sent
+
+
+async def _reply_pipelined(message, user_question, history, turn=None):
+    """Конвейерный режим: текст уходит сразу, картинка догоняет отдельным сообщением"""
+    image = None
+    need_prompt = False
+    if wants_image(user_question):
+        image = await find_category_image(user_question)
+        need_prompt = image is None
+
+    image_prompt = None
+    if need_prompt and core.COMBINED_COMPLETION and not core.STREAM_REPLIES:
+        # Один структурированный запрос: ответ и промпт картинки вместе
+        answer, image_prompt = await answer_with_image_prompt(user_question, history)
+        if core.superseded(turn):
+            return
+        sent = await bot.reply_to(message, answer)
+    else:
+        if core.STREAM_REPLIES and core.superseded(turn):
+            return
+
+        if need_prompt:
+            image_prompt = asyncio.ensure_future(generate_image_prompt(user_question, history))
+
+        if core.STREAM_REPLIES:
+            answer, sent = await stream_answer(message, user_question, history)
+        else:
+            try:
+                answer = await ask_gigachat(user_question, history)
+            except asyncio.CancelledError:
+                # Вопрос поглощён новыми сообщениями - промпт картинки тоже не нужен
+                if asyncio.isfuture(image_prompt):
+                    image_prompt.cancel()
+                raise
+            if core.superseded(turn):
+                if asyncio.isfuture(image_prompt):
+                    image_prompt.cancel()
+                return
+            sent = await bot.reply_to(message, answer)
+    await run_blocking(core.remember_turn, message.from_user.id, user_question, answer)
+
+    if image or image_prompt:
+        task = asyncio.ensure_future(_deliver_image(message.chat.id, user_question, image,
+                                                    image_prompt, sent.message_id))
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
+
+
+@bot.message_handler(func=lambda message: True)
+async def handle_message(message):
+    """Обработчик всех текстовых сообщений"""
+    user_question = message.text
+
+    error_text = core.question_too_long_text(user_question)
+    if error_text:
+        await bot.reply_to(message, error_text)
+        return
+
+    await bot.send_chat_action(message.chat.id, 'typing')
+
+    if message_coalescer:
+        message_coalescer.add(message.from_user.id, message, user_question)
+    else:
+        await answer_message(message, user_question)
+
+
+@core.metrics.timed('answer', new_trace=True)
+async def answer_message(message, user_question, turn=None):
+    """Асинхронный аналог bot.answer_message"""
+    history = await run_blocking(core.get_history, message.from_user.id)
+
+    if core.PIPELINE_MODE == 'pipelined':
+        await _reply_pipelined(message, user_question, history, turn)
+    else:
+        await _reply_sequential(message, user_question, history, turn)
+
+
+async def _answer_turn(turn):
+    """Отвечает на склеенный вопрос; задача отменяется, если вопрос поглощён новым"""
+    await answer_message(turn.last, turn.text, turn)
+
+
+message_coalescer = None
+if core.COALESCE_WINDOW_MS > 0:
+    message_coalescer = AsyncMessageCoalescer(
+        _answer_turn,
+        window=core.COALESCE_WINDOW_MS / 1000,
+        max_delay=core.COALESCE_MAX_DELAY_MS / 1000,
+    )
+
+# Статистика асинхронного движка дополняет общие метрики bot.metrics
+core.metrics.add_collector('gigachat_async', gigachat_policy.stats)
+core.metrics.add_collector('proxyapi_async', image_policy.stats)
+core.metrics.add_collector('pending_images', lambda: {'count': _pending_images})
+if inflight:
+    core.metrics.add_collector('inflight_async', inflight.stats, label='kind')
+if message_coalescer:
+    core.metrics.add_collector('coalescer_async', message_coalescer.stats)
+
+
+async def _drain(timeout):
+    """
+    Дожидается начатых обработчиков сообщений и отправки картинок не дольше
+    timeout секунд: иначе asyncio.run отменит их вместе с ответами пользователям
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    current = asyncio.current_task()
+    while True:
+        # Обработчик может запустить новую задачу (картинку) - ждём по кругу
+        pending = [task for task in asyncio.all_tasks() if task is not current and not task.done()]
+        remaining = deadline - loop.time()
+        if not pending or remaining <= 0:
+            break
+        print(f"⏳ Дорабатываем {len(pending)} задач перед остановкой...")
+        await asyncio.wait(pending, timeout=remaining)
+    if pending:
+        print(f"⚠️  При остановке не завершены задачи: {len(pending)}")
+
+
+async def _run():
+    """Создаёт HTTP-клиенты внутри event loop и запускает long polling"""
+    global _session, _proxyapi_client, _chat_limit, _image_limit
+
+    _chat_limit = asyncio.Semaphore(CHAT_CONCURRENCY)
+    _image_limit = asyncio.Semaphore(IMAGE_CONCURRENCY)
+
+    # Keep-alive пул к GigaChat; соединений не больше, чем одновременных запросов
+    connector = aiohttp.TCPConnector(limit_per_host=CHAT_CONCURRENCY, keepalive_timeout=60)
+    timeout = aiohttp.ClientTimeout(
+        total=None,
+        sock_connect=core.HTTP_CONNECT_TIMEOUT,
+        sock_read=core.HTTP_READ_TIMEOUT,
+    )
+    _session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+
+    if core.PROXY_API:
+        _proxyapi_client = create_async_proxyapi_client(
+            api_key=core.PROXY_API,
+            base_url=core.PROXYAPI_BASE_URL,
+            pool_size=IMAGE_CONCURRENCY,
+            connect_timeout=core.HTTP_CONNECT_TIMEOUT,
+            read_timeout=core.IMAGE_READ_TIMEOUT,
+            max_retries=0,
+        )
+
+    print(f"🤖 Бот запущен (asyncio): до {CHAT_CONCURRENCY} запросов к GigaChat "
+          f"и {IMAGE_CONCURRENCY} генераций картинок одновременно")
+    print("Нажмите Ctrl+C для остановки")
+
+    try:
+        await bot.polling(non_stop=True)
+    finally:
+        await _drain(core.WEBHOOK_DRAIN_TIMEOUT)
+        await _session.close()
+        if _proxyapi_client:
+            await _proxyapi_client.close()
+        await bot.close_session()
+
+
+def run():
+    """Запускает асинхронный движок бота"""
+    asyncio.run(_run())
+
+
+def main():
+    """Основная функция для запуска бота в режиме asyncio"""
+    if not core.check_config():
+        return
+    # Эндпоинт метрик и сводка - те же, что у потокового движка (bot.main)
+    core.start_metrics()
+    run()
+
+
+if __name__ == "__main__":
+    main()
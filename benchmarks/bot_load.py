@@ -0,0 +1,267 @@
+"""
+Нагрузочный тест бота без сети
+Поднимает заглушки GigaChat, ProxyAPI и Telegram (fake_services.py), направляет
+на них bot.py и подаёт синтетические обновления Telegram с заданной частотой.
+Печатает время до первого ответа (p50/p95/p99), время до картинки, пропускную
+способность, рост памяти и сводку метрик стадий - для сравнения до и после
+изменений производительности
+
+Примеры:
+    python benchmarks/bot_load.py --scenario steady --rate 20 --duration 30
+    python benchmarks/bot_load.py --scenario burst --env PIPELINE_MODE=sequential
+    python benchmarks/bot_load.py --scenario flaky --json results.json
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from fake_services import FakeServices, Latency  # noqa: E402
+from webhook_harness import SAMPLE_QUESTIONS, make_update  # noqa: E402
+
+# Сценарии нагрузки: частота сообщений, пользователи и поведение сервисов
+SCENARIOS = {
+    # Равномерный поток разных вопросов от многих пользователей
+    "steady": {"rate": 10, "users": 50},
+    # Рассылка: все спрашивают одно и то же почти одновременно
+    "burst": {"rate": 100, "users": 200, "same_question": True},
+    # Пользователи пишут вопрос тремя сообщениями подряд
+    "chatty": {"rate": 10, "users": 30, "fragments": 3},
+    # Сбои и лимиты на стороне GigaChat и ProxyAPI
+    "flaky": {"rate": 10, "users": 50, "chat_errors": 0.1, "chat_throttle": 0.05,
+              "image_errors": 0.2},
+}
+
+# Пауза между частями вопроса в сценарии chatty, секунды
+FRAGMENT_GAP = 0.2
+
+
+def percentile(values, q):
+    """Квантиль q (0..1) методом ближайшего ранга"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(q * len(ordered)) - 1))]
+
+
+def rss_bytes():
+    """Текущий RSS процесса (Linux) или пиковый (остальные системы)"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+def build_schedule(scenario, duration, seed):
+    """Список (смещение от старта, обновление Telegram) в порядке отправки"""
+    rng = random.Random(seed)
+    rate, users = scenario["rate"], scenario["users"]
+    fragments = scenario.get("fragments", 1)
+    question = rng.choice(SAMPLE_QUESTIONS)
+
+    schedule = []
+    count = int(rate * duration)
+    for i in range(count):
+        start = i / rate
+        user_id = 100000 + i % users
+        text = question if scenario.get("same_question") else rng.choice(SAMPLE_QUESTIONS)
+        if fragments == 1:
+            schedule.append((start, make_update(user_id, text)))
+            continue
+        words = text.split()
+        size = max(1, -(-len(words) // fragments))
+        for j in range(0, len(words), size):
+            schedule.append((start + j // size * FRAGMENT_GAP,
+                             make_update(user_id, " ".join(words[j:j + size]))))
+    schedule.sort(key=lambda item: item[0])
+    return schedule
+
+
+def configure_environment(fake, extra_env, cache_dir):
+    """Переменные окружения bot.py: заглушки вместо сервисов, без реальных ключей"""
+    os.environ.update({
+        "TELEGRAM_BOT_TOKEN": "123456:BENCHMARK",
+        "GIGACHAT_AUTHORIZATION_KEY": "benchmark",
+        "PROXY_API": "benchmark",
+        "IMAGE_CACHE_DIR": cache_dir,
+        "HISTORY_BACKEND": "memory",
+        "METRICS_PORT": "0",
+    })
+    os.environ.update(fake.env())
+    os.environ.update(extra_env)
+
+
+def wait_for_quiet(fake, core, settle, timeout):
+    """Ждёт, пока бот перестанет отправлять сообщения и опустеют очереди"""
+    deadline = time.perf_counter() + timeout
+    last_count, last_change = -1, time.perf_counter()
+    while time.perf_counter() < deadline:
+        count = len(fake.sent)
+        busy = any(pool.stats()["active"] or pool.depth for pool in (core.chat_pool, core.image_pool))
+        if count != last_count or busy:
+            last_count, last_change = count, time.perf_counter()
+        elif time.perf_counter() - last_change >= settle:
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def match_replies(injected, sent):
+    """
+    Сопоставляет отправленные ботом сообщения вопросам пользователей
+    Возвращает {(chat_id, message_id): {"text": время, "photo": время}}
+    Сообщение без reply_to (картинка с подписью) относится к самому старому
+    ещё не отвеченному вопросу этого чата
+    """
+    replies = {key: {} for key in injected}
+    for message in sorted(sent, key=lambda m: m.sent_at):
+        kind = "photo" if message.method == "sendPhoto" else "text"
+        key = (message.chat_id, message.reply_to)
+        if message.reply_to is None or key not in replies:
+            waiting = [k for k in injected if k[0] == message.chat_id and kind not in replies[k]]
+            if not waiting:
+                continue
+            key = min(waiting, key=lambda k: injected[k])
+        replies[key].setdefault(kind, message.sent_at)
+        if kind == "photo":
+            # Картинка с подписью - это и первый ответ
+            replies[key].setdefault("text", message.sent_at)
+    return replies
+
+
+def run(args):
+    scenario = dict(SCENARIOS[args.scenario])
+    for key in ("rate", "users"):
+        if getattr(args, key) is not None:
+            scenario[key] = getattr(args, key)
+
+    fake = FakeServices(
+        gigachat=Latency(args.chat_latency, error_rate=scenario.get("chat_errors", 0.0),
+                         throttle_rate=scenario.get("chat_throttle", 0.0)),
+        images=Latency(args.image_latency, error_rate=scenario.get("image_errors", 0.0)),
+        telegram=Latency(args.telegram_latency),
+        image_size=args.image_size,
+    ).start()
+
+    extra_env = dict(item.split("=", 1) for item in args.env)
+    configure_environment(fake, extra_env, tempfile.mkdtemp(prefix="bench-images-"))
+
+    import telebot
+    telebot.apihelper.API_URL = fake.telegram_api_url()
+    import bot as core
+
+    schedule = build_schedule(scenario, args.duration, args.seed)
+    print(f"Сценарий {args.scenario}: {len(schedule)} сообщений от {scenario['users']} "
+          f"пользователей за {args.duration:.0f} с")
+
+    if args.tracemalloc:
+        tracemalloc.start()
+    rss_before = rss_bytes()
+
+    injected = {}
+    started = time.perf_counter()
+    for offset, update in schedule:
+        delay = started + offset - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        message = update["message"]
+        injected[(message["chat"]["id"], message["message_id"])] = time.perf_counter()
+        core.process_update_json(update)
+
+    quiet = wait_for_quiet(fake, core, args.settle, args.timeout)
+    finished = time.perf_counter()
+    rss_after = rss_bytes()
+    traced_peak = tracemalloc.get_traced_memory()[1] if args.tracemalloc else None
+
+    replies = match_replies(injected, list(fake.sent))
+    first_reply = [r["text"] - injected[k] for k, r in replies.items() if "text" in r]
+    to_photo = [r["photo"] - injected[k] for k, r in replies.items() if "photo" in r]
+    last_reply = max((r["text"] for r in replies.values() if "text" in r), default=finished)
+    photo_sizes = [m.size for m in fake.sent if m.method == "sendPhoto"]
+
+    result = {
+        "scenario": args.scenario,
+        "messages": len(injected),
+        "answered": len(first_reply),
+        "unanswered": len(injected) - len(first_reply),
+        "photos": len(to_photo),
+        "drained": quiet,
+        "throughput_mps": round(len(first_reply) / max(last_reply - started, 1e-9), 2),
+        "first_reply_ms": {f"p{int(q * 100)}": round(percentile(first_reply, q) * 1000, 1)
+                           for q in (0.5, 0.95, 0.99)},
+        "photo_ms": {f"p{int(q * 100)}": round(percentile(to_photo, q) * 1000, 1)
+                     for q in (0.5, 0.95, 0.99)},
+        "avg_photo_upload_bytes": round(sum(photo_sizes) / len(photo_sizes)) if photo_sizes else 0,
+        "rss_growth_bytes": rss_after - rss_before,
+        "traced_peak_bytes": traced_peak,
+        "upstream_requests": fake.requests,
+        "upstream_failures": fake.failures,
+        "stages": core.metrics.snapshot(),
+    }
+    fake.stop()
+    return result
+
+
+def print_report(result):
+    print()
+    print(f"Отвечено: {result['answered']} из {result['messages']} "
+          f"(без ответа: {result['unanswered']}, картинок: {result['photos']})"
+          + ("" if result["drained"] else " - очереди не опустели до таймаута"))
+    print(f"Пропускная способность: {result['throughput_mps']} сообщений/с")
+    first, photo = result["first_reply_ms"], result["photo_ms"]
+    print(f"Время до первого ответа: p50 {first['p50']} мс, p95 {first['p95']} мс, p99 {first['p99']} мс")
+    print(f"Время до картинки: p50 {photo['p50']} мс, p95 {photo['p95']} мс, p99 {photo['p99']} мс")
+    print(f"Средний размер загружаемой картинки: {result['avg_photo_upload_bytes'] / 1024:.0f} КБ")
+    print(f"Рост RSS: {result['rss_growth_bytes'] / 1024 / 1024:.1f} МБ"
+          + (f", пик tracemalloc: {result['traced_peak_bytes'] / 1024 / 1024:.1f} МБ"
+             if result["traced_peak_bytes"] is not None else ""))
+    print(f"Запросы к заглушкам: {result['upstream_requests']}")
+    if result["upstream_failures"]:
+        print(f"Из них сбоев: {result['upstream_failures']}")
+    print()
+    for stage, values in result["stages"].items():
+        print(f"  {stage:<18} {values['count']:>6} вызовов, среднее {values['avg'] * 1000:>7.0f} мс, "
+              f"p95 ≤ {values['p95'] * 1000:>6.0f} мс, ошибок {values['errors']:.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест бота на локальных заглушках")
+    parser.add_argument("--scenario", choices=sorted(SCENARIOS), default="steady")
+    parser.add_argument("--duration", type=float, default=10.0, help="сколько секунд подавать сообщения")
+    parser.add_argument("--rate", type=float, default=None, help="сообщений (вопросов) в секунду")
+    parser.add_argument("--users", type=int, default=None, help="число разных пользователей")
+    parser.add_argument("--chat-latency", type=float, default=0.8, help="медианная задержка GigaChat, с")
+    parser.add_argument("--image-latency", type=float, default=5.0, help="медианная задержка ProxyAPI, с")
+    parser.add_argument("--telegram-latency", type=float, default=0.05, help="медианная задержка Bot API, с")
+    parser.add_argument("--image-size", type=int, default=1024, help="сторона картинки ProxyAPI, пикселей")
+    parser.add_argument("--settle", type=float, default=2.0,
+                        help="сколько секунд тишины считать завершением обработки")
+    parser.add_argument("--timeout", type=float, default=120.0, help="сколько ждать обработки после подачи")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                        help="настройка bot.py (например PIPELINE_MODE=sequential)")
+    parser.add_argument("--tracemalloc", action="store_true", help="замерять пик выделенной памяти Python")
+    parser.add_argument("--json", help="сохранить результаты в файл для сравнения")
+    args = parser.parse_args()
+
+    result = run(args)
+    print_report(result)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"\nРезультаты сохранены в {args.json}")
+
+
+if __name__ == "__main__":
+    main()
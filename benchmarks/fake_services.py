@@ -0,0 +1,279 @@
+"""
+Локальные заглушки внешних сервисов для нагрузочных тестов
+Один HTTP-сервер отвечает за OAuth и chat/completions GigaChat, images/generations
+ProxyAPI и Bot API Telegram; задержки и ошибки задаются для каждого сервиса,
+а отправленные ботом сообщения записываются с временем отправки
+"""
+
+import json
+import math
+import random
+import struct
+import threading
+import time
+import zlib
+from base64 import b64encode
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs, urlsplit
+
+OAUTH_PATH = "/api/v2/oauth"
+CHAT_PATH = "/api/v1/chat/completions"
+IMAGES_PATH = "/openai/v1/images/generations"
+TELEGRAM_PREFIX = "/bot"
+
+SAMPLE_ANSWER = (
+    "Для небольшого офиса подойдёт лазерное МФУ с двусторонней печатью и Wi-Fi: "
+    "оно печатает до 30 страниц в минуту, сканирует в PDF и стоит около 25 000 рублей. "
+    "Если нужна цветная печать, посмотрите струйные модели с СНПЧ - они дешевле в обслуживании."
+)
+SAMPLE_IMAGE_PROMPT = "Современный светлый офис, на столе компактное лазерное МФУ, фотореализм"
+
+
+class Latency:
+    """
+    Распределение задержки сервиса: логнормальное с медианой median (сек)
+    и разбросом sigma; error_rate - доля ответов 500, throttle_rate - доля 429
+    """
+
+    def __init__(self, median: float = 0.0, sigma: float = 0.5, error_rate: float = 0.0,
+                 throttle_rate: float = 0.0):
+        self.median = median
+        self.sigma = sigma
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+
+    def sample(self) -> float:
+        if self.median <= 0:
+            return 0.0
+        return random.lognormvariate(math.log(self.median), self.sigma)
+
+    def failure(self) -> Optional[int]:
+        """HTTP-статус сбоя или None"""
+        roll = random.random()
+        if roll < self.error_rate:
+            return 500
+        if roll < self.error_rate + self.throttle_rate:
+            return 429
+        return None
+
+
+def make_png(width: int, height: int, seed: int = 0) -> bytes:
+    """PNG из шума (плохо сжимается, как фотография) без сторонних библиотек"""
+    rng = random.Random(seed)
+    row_bytes = width * 3
+    raw = b"".join(b"\x00" + rng.randbytes(row_bytes) for _ in range(height))
+
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return (struct.pack(">I", len(data)) + kind + data
+                + struct.pack(">I", zlib.crc32(kind + data) & 0xFFFFFFFF))
+
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header)
+            + chunk(b"IDAT", zlib.compress(raw, 1)) + chunk(b"IEND", b""))
+
+
+class SentMessage:
+    """Сообщение, отправленное ботом в заглушку Telegram"""
+
+    __slots__ = ("method", "chat_id", "reply_to", "sent_at", "size")
+
+    def __init__(self, method: str, chat_id: int, reply_to: Optional[int], sent_at: float,
+                 size: int):
+        self.method = method
+        self.chat_id = chat_id
+        self.reply_to = reply_to
+        self.sent_at = sent_at
+        self.size = size
+
+
+class FakeServices:
+    """
+    Заглушки GigaChat, ProxyAPI и Telegram на одном порту
+
+    gigachat / images / telegram - Latency соответствующих сервисов
+    image_size - сторона квадратной картинки, которую «генерирует» ProxyAPI
+    stream_chunks - на сколько фрагментов делится потоковый ответ GigaChat
+    """
+
+    def __init__(self, gigachat: Latency = None, images: Latency = None,
+                 telegram: Latency = None, image_size: int = 512, stream_chunks: int = 8,
+                 host: str = "127.0.0.1", port: int = 0):
+        self.gigachat = gigachat or Latency()
+        self.images = images or Latency()
+        self.telegram = telegram or Latency()
+        self.stream_chunks = stream_chunks
+        self.image_b64 = b64encode(make_png(image_size, image_size)).decode("ascii")
+
+        self.sent: List[SentMessage] = []
+        self.requests: Dict[str, int] = {}
+        self.failures: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._message_ids = iter(range(10 ** 6, 10 ** 9))
+
+        handler = type("FakeHandler", (_Handler,), {"services": self})
+        self.server = ThreadingHTTPServer((host, port), handler)
+        self.server.daemon_threads = True
+        self.host, self.port = self.server.server_address[:2]
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def env(self) -> Dict[str, str]:
+        """Переменные окружения, направляющие bot.py на заглушки"""
+        return {
+            "GIGACHAT_OAUTH_URL": self.base_url + OAUTH_PATH,
+            "GIGACHAT_CHAT_URL": self.base_url + CHAT_PATH,
+            "PROXYAPI_BASE_URL": self.base_url + "/openai/v1",
+        }
+
+    def telegram_api_url(self) -> str:
+        """Шаблон адреса Bot API для telebot.apihelper.API_URL"""
+        return self.base_url + TELEGRAM_PREFIX + "{0}/{1}"
+
+    def start(self) -> "FakeServices":
+        threading.Thread(target=self.server.serve_forever, name="fake-services",
+                         daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def count(self, route: str, failed: bool = False):
+        with self._lock:
+            self.requests[route] = self.requests.get(route, 0) + 1
+            if failed:
+                self.failures[route] = self.failures.get(route, 0) + 1
+
+    def record(self, message: SentMessage) -> int:
+        with self._lock:
+            self.sent.append(message)
+            return next(self._message_ids)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # keep-alive, как у настоящих API
+    protocol_version = "HTTP/1.1"
+    services: FakeServices = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        path = urlsplit(self.path).path
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if path == OAUTH_PATH:
+            self._upstream("oauth", self.services.gigachat, self._oauth)
+        elif path == CHAT_PATH:
+            self._upstream("chat", self.services.gigachat, self._chat, body)
+        elif path == IMAGES_PATH:
+            self._upstream("images", self.services.images, self._images)
+        elif path.startswith(TELEGRAM_PREFIX):
+            self._telegram(path.rsplit("/", 1)[-1], body)
+        else:
+            self._json(404, {"error": "not found"})
+
+    do_GET = do_POST
+
+    def _upstream(self, route: str, latency: Latency, respond, *args):
+        status = latency.failure()
+        self.services.count(route, failed=status is not None)
+        time.sleep(latency.sample())
+        if status == 429:
+            self._json(429, {"error": "rate limit"}, {"Retry-After": "1"})
+        elif status:
+            self._json(status, {"error": "upstream failure"})
+        else:
+            respond(*args)
+
+    def _oauth(self):
+        expires_at = int((time.time() + 30 * 60) * 1000)
+        self._json(200, {"access_token": "bench-token", "expires_at": expires_at})
+
+    def _chat(self, body: bytes):
+        payload = json.loads(body or b"{}")
+        system = " ".join(m.get("content", "") for m in payload.get("messages", [])
+                          if m.get("role") == "system")
+        if "image_prompt" in system.lower():
+            content = json.dumps({"answer": SAMPLE_ANSWER, "image_prompt": SAMPLE_IMAGE_PROMPT},
+                                 ensure_ascii=False)
+        elif "изображени" in system.lower():
+            content = SAMPLE_IMAGE_PROMPT
+        else:
+            content = SAMPLE_ANSWER
+        usage = {"prompt_tokens": len(body) // 4, "completion_tokens": len(content) // 3}
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+
+        if payload.get("stream"):
+            self._stream(content)
+            return
+        self._json(200, {
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content},
+                         "finish_reason": "stop"}],
+            "usage": usage,
+        })
+
+    def _stream(self, content: str):
+        """SSE-ответ: содержимое по частям, задержка уже выдержана до первого фрагмента"""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        parts = max(self.services.stream_chunks, 1)
+        step = math.ceil(len(content) / parts)
+        for i in range(0, len(content), step):
+            chunk = {"choices": [{"index": 0, "delta": {"content": content[i:i + step]}}]}
+            self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+            time.sleep(self.services.gigachat.sample() / parts)
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.close_connection = True
+
+    def _images(self):
+        self._json(200, {"created": int(time.time()), "data": [{"b64_json": self.services.image_b64}]})
+
+    def _telegram(self, method: str, body: bytes):
+        """Bot API: сообщения записываются, ответ - минимальный объект Message"""
+        latency = self.services.telegram
+        time.sleep(latency.sample())
+        params = {key: values[-1] for key, values in parse_qs(urlsplit(self.path).query).items()}
+        if self.headers.get("Content-Type", "").startswith("application/x-www-form-urlencoded"):
+            params.update({key: values[-1] for key, values in parse_qs(body.decode("utf-8")).items()})
+        self.services.count("telegram." + method)
+
+        if method in ("sendChatAction", "setWebhook", "deleteWebhook"):
+            self._json(200, {"ok": True, "result": True})
+            return
+
+        chat_id = int(params.get("chat_id", 0))
+        reply_to = params.get("reply_to_message_id")
+        if reply_to is None and "reply_parameters" in params:
+            reply_to = json.loads(params["reply_parameters"]).get("message_id")
+        message_id = int(params.get("message_id", 0))
+        if method != "editMessageText":
+            message_id = self.services.record(SentMessage(
+                method, chat_id, int(reply_to) if reply_to else None,
+                time.perf_counter(), len(body)))
+
+        result = {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "text": params.get("text", ""),
+        }
+        if method == "sendPhoto":
+            result["photo"] = [{"file_id": f"photo-{message_id}", "file_unique_id": f"u{message_id}",
+                                "width": 512, "height": 512}]
+        self._json(200, {"ok": True, "result": result})
+
+    def _json(self, status: int, data: dict, headers: Optional[Dict[str, str]] = None):
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
@@ -0,0 +1,109 @@
+"""
+Память и время создания продуктов каталога
+Сравнивает компактный main.Product (__slots__, время создания в секундах Unix,
+интернированные категории) с прежним классом на __dict__ и datetime: сколько
+байт занимает один продукт и сколько секунд уходит на миллион продуктов
+
+Примеры:
+    python benchmarks/product_memory.py
+    python benchmarks/product_memory.py --count 200000 --store
+"""
+
+import argparse
+import gc
+import os
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from main import Product, Store  # noqa: E402
+
+CATEGORIES = ["Принтеры", "МФУ", "Сканеры", "Копиры", "Шредеры", "Проекторы", "Расходники"]
+
+
+class LegacyProduct:
+    """Product до перехода на __slots__ (для сравнения)"""
+
+    def __init__(self, name: str, price: float, category: str = "Общее", specs: str = ""):
+        self.name = name
+        self._price = price
+        self._category = category
+        self.specs = specs
+        self.created_at = datetime.now()
+        self._catalog = None
+        self._row = -1
+
+
+def make_rows(count):
+    """Исходные данные как после разбора файла: у каждой строки своя копия категории"""
+    return [(f"Товар {i}", float(1000 + i % 50000), "".join(CATEGORIES[i % len(CATEGORIES)]), "")
+            for i in range(count)]
+
+
+def measure(factory, rows):
+    """Байт на продукт при создании продуктов из rows"""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    products = [factory(*row) for row in rows]
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del products
+    return used / len(rows)
+
+
+def construct(factory, rows):
+    """Секунд на создание продуктов из rows (сборщик мусора отключён, как в timeit)"""
+    gc.collect()
+    gc.disable()
+    started = time.perf_counter()
+    products = [factory(*row) for row in rows]
+    elapsed = time.perf_counter() - started
+    gc.enable()
+    del products
+    return elapsed
+
+
+def measure_store(rows):
+    """Секунд на создание продуктов и добавление их в Store"""
+    store = Store("Бенчмарк")
+    started = time.perf_counter()
+    for name, price, category, specs in rows:
+        store.add_product(Product(name, price, category, specs), verbose=False)
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Память и время создания продуктов")
+    parser.add_argument("--count", type=int, default=1_000_000, help="сколько продуктов создавать")
+    parser.add_argument("--repeat", type=int, default=3, help="сколько раз замерять время (берётся лучшее)")
+    parser.add_argument("--store", action="store_true", help="замерить и добавление в Store")
+    args = parser.parse_args()
+
+    rows = make_rows(args.count)
+    scale = 1_000_000 / args.count
+    print(f"Продуктов: {args.count}")
+
+    # Время замеряется отдельно от tracemalloc, который замедляет выделение памяти
+    results = {}
+    for label, factory in (("прежний", LegacyProduct), ("компактный", Product)):
+        size = measure(factory, rows)
+        elapsed = min(construct(factory, rows) for _ in range(args.repeat))
+        results[label] = (size, elapsed)
+        print(f"  {label:<11} {size:>6.0f} байт на продукт, "
+              f"{size * 1_000_000 / 1024 / 1024:>6.0f} МБ и {elapsed * scale:>5.2f} с на миллион")
+
+    (old_size, old_time), (new_size, new_time) = results["прежний"], results["компактный"]
+    print(f"Память: в {old_size / new_size:.1f} раза меньше, создание: в {old_time / new_time:.1f} раза быстрее")
+
+    if args.store:
+        elapsed = measure_store(rows)
+        print(f"Создание и добавление в Store: {elapsed * scale:.2f} с на миллион")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+Потоковая статистика против функций simple_example
+Сравнивает время и пик памяти: среднее и min/max по списку (calculate_average,
+find_max_min) против RunningStats по генератору и по массиву NumPy, квантили
+сортировкой против QuantileSketch, подсчёт слов чтением файла целиком
+(count_words) против count_words_in_file. Результаты сверяются между собой
+
+Примеры:
+    python benchmarks/stream_stats.py
+    python benchmarks/stream_stats.py --count 10000000 --text-mb 200
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from simple_example import calculate_average, count_words, find_max_min  # noqa: E402
+from stream_stats import (QuantileSketch, RunningStats, count_words_in_file,  # noqa: E402
+                          np)
+
+QUANTILES = (0.5, 0.9, 0.99)
+WORDS = ["принтер", "МФУ", "картридж", "лазерный", "A4", "Wi-Fi", "цена", "офис", "скидка"]
+
+
+# Размер пула заранее сгенерированных цен (генерация случайных чисел не должна
+# занимать большую часть замера)
+PRICE_POOL = 100003
+
+
+def price_pool(seed):
+    """Цены продаж: логнормальное распределение, как у реального чека"""
+    rng = random.Random(seed)
+    return [round(rng.lognormvariate(8, 1.2), 2) for _ in range(PRICE_POOL)]
+
+
+def prices(pool, count):
+    """Поток из count цен по кругу из пула"""
+    return (pool[i % PRICE_POOL] for i in range(count))
+
+
+def measure(label, fn):
+    """
+    Печатает время fn и пик выделенной памяти, возвращает результат
+    Время и память замеряются разными запусками: tracemalloc сильно замедляет выделение памяти
+    """
+    started = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - started
+    tracemalloc.start()
+    fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print(f"  {label:<38} {elapsed:>7.2f} с, пик памяти {peak / 1024 / 1024:>8.1f} МБ")
+    return result
+
+
+def list_summary(pool, count):
+    numbers = list(prices(pool, count))
+    return calculate_average(numbers), find_max_min(numbers)
+
+
+def list_quantiles(pool, count):
+    ordered = sorted(prices(pool, count))
+    return [ordered[int(q * (len(ordered) - 1))] for q in QUANTILES]
+
+
+def write_text(path, megabytes, seed):
+    rng = random.Random(seed)
+    line_words = 12
+    with open(path, "w", encoding="utf-8") as f:
+        while f.tell() < megabytes * 1024 * 1024:
+            f.write("\n".join(" ".join(rng.choices(WORDS, k=line_words)) for _ in range(1000)) + "\n")
+
+
+def read_and_count(path):
+    with open(path, encoding="utf-8") as f:
+        return count_words(f.read())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Потоковая статистика против simple_example")
+    parser.add_argument("--count", type=int, default=2_000_000, help="сколько цен в потоке")
+    parser.add_argument("--text-mb", type=int, default=50, help="размер текстового файла, МБ")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    count, seed = args.count, args.seed
+    pool = price_pool(seed)
+
+    print(f"Среднее и min/max, {count} цен:")
+    average, (maximum, minimum) = measure("calculate_average + find_max_min",
+                                          lambda: list_summary(pool, count))
+    stats = measure("RunningStats (генератор)", lambda: RunningStats(prices(pool, count)))
+    print(f"  расхождение среднего: {abs(stats.mean - average) / average:.1e}, "
+          f"совпадение min/max: {(stats.minimum, stats.maximum) == (minimum, maximum)}")
+    if np is not None:
+        array = np.fromiter(prices(pool, count), dtype=np.float64, count=count)
+        vector = measure("RunningStats (массив NumPy)", lambda: RunningStats(array))
+        print(f"  расхождение среднего NumPy: {abs(vector.mean - average) / average:.1e}")
+
+    print(f"\nКвантили {', '.join(map(str, QUANTILES))}:")
+    exact = measure("sorted", lambda: list_quantiles(pool, count))
+    sketch = measure("QuantileSketch (1%, генератор)", lambda: QuantileSketch(0.01, prices(pool, count)))
+    if np is not None:
+        vector_sketch = measure("QuantileSketch (1%, массив NumPy)", lambda: QuantileSketch(0.01, array))
+        print(f"  совпадение с генератором: {vector_sketch.quantiles(QUANTILES) == sketch.quantiles(QUANTILES)}")
+    errors = [abs(estimate - value) / value for estimate, value in zip(sketch.quantiles(QUANTILES), exact)]
+    print(f"  наибольшая относительная ошибка: {max(errors):.2%}, корзин: {sketch.buckets}")
+
+    print(f"\nПодсчёт слов, файл {args.text_mb} МБ:")
+    path = os.path.join(tempfile.mkdtemp(prefix="bench-words-"), "text.txt")
+    write_text(path, args.text_mb, seed)
+    try:
+        whole = measure("count_words(f.read())", lambda: read_and_count(path))
+        chunked = measure("count_words_in_file", lambda: count_words_in_file(path))
+        print(f"  совпадение: {whole == chunked} ({chunked} слов)")
+    finally:
+        os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,19 +4,61 @@ Telegram бот с интеграцией GigaChat AI
 """
 
 import os
+import re
+import signal
+import sys
+import time
+import json
+import atexit
 import uuid
 import base64
+import contextvars
+import threading
 import requests
+from concurrent.futures import ThreadPoolExecutor
 import urllib3
 import telebot
 from io import BytesIO
-from openai import OpenAI
 from dotenv import load_dotenv
+from openai import APIConnectionError
+
+from catalog_io import load_store
+from coalescer import MessageCoalescer
+from gigachat_auth import GigaChatTokenManager
+from history_compactor import HistoryCompactor, extractive_summary
+from history_store import ConversationStore, SQLiteConversationStore
+from image_cache import CachedImage, ImageCache, detect_category
+from image_postprocess import ImagePostprocessor, decode_b64
+from intent_classifier import ImageIntentClassifier
+from main import Store
+from metrics import Metrics, start_metrics_server, start_periodic_dump
+from resilience import CircuitBreaker, TokenBucket, UpstreamPolicy, UpstreamUnavailable, upstream_status
+from response_cache import ResponseCache
+from retrieval import CatalogIndex
+from scheduler import PRIORITY_BACKGROUND, PoolClosed, QueueFull, WorkerPool
+from singleflight import SingleFlight, fingerprint
+from streaming import STREAM_DONE, TELEGRAM_MESSAGE_LIMIT, EditThrottle, parse_sse_line
+from transport import HttpTransport, create_proxyapi_client
+from webhook import WebhookServer
+
+# При запуске «python bot.py» модуль называется __main__; async_bot делает
+# «import bot», и без этой строки bot.py загрузился бы второй раз - со вторым
+# ботом, пулами, хранилищами и метриками
+if __name__ == "__main__":
+    sys.modules.setdefault("bot", sys.modules[__name__])
 
 # Отключаем предупреждения о небезопасных SSL запросах
 # (GigaChat API использует самоподписанный сертификат)
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
+def env_flag(name, default=False):
+    """Читает логический флаг из переменной окружения (1/true/yes/on)"""
+    value = os.getenv(name)
+    if value is None or not value.strip():
+        return default
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+
 # Загружаем переменные окружения из .env файла
 # Используем явный путь для надежности
 env_path = os.path.join(os.path.dirname(__file__), '.env')
@@ -35,26 +77,280 @@ GIGACHAT_CLIENT_SECRET = os.getenv('GIGACHAT_CLIENT_SECRET', '').strip()
 # Получаем ключ ProxyAPI для генерации изображений
 PROXY_API = os.getenv('PROXY_API', '').strip()
 
+# Способ получения обновлений: polling (long polling) или webhook (см. webhook.py)
+BOT_INGESTION = os.getenv('BOT_INGESTION', 'polling').strip().lower()
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '').strip()
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8080'))
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/telegram/webhook')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '').strip()
+WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', '8'))
+WEBHOOK_QUEUE_SIZE = int(os.getenv('WEBHOOK_QUEUE_SIZE', '1000'))
+WEBHOOK_DRAIN_TIMEOUT = float(os.getenv('WEBHOOK_DRAIN_TIMEOUT', '30'))
+
 # Инициализация бота
-bot = telebot.TeleBot(TELEGRAM_BOT_TOKEN)
+# В режиме webhook обработчики выполняются прямо в рабочих потоках WebhookServer,
+# поэтому собственный пул потоков telebot не нужен
+bot = telebot.TeleBot(TELEGRAM_BOT_TOKEN, threaded=BOT_INGESTION != 'webhook')
+
+# Обновлять токен GigaChat в фоне за столько секунд до истечения
+GIGACHAT_TOKEN_REFRESH_AHEAD = int(os.getenv('GIGACHAT_TOKEN_REFRESH_AHEAD', '300'))
+
+# Настройки HTTP-транспорта (пулы keep-alive соединений)
+HTTP_POOL_SIZE = int(os.getenv('HTTP_POOL_SIZE', '10'))
+HTTP_CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', '5'))
+HTTP_READ_TIMEOUT = float(os.getenv('HTTP_READ_TIMEOUT', '60'))
+IMAGE_READ_TIMEOUT = float(os.getenv('IMAGE_READ_TIMEOUT', '120'))
+
+# Общий пул HTTP-сессий для GigaChat (OAuth и chat/completions)
+http = HttpTransport(
+    pool_size=HTTP_POOL_SIZE,
+    connect_timeout=HTTP_CONNECT_TIMEOUT,
+    read_timeout=HTTP_READ_TIMEOUT,
+)
+
+# Адреса API (переопределяются для локальных заглушек, см. benchmarks/)
+GIGACHAT_OAUTH_URL = os.getenv('GIGACHAT_OAUTH_URL', "https://ngw.devices.sberbank.ru:9443/api/v2/oauth")
+GIGACHAT_CHAT_URL = os.getenv('GIGACHAT_CHAT_URL', "https://gigachat.devices.sberbank.ru/api/v1/chat/completions")
+PROXYAPI_BASE_URL = os.getenv('PROXYAPI_BASE_URL', "https://api.proxyapi.ru/openai/v1")
+
+# Долгоживущий клиент ProxyAPI (создаётся один раз, если указан ключ)
+proxyapi_client = None
+if PROXY_API:
+    proxyapi_client = create_proxyapi_client(
+        api_key=PROXY_API,
+        base_url=PROXYAPI_BASE_URL,
+        pool_size=HTTP_POOL_SIZE,
+        connect_timeout=HTTP_CONNECT_TIMEOUT,
+        read_timeout=IMAGE_READ_TIMEOUT,
+        # Повторы выполняет image_policy (см. ниже), клиент не повторяет сам
+        max_retries=0,
+    )
+
+# Режим обработки сообщений:
+# pipelined - текст отправляется сразу, картинка догоняет отдельным сообщением
+# sequential - ответ и картинка отправляются одним сообщением после генерации
+PIPELINE_MODE = os.getenv('PIPELINE_MODE', 'pipelined').strip().lower()
+LLM_WORKERS = int(os.getenv('LLM_WORKERS', '8'))
+IMAGE_WORKERS = int(os.getenv('IMAGE_WORKERS', '4'))
+# Пул ответов на сообщения и ограничения очередей: переполненная очередь ответов
+# отклоняет вопрос с просьбой повторить позже, при глубокой очереди картинок
+# бот отвечает только текстом
+CHAT_WORKERS = int(os.getenv('CHAT_WORKERS', '16'))
+CHAT_QUEUE_LIMIT = int(os.getenv('CHAT_QUEUE_LIMIT', '1000'))
+CHAT_QUEUE_PER_USER = int(os.getenv('CHAT_QUEUE_PER_USER', '5'))
+IMAGE_QUEUE_LIMIT = int(os.getenv('IMAGE_QUEUE_LIMIT', '20'))
+
+# Потоковые ответы (только в режиме pipelined): сообщение-заглушка правится
+# по мере генерации, но не чаще раза в STREAM_EDIT_INTERVAL секунд
+STREAM_REPLIES = env_flag('STREAM_REPLIES', False)
+STREAM_EDIT_INTERVAL = float(os.getenv('STREAM_EDIT_INTERVAL', '1.0'))
+STREAM_PLACEHOLDER = "💭 Печатаю ответ..."
 
-# Кеш для токена доступа GigaChat
-_access_token = None
+# Совмещённый запрос: ответ и описание картинки одним вызовом GigaChat
+# (если ответ не удалось разобрать - два отдельных запроса, как раньше)
+COMBINED_COMPLETION = env_flag('COMBINED_COMPLETION', True)
+
+# Пулы с отдельными очередями: ответы на сообщения и генерация картинок;
+# задачи берутся по кругу между пользователями, чтобы поток сообщений одного
+# клиента не задерживал остальных, а долгие картинки не задерживали ответы
+chat_pool = WorkerPool('chat', CHAT_WORKERS, max_depth=CHAT_QUEUE_LIMIT,
+                       max_per_user=CHAT_QUEUE_PER_USER)
+image_pool = WorkerPool('image', IMAGE_WORKERS, max_depth=IMAGE_QUEUE_LIMIT)
+# Вспомогательные запросы к GigaChat параллельно с ответом (промпт картинки)
+llm_executor = ThreadPoolExecutor(max_workers=LLM_WORKERS, thread_name_prefix='llm')
+
+# Политика запросов к внешним API: лимит частоты (token bucket), повторы 429/5xx
+# и сетевых ошибок с джиттером в пределах бюджета времени, дублирующий запрос
+# для медленных ответов GigaChat и автоматический выключатель: после серии
+# сбоев запросы не отправляются CIRCUIT_RESET_TIMEOUT секунд, бот сразу
+# отвечает текстом без картинки (или сообщением об ошибке GigaChat)
+GIGACHAT_RPS = float(os.getenv('GIGACHAT_RPS', '10'))
+PROXYAPI_RPS = float(os.getenv('PROXYAPI_RPS', '1'))
+UPSTREAM_MAX_ATTEMPTS = int(os.getenv('UPSTREAM_MAX_ATTEMPTS', '3'))
+GIGACHAT_LATENCY_BUDGET = float(os.getenv('GIGACHAT_LATENCY_BUDGET', '30'))
+IMAGE_LATENCY_BUDGET = float(os.getenv('IMAGE_LATENCY_BUDGET', '180'))
+GIGACHAT_HEDGE_AFTER = float(os.getenv('GIGACHAT_HEDGE_AFTER', '0'))
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv('CIRCUIT_FAILURE_THRESHOLD', '5'))
+CIRCUIT_RESET_TIMEOUT = float(os.getenv('CIRCUIT_RESET_TIMEOUT', '30'))
+
+gigachat_policy = UpstreamPolicy(
+    'GigaChat',
+    TokenBucket(GIGACHAT_RPS, burst=max(int(GIGACHAT_RPS), 1) * 2),
+    CircuitBreaker(CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_RESET_TIMEOUT),
+    transient_errors=(requests.exceptions.ConnectionError, requests.exceptions.Timeout),
+    max_attempts=UPSTREAM_MAX_ATTEMPTS,
+    budget=GIGACHAT_LATENCY_BUDGET,
+    hedge_after=GIGACHAT_HEDGE_AFTER,
+)
+# Картинки дорогие и долгие: не дублируем и повторяем не больше одного раза
+image_policy = UpstreamPolicy(
+    'ProxyAPI',
+    TokenBucket(PROXYAPI_RPS, burst=IMAGE_WORKERS),
+    CircuitBreaker(CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_RESET_TIMEOUT),
+    transient_errors=(APIConnectionError,),
+    max_attempts=min(UPSTREAM_MAX_ATTEMPTS, 2),
+    base_delay=2.0,
+    max_delay=10.0,
+    budget=IMAGE_LATENCY_BUDGET,
+)
+
+# Ошибки запроса к GigaChat, после которых пользователь получает ERROR_ANSWER
+GIGACHAT_ERRORS = (requests.exceptions.RequestException, UpstreamUnavailable)
+
+# Метрики стадий конвейера: HTTP-эндпоинт в формате Prometheus (METRICS_PORT=0 -
+# отключить), периодическая сводка в лог и трассировка стадий каждого сообщения
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))
+METRICS_DUMP_INTERVAL = float(os.getenv('METRICS_DUMP_INTERVAL', '0'))
+METRICS_TRACE = env_flag('METRICS_TRACE', False)
+
+metrics = Metrics(trace=METRICS_TRACE)
+
+# Склейка сообщений: сообщения пользователя с паузой меньше окна объединяются
+# в один вопрос (COALESCE_WINDOW_MS=0 - отвечать на каждое сообщение сразу)
+COALESCE_WINDOW_MS = int(os.getenv('COALESCE_WINDOW_MS', '600'))
+COALESCE_MAX_DELAY_MS = int(os.getenv('COALESCE_MAX_DELAY_MS', '3000'))
+
+# Движок бота: threads (telebot.TeleBot, по умолчанию) или asyncio (см. async_bot.py)
+BOT_RUNTIME = os.getenv('BOT_RUNTIME', 'threads').strip().lower()
+
+MAX_HISTORY_MESSAGES = int(os.getenv('HISTORY_MAX_MESSAGES', '10'))  # Максимальное количество сообщений в истории
+# Бюджет токенов истории в запросе к GigaChat: старые сообщения сверх бюджета
+# сворачиваются в краткое содержание (HISTORY_TOKEN_BUDGET=0 - отключить)
+HISTORY_TOKEN_BUDGET = int(os.getenv('HISTORY_TOKEN_BUDGET', '1500'))
+HISTORY_SUMMARY_TOKENS = int(os.getenv('HISTORY_SUMMARY_TOKENS', '300'))
+# Ограничения хранилища истории: число пользователей, время хранения (сек) и объём (байт)
+HISTORY_MAX_USERS = int(os.getenv('HISTORY_MAX_USERS', '10000'))
+HISTORY_TTL = float(os.getenv('HISTORY_TTL', str(24 * 60 * 60)))
+HISTORY_MAX_BYTES = int(os.getenv('HISTORY_MAX_BYTES', str(64 * 1024 * 1024)))
+
+# Где хранить историю: memory (в памяти процесса) или sqlite (общий файл для
+# нескольких процессов бота, переживает перезапуск)
+HISTORY_BACKEND = os.getenv('HISTORY_BACKEND', 'memory').strip().lower()
+HISTORY_DB_PATH = os.getenv('HISTORY_DB_PATH', os.path.join(os.path.dirname(__file__), 'history.db'))
 
 # Хранилище истории сообщений для каждого пользователя
-# Формат: {user_id: [{"role": "user", "content": "..."}, {"role": "assistant", "content": "..."}, ...]}
-user_history = {}
-MAX_HISTORY_MESSAGES = 10  # Максимальное количество сообщений в истории
+if HISTORY_BACKEND == 'sqlite':
+    user_history = SQLiteConversationStore(
+        HISTORY_DB_PATH,
+        max_messages=MAX_HISTORY_MESSAGES,
+        ttl=HISTORY_TTL,
+    )
+else:
+    # Давно неактивные пользователи вытесняются, память не растёт бесконечно
+    user_history = ConversationStore(
+        max_messages=MAX_HISTORY_MESSAGES,
+        max_users=HISTORY_MAX_USERS,
+        ttl=HISTORY_TTL,
+        max_bytes=HISTORY_MAX_BYTES,
+    )
+# Несброшенные записи истории сохраняются при выходе
+atexit.register(user_history.close)
 
+# Краткое содержание старой части диалогов (создаётся ниже, после функций GigaChat)
+history_compactor = None
 
-def get_gigachat_access_token():
+# Кеш сгенерированных картинок на диске (IMAGE_CACHE_MAX_MB=0 - отключить)
+IMAGE_CACHE_DIR = os.getenv('IMAGE_CACHE_DIR', os.path.join(os.path.dirname(__file__), 'image_cache'))
+IMAGE_CACHE_MAX_MB = int(os.getenv('IMAGE_CACHE_MAX_MB', '500'))
+# Переиспользовать картинку любой модели той же категории (принтер, МФУ, сканер...);
+# выключено по умолчанию: на категорию запоминается одна первая картинка без срока
+# жизни, и все вопросы о категории получают её независимо от модели
+IMAGE_CACHE_BY_CATEGORY = env_flag('IMAGE_CACHE_BY_CATEGORY', False)
+
+image_cache = None
+if IMAGE_CACHE_MAX_MB > 0:
+    image_cache = ImageCache(IMAGE_CACHE_DIR, max_bytes=IMAGE_CACHE_MAX_MB * 1024 * 1024)
+
+# Пережатие сгенерированных картинок перед отправкой (нужен Pillow):
+# уменьшение до IMAGE_MAX_SIDE пикселей и JPEG/WebP вместо PNG
+IMAGE_POSTPROCESS = env_flag('IMAGE_POSTPROCESS', True)
+IMAGE_MAX_SIDE = int(os.getenv('IMAGE_MAX_SIDE', '1280'))
+IMAGE_FORMAT = os.getenv('IMAGE_FORMAT', 'jpeg').strip().lower()
+IMAGE_QUALITY = int(os.getenv('IMAGE_QUALITY', '85'))
+
+image_postprocessor = None
+if IMAGE_POSTPROCESS:
+    image_postprocessor = ImagePostprocessor(
+        max_side=IMAGE_MAX_SIDE,
+        image_format=IMAGE_FORMAT,
+        quality=IMAGE_QUALITY,
+    )
+    if not image_postprocessor.available:
+        print("⚠️  Pillow не установлен: картинки отправляются без пережатия")
+        image_postprocessor = None
+
+# Локальный классификатор: генерировать картинку только когда она что-то добавляет
+# (не для "спасибо", вопросов о доставке, гарантии и т.п.)
+IMAGE_INTENT_FILTER = env_flag('IMAGE_INTENT_FILTER', True)
+IMAGE_INTENT_THRESHOLD = float(os.getenv('IMAGE_INTENT_THRESHOLD', '0.5'))
+
+image_intent = None
+if IMAGE_INTENT_FILTER:
+    image_intent = ImageIntentClassifier(threshold=IMAGE_INTENT_THRESHOLD)
+
+# Кеш ответов на повторяющиеся вопросы (RESPONSE_CACHE_SIZE=0 - отключить)
+RESPONSE_CACHE_SIZE = int(os.getenv('RESPONSE_CACHE_SIZE', '1000'))
+RESPONSE_CACHE_TTL = float(os.getenv('RESPONSE_CACHE_TTL', '3600'))
+RESPONSE_CACHE_THRESHOLD = float(os.getenv('RESPONSE_CACHE_THRESHOLD', '0.95'))
+
+response_cache = None
+if RESPONSE_CACHE_SIZE > 0:
+    response_cache = ResponseCache(
+        max_entries=RESPONSE_CACHE_SIZE,
+        ttl=RESPONSE_CACHE_TTL,
+        threshold=RESPONSE_CACHE_THRESHOLD,
+    )
+
+
+# Каталог товаров (CSV или JSONL с полями name, price, category, specs либо снимок
+# .snap из catalog_io.py): подходящие к вопросу товары с актуальными ценами
+# добавляются в system prompt
+CATALOG_PATH = os.getenv('CATALOG_PATH', '').strip()
+CATALOG_TOP_K = int(os.getenv('CATALOG_TOP_K', '5'))
+
+
+def product_fields(product):
+    """Тексты товара для поискового индекса"""
+    return {"name": product.name, "category": product.category, "specs": product.specs}
+
+
+catalog_store = None
+catalog_index = None
+if CATALOG_PATH:
+    catalog_store = load_store(CATALOG_PATH, Store("Каталог"))
+    # Индекс подписан на магазин и обновляется при изменениях ассортимента
+    catalog_index = CatalogIndex(product_fields)
+    catalog_store.watch(catalog_index)
+    print(f"✓ Каталог загружен: {len(catalog_store.products)} товаров")
+
+
+# Одновременные одинаковые запросы к GigaChat и ProxyAPI выполняются один раз,
+# результат получают все ожидающие (SINGLE_FLIGHT=false - отключить)
+SINGLE_FLIGHT = env_flag('SINGLE_FLIGHT', True)
+inflight = SingleFlight() if SINGLE_FLIGHT else None
+
+
+def submit_llm(fn, *args):
+    """Запускает вспомогательный запрос в llm_executor в контексте текущего сообщения (трассировка)"""
+    return llm_executor.submit(contextvars.copy_context().run, fn, *args)
+
+
+def deduplicate(kind, fn, *args):
+    """Выполняет запрос fn(*args), присоединяясь к такому же уже выполняющемуся"""
+    if not inflight:
+        return fn(*args)
+    return inflight.do(kind, fingerprint(*args), fn, *args)
+
+
+@metrics.timed('gigachat_token')
+def _request_gigachat_access_token():
     """
-    Получает Access token для работы с GigaChat API
-    Токен действителен 30 минут
+    Запрашивает новый Access token у OAuth-сервера GigaChat
+    Возвращает (token, expires_at) или None при ошибке
     """
-    global _access_token
-    
-    url = "https://ngw.devices.sberbank.ru:9443/api/v2/oauth"
+    url = GIGACHAT_OAUTH_URL
     
     # Генерируем уникальный идентификатор запроса
     rq_uid = str(uuid.uuid4())
@@ -95,14 +391,22 @@ def get_gigachat_access_token():
         # Отключаем проверку SSL сертификата для GigaChat API
         # (сервер использует самоподписанный сертификат)
         # Используем data=payload для form-urlencoded формата
-        response = requests.post(url, headers=headers, data=payload, verify=False)
+        response = http.post(url, headers=headers, data=payload, verify=False)
         response.raise_for_status()
         
         token_data = response.json()
-        _access_token = token_data.get('access_token')
+        access_token = token_data.get('access_token')
+        if not access_token:
+            print("❌ Ошибка: в ответе GigaChat нет access_token")
+            return None
+        
+        # expires_at приходит в миллисекундах
+        expires_at = token_data.get('expires_at')
+        if expires_at:
+            expires_at = expires_at / 1000
         
         print(f"✓ Токен GigaChat получен успешно")
-        return _access_token
+        return access_token, expires_at
         
     except requests.exceptions.RequestException as e:
         print(f"❌ Ошибка при получении токена GigaChat: {e}")
@@ -111,27 +415,34 @@ def get_gigachat_access_token():
         return None
 
 
-def ask_gigachat(question, message_history=None):
+# Кеш для токена доступа GigaChat (общий для всех запросов)
+token_manager = GigaChatTokenManager(
+    _request_gigachat_access_token,
+    refresh_ahead=GIGACHAT_TOKEN_REFRESH_AHEAD,
+)
+
+
+def get_gigachat_access_token():
     """
-    Отправляет вопрос в GigaChat и получает ответ
-    message_history - список предыдущих сообщений для контекста
+    Возвращает Access token для работы с GigaChat API
+    Токен действителен 30 минут и берётся из кеша, пока не истечёт
     """
-    # Получаем токен доступа
-    access_token = get_gigachat_access_token()
-    
-    if not access_token:
-        return "❌ Не удалось получить доступ к GigaChat API. Проверьте настройки."
-    
-    url = "https://gigachat.devices.sberbank.ru/api/v1/chat/completions"
-    
-    headers = {
-        'Accept': 'application/json',
-        'Authorization': f'Bearer {access_token}',
-        'Content-Type': 'application/json'
-    }
-    
-    # System prompt для роли менеджера по продажам офисной техники
-    system_prompt = """Ты профессиональный менеджер по продажам офисной техники. Твоя задача - помогать клиентам выбрать подходящую офисную технику, консультировать по характеристикам, ценам и условиям покупки.
+    return token_manager.get_token()
+
+
+def refreshed_token(error, access_token):
+    """
+    Новый токен после ответа 401 на запрос с access_token (старый токен уже сброшен
+    через token_manager.invalidate); None - ошибка другая или нового токена нет
+    """
+    if upstream_status(error) != 401:
+        return None
+    fresh_token = get_gigachat_access_token()
+    return fresh_token if fresh_token and fresh_token != access_token else None
+
+
+# System prompt для роли менеджера по продажам офисной техники
+SALES_SYSTEM_PROMPT = """Ты профессиональный менеджер по продажам офисной техники. Твоя задача - помогать клиентам выбрать подходящую офисную технику, консультировать по характеристикам, ценам и условиям покупки.
 
 Твои основные обязанности:
 - Вежливо и профессионально общаться с клиентами
@@ -143,29 +454,83 @@ def ask_gigachat(question, message_history=None):
 - Быть дружелюбным, внимательным и готовым помочь
 
 Общайся вежливо, используй профессиональную, но понятную терминологию. Задавай уточняющие вопросы, чтобы лучше понять потребности клиента."""
-    
-    # Формируем список сообщений с историей
-    messages = []
-    
-    # Добавляем system prompt только если его нет в истории
-    # Проверяем, есть ли уже system prompt в истории
-    has_system = False
-    if message_history:
-        for msg in message_history:
-            if msg.get("role") == "system":
-                has_system = True
-                break
-    
-    # Добавляем system prompt, если его нет
-    if not has_system:
-        messages.append({
-            "role": "system",
-            "content": system_prompt
-        })
-    
-    if message_history:
-        # Добавляем историю сообщений
-        messages.extend(message_history)
+
+# System prompt для генерации промпта изображения с учетом роли менеджера по продажам
+IMAGE_SYSTEM_PROMPT = """Ты помощник менеджера по продажам офисной техники. Твоя задача - создавать детальные и художественные описания для генерации изображений офисной техники или рабочих мест.
+
+Создай краткое, но детальное описание изображения на основе вопроса клиента о офисной технике. Описание должно быть на английском языке, содержать детали визуального стиля, композиции, цветов и настроения. 
+
+Если вопрос касается офисной техники (принтеры, сканеры, МФУ и т.д.), создай описание, которое покажет эту технику в профессиональном офисном контексте. Ответ должен быть только описанием изображения, без дополнительных комментариев."""
+
+# Ответы пользователю при ошибках GigaChat
+NO_ACCESS_ANSWER = "❌ Не удалось получить доступ к GigaChat API. Проверьте настройки."
+BAD_FORMAT_ANSWER = "❌ Неожиданный формат ответа от GigaChat API"
+ERROR_ANSWER = "❌ Произошла ошибка при обращении к GigaChat API. Попробуйте позже."
+BUSY_ANSWER = "⏳ Сейчас очень много вопросов. Пожалуйста, повторите свой вопрос через минуту."
+# Ответы совмещённого запроса при сбое API: описание картинки к ним не запрашивается
+COMBINED_FAILURE_ANSWERS = (NO_ACCESS_ANSWER, ERROR_ANSWER)
+
+
+def gigachat_headers(access_token):
+    """Заголовки запроса к chat/completions GigaChat"""
+    return {
+        'Accept': 'application/json',
+        'Authorization': f'Bearer {access_token}',
+        'Content-Type': 'application/json'
+    }
+
+
+def with_system_prompt(system_prompt, message_history=None):
+    """
+    Начало списка сообщений: system prompt и история диалога
+    System-сообщения истории (краткое содержание старой части разговора)
+    дописываются к system prompt - GigaChat ждёт его одним первым сообщением
+    """
+    history = message_history or []
+    extra = [msg["content"] for msg in history if msg.get("role") == "system"]
+    messages = [{"role": "system", "content": "\n\n".join([system_prompt] + extra)}]
+    messages.extend(msg for msg in history if msg.get("role") != "system")
+    return messages
+
+
+CATALOG_PROMPT = "\n\nТовары нашего каталога, подходящие к вопросу (цены актуальны):\n"
+CATALOG_RULES = ("\nНазывай цены и характеристики только из этого списка. "
+                 "Если подходящего товара в нём нет, так и скажи и предложи уточнить запрос.")
+
+
+def catalog_query(question, message_history=None):
+    """
+    Текст для поиска по каталогу: вопрос и предыдущий вопрос клиента, чтобы
+    уточнения вроде «а подешевле?» находили товары из начала разговора
+    """
+    for message in reversed(message_history or []):
+        if message.get("role") == "user":
+            return f"{message['content']}\n{question}"
+    return question
+
+
+@metrics.timed('catalog_search')
+def catalog_context(question, message_history=None):
+    """Дополнение к system prompt: подходящие к вопросу товары каталога или пустая строка"""
+    if not catalog_index:
+        return ""
+    found = catalog_index.search(catalog_query(question, message_history), CATALOG_TOP_K)
+    if not found:
+        return ""
+    lines = []
+    for product, _ in found:
+        line = f"- {product.name} ({product.category}): {product.price:.2f}₽"
+        if product.specs:
+            line += f"; {product.specs}"
+        lines.append(line)
+    return CATALOG_PROMPT + "\n".join(lines) + CATALOG_RULES
+
+
+def build_chat_payload(question, message_history=None):
+    """Формирует тело запроса к GigaChat для ответа менеджера по продажам"""
+    # Формируем список сообщений: system prompt (с товарами каталога) и история
+    messages = with_system_prompt(SALES_SYSTEM_PROMPT + catalog_context(question, message_history),
+                                  message_history)
     
     # Добавляем текущий вопрос
     messages.append({
@@ -173,95 +538,366 @@ def ask_gigachat(question, message_history=None):
         "content": question
     })
     
-    payload = {
+    return {
         "model": "GigaChat",
         "messages": messages,
         "temperature": 0.7,
         "max_tokens": 1000
     }
+
+
+def build_image_prompt_payload(question, history=None):
+    """Формирует тело запроса к GigaChat для описания картинки (на английском)"""
+    messages = with_system_prompt(IMAGE_SYSTEM_PROMPT, history)
     
+    messages.append({
+        "role": "user",
+        "content": f"Создай детальное описание изображения для следующего запроса клиента о офисной технике: {question}"
+    })
+    
+    return {
+        "model": "GigaChat",
+        "messages": messages,
+        "temperature": 0.8,
+        "max_tokens": 200
+    }
+
+
+def extract_message_content(result):
+    """Извлекает текст первого варианта ответа из ответа API или None"""
+    if 'choices' in result and len(result['choices']) > 0:
+        message = result['choices'][0].get('message', {})
+        return message.get('content')
+    return None
+
+
+def post_gigachat(access_token, payload):
+    """
+    Отправляет запрос к chat/completions GigaChat по политике gigachat_policy
+    Возвращает JSON ответа; ошибки - из GIGACHAT_ERRORS
+    После 401 (токен истёк раньше срока) запрос один раз повторяется с новым токеном
+    """
     try:
-        # Отключаем проверку SSL сертификата для GigaChat API
-        response = requests.post(url, headers=headers, json=payload, verify=False)
-        response.raise_for_status()
-        
-        result = response.json()
+        return gigachat_policy.call(_post_gigachat_once, access_token, payload)
+    except requests.exceptions.HTTPError as e:
+        fresh_token = refreshed_token(e, access_token)
+        if not fresh_token:
+            raise
+    return gigachat_policy.call(_post_gigachat_once, fresh_token, payload)
+
+
+@metrics.timed('gigachat_request')
+def _post_gigachat_once(access_token, payload):
+    """Одна попытка запроса к chat/completions"""
+    # Отключаем проверку SSL сертификата для GigaChat API
+    response = http.post(GIGACHAT_CHAT_URL, headers=gigachat_headers(access_token),
+                         json=payload, verify=False)
+    if response.status_code == 401:
+        # Токен отозван или истёк раньше срока - следующий запрос получит новый
+        token_manager.invalidate()
+    response.raise_for_status()
+    result = response.json()
+    metrics.record_usage(result.get('usage'))
+    return result
+
+
+def ask_gigachat(question, message_history=None):
+    """
+    Отправляет вопрос в GigaChat и получает ответ
+    message_history - список предыдущих сообщений для контекста
+    """
+    # Частые вопросы отвечаем из кеша без обращения к API
+    if response_cache:
+        cached = response_cache.get(question, message_history)
+        if cached is not None:
+            return cached
+    
+    # Такой же вопрос уже задан другим пользователем - ждём его ответ
+    return deduplicate('chat', _ask_gigachat, question, message_history)
+
+
+@metrics.timed('ask_gigachat')
+def _ask_gigachat(question, message_history=None):
+    """Запрос ответа к GigaChat (без кеша и объединения запросов)"""
+    # Получаем токен доступа
+    access_token = get_gigachat_access_token()
+    
+    if not access_token:
+        return NO_ACCESS_ANSWER
+    
+    payload = build_chat_payload(question, message_history)
+    
+    try:
+        result = post_gigachat(access_token, payload)
         
         # Извлекаем ответ из структуры ответа API
         if 'choices' in result and len(result['choices']) > 0:
-            message = result['choices'][0].get('message', {})
-            content = message.get('content', 'Не удалось получить ответ')
+            content = extract_message_content(result)
+            if not content:
+                return 'Не удалось получить ответ'
+            if response_cache:
+                response_cache.put(question, message_history, content)
             return content
         else:
-            return "❌ Неожиданный формат ответа от GigaChat API"
+            return BAD_FORMAT_ANSWER
             
-    except requests.exceptions.RequestException as e:
+    except GIGACHAT_ERRORS as e:
         print(f"❌ Ошибка при запросе к GigaChat: {e}")
-        if hasattr(e, 'response') and e.response is not None:
+        if getattr(e, 'response', None) is not None:
             print(f"Ответ сервера: {e.response.text}")
-        return "❌ Произошла ошибка при обращении к GigaChat API. Попробуйте позже."
+        return ERROR_ANSWER
+
+
+def stream_gigachat(question, message_history=None):
+    """
+    Отправляет вопрос в GigaChat в потоковом режиме (stream: true)
+    Генератор: отдаёт фрагменты ответа по мере их получения
+    Ошибки запроса пробрасываются (GIGACHAT_ERRORS)
+    """
+    access_token = get_gigachat_access_token()
+    if not access_token:
+        raise requests.exceptions.RequestException("нет токена доступа GigaChat")
+    
+    payload = build_chat_payload(question, message_history)
+    payload["stream"] = True
+    try:
+        response = _open_gigachat_stream(access_token, payload)
+    except requests.exceptions.HTTPError as e:
+        # Токен истёк раньше срока - один повтор с новым
+        fresh_token = refreshed_token(e, access_token)
+        if not fresh_token:
+            raise
+        response = _open_gigachat_stream(fresh_token, payload)
+    
+    with response:
+        for line in response.iter_lines():
+            delta = parse_sse_line(line)
+            if delta is STREAM_DONE:
+                break
+            if delta:
+                yield delta
+
+
+def _open_gigachat_stream(access_token, payload):
+    """Открывает потоковый ответ GigaChat; ошибки запроса пробрасываются"""
+    headers = gigachat_headers(access_token)
+    headers['Accept'] = 'text/event-stream'
+    
+    # Поток не повторяется, но выключатель и лимит частоты действуют и здесь
+    delay = gigachat_policy.admit()
+    if delay:
+        time.sleep(delay)
+    response = None
+    try:
+        response = http.post(GIGACHAT_CHAT_URL, headers=headers, json=payload,
+                             verify=False, stream=True)
+        if response.status_code == 401:
+            token_manager.invalidate()
+        response.raise_for_status()
+    except requests.exceptions.RequestException as e:
+        gigachat_policy.record(e)
+        if response is not None:
+            response.close()
+        raise
+    gigachat_policy.record()
+    return response
 
 
 def generate_image_prompt(question, history=None):
     """
     Генерирует промпт для генерации изображения через GigaChat
     """
+    return deduplicate('image_prompt', _generate_image_prompt, question, history)
+
+
+@metrics.timed('image_prompt')
+def _generate_image_prompt(question, history=None):
+    """Запрос промпта изображения к GigaChat (без объединения запросов)"""
     # Получаем токен доступа
     access_token = get_gigachat_access_token()
     
     if not access_token:
         return None
     
-    url = "https://gigachat.devices.sberbank.ru/api/v1/chat/completions"
+    payload = build_image_prompt_payload(question, history)
     
-    headers = {
-        'Accept': 'application/json',
-        'Authorization': f'Bearer {access_token}',
-        'Content-Type': 'application/json'
+    try:
+        prompt = extract_message_content(post_gigachat(access_token, payload))
+        return prompt.strip() if prompt is not None else None
+            
+    except GIGACHAT_ERRORS as e:
+        print(f"❌ Ошибка при генерации промпта: {e}")
+        return None
+
+
+# Дополнение к system prompt для совмещённого запроса: ответ и описание картинки сразу
+COMBINED_FORMAT_PROMPT = """
+
+Формат ответа: сначала напиши ответ клиенту. Затем последней отдельной строкой напиши маркер IMAGE_PROMPT: и сразу после него краткое, но детальное описание изображения на английском языке для генерации картинки. Описание должно показывать офисную технику из ответа в профессиональном офисном контексте и содержать детали визуального стиля, композиции, цветов и настроения. Маркер и описание клиент не увидит."""
+
+# Строка-маркер описания картинки (допускаем markdown и варианты написания)
+_IMAGE_PROMPT_MARKER = re.compile(r"^[\s*#>_-]*image[ _-]?prompt[\s*_]*:[\s*_]*", re.IGNORECASE | re.MULTILINE)
+_JSON_DECODER = json.JSONDecoder()
+
+
+def build_combined_payload(question, message_history=None):
+    """Формирует тело запроса к GigaChat за ответом и описанием картинки одновременно"""
+    messages = with_system_prompt(
+        SALES_SYSTEM_PROMPT + catalog_context(question, message_history) + COMBINED_FORMAT_PROMPT,
+        message_history,
+    )
+    messages.append({"role": "user", "content": question})
+    
+    return {
+        "model": "GigaChat",
+        "messages": messages,
+        "temperature": 0.7,
+        "max_tokens": 1200
     }
+
+
+def parse_combined_response(text):
+    """
+    Разбирает совмещённый ответ на (answer, image_prompt)
+    Понимает строку-маркер IMAGE_PROMPT: и JSON вида {"answer": ..., "image_prompt": ...}
+    Если описание картинки не найдено, возвращает (весь текст, None): ответ
+    клиенту не теряется, промпт запрашивается отдельно. None - для пустого текста
+    """
+    text = (text or "").strip()
+    if not text:
+        return None
     
-    # Формируем промпт для генерации описания изображения
-    # System prompt для генерации промпта изображения с учетом роли менеджера по продажам
-    image_system_prompt = """Ты помощник менеджера по продажам офисной техники. Твоя задача - создавать детальные и художественные описания для генерации изображений офисной техники или рабочих мест.
+    # JSON ищем с каждой «{» по очереди: фигурные скобки могут быть и в тексте ответа
+    start = text.find("{")
+    while start != -1:
+        try:
+            data, _ = _JSON_DECODER.raw_decode(text, start)
+        except ValueError:
+            data = None
+        if isinstance(data, dict) and data.get("answer"):
+            image_prompt = str(data.get("image_prompt") or "").strip()
+            return str(data["answer"]).strip(), image_prompt or None
+        start = text.find("{", start + 1)
+    
+    markers = list(_IMAGE_PROMPT_MARKER.finditer(text))
+    if not markers:
+        return text, None
+    marker = markers[-1]
+    answer = text[:marker.start()].rstrip(" \n*_-")
+    image_prompt = text[marker.end():].strip().strip("*_\"' ")
+    if not answer:
+        return text, None
+    return answer, image_prompt or None
 
-Создай краткое, но детальное описание изображения на основе вопроса клиента о офисной технике. Описание должно быть на английском языке, содержать детали визуального стиля, композиции, цветов и настроения. 
 
-Если вопрос касается офисной техники (принтеры, сканеры, МФУ и т.д.), создай описание, которое покажет эту технику в профессиональном офисном контексте. Ответ должен быть только описанием изображения, без дополнительных комментариев."""
+def ask_gigachat_combined(question, message_history=None):
+    """
+    Одним запросом получает ответ клиенту и описание картинки
+    Возвращает (answer, image_prompt), (answer, None), если в ответе модели
+    нет описания картинки, (текст ошибки, None) при сбое API или None для
+    пустого ответа
+    """
+    return deduplicate('combined', _ask_gigachat_combined, question, message_history)
+
+
+@metrics.timed('combined')
+def _ask_gigachat_combined(question, message_history=None):
+    """Совмещённый запрос к GigaChat (без объединения запросов)"""
+    access_token = get_gigachat_access_token()
+    if not access_token:
+        return NO_ACCESS_ANSWER, None
     
-    messages = []
-    if history:
-        messages.extend(history)
+    payload = build_combined_payload(question, message_history)
     
-    messages.append({
-        "role": "user",
-        "content": f"Создай детальное описание изображения для следующего запроса клиента о офисной технике: {question}"
-    })
+    try:
+        return parse_combined_response(extract_message_content(post_gigachat(access_token, payload)))
+    
+    except GIGACHAT_ERRORS as e:
+        print(f"❌ Ошибка при запросе к GigaChat: {e}")
+        return ERROR_ANSWER, None
+
+
+def answer_with_image_prompt(question, history=None):
+    """
+    Возвращает (answer, image_prompt): одним структурированным запросом
+    (COMBINED_COMPLETION) или, если он выключен либо ответ пуст, двумя
+    параллельными запросами ask_gigachat и generate_image_prompt
+    """
+    if COMBINED_COMPLETION:
+        cached = response_cache.get(question, history) if response_cache else None
+        if cached is None:
+            combined = ask_gigachat_combined(question, history)
+            if combined is not None:
+                answer, image_prompt = combined
+                if image_prompt is None and answer not in COMBINED_FAILURE_ANSWERS:
+                    # Ответ есть, а описание картинки не разобрано - запрашиваем только его
+                    print("⚠️  В совмещённом ответе GigaChat нет описания картинки, запрашиваем его отдельно")
+                    image_prompt = generate_image_prompt(question, history)
+                if response_cache and image_prompt:
+                    response_cache.put(question, history, answer)
+                return answer, image_prompt
+            print("⚠️  Пустой совмещённый ответ GigaChat, делаем два запроса")
+        else:
+            # Ответ уже есть в кеше - нужен только промпт картинки
+            return cached, generate_image_prompt(question, history)
+    
+    prompt_future = submit_llm(generate_image_prompt, question, history)
+    answer = ask_gigachat(question, history)
+    return answer, prompt_future.result()
+
+
+# System prompt для краткого содержания старой части диалога
+SUMMARY_SYSTEM_PROMPT = """Ты ведёшь заметки менеджера по продажам офисной техники о разговоре с клиентом. Обнови краткое содержание разговора с учётом новых реплик.
+
+Сохрани всё, что важно для продолжения консультации: потребности и условия клиента (офис, объёмы печати, бюджет), обсуждённые модели и цены, принятые решения и открытые вопросы. Пиши кратко, по-русски, без приветствий и комментариев."""
+
+
+@metrics.timed('history_summary')
+def summarize_history(previous_summary, messages):
+    """
+    Дописывает к краткому содержанию диалога новые сообщения через GigaChat
+    Если GigaChat недоступен, собирает краткое содержание из первых предложений реплик
+    """
+    access_token = get_gigachat_access_token()
     
+    transcript = "\n".join(
+        f"{'Клиент' if msg.get('role') == 'user' else 'Менеджер'}: {msg.get('content', '')}"
+        for msg in messages
+    )
+    content = f"Текущее краткое содержание:\n{previous_summary or '(пока нет)'}\n\nНовые реплики:\n{transcript}"
     payload = {
         "model": "GigaChat",
         "messages": [
-            {"role": "system", "content": image_system_prompt}
-        ] + messages,
-        "temperature": 0.8,
-        "max_tokens": 200
+            {"role": "system", "content": SUMMARY_SYSTEM_PROMPT},
+            {"role": "user", "content": content}
+        ],
+        "temperature": 0.3,
+        "max_tokens": HISTORY_SUMMARY_TOKENS
     }
     
-    try:
-        response = requests.post(url, headers=headers, json=payload, verify=False)
-        response.raise_for_status()
-        
-        result = response.json()
-        
-        if 'choices' in result and len(result['choices']) > 0:
-            message = result['choices'][0].get('message', {})
-            prompt = message.get('content', '').strip()
-            return prompt
-        else:
-            return None
-            
-    except requests.exceptions.RequestException as e:
-        print(f"❌ Ошибка при генерации промпта: {e}")
-        return None
+    if access_token:
+        try:
+            summary = extract_message_content(post_gigachat(access_token, payload))
+            if summary:
+                return summary.strip()
+        except GIGACHAT_ERRORS as e:
+            print(f"❌ Ошибка при сжатии истории через GigaChat: {e}")
+    
+    return extractive_summary(previous_summary, messages, max_tokens=HISTORY_SUMMARY_TOKENS)
+
+
+if HISTORY_TOKEN_BUDGET > 0:
+    # Свежие сообщения идут как есть, пока помещаются в бюджет; два последних
+    # места в хранилище оставлены, чтобы сообщения успевали попасть в краткое
+    # содержание до вытеснения
+    history_compactor = HistoryCompactor(
+        summarize_history,
+        token_budget=HISTORY_TOKEN_BUDGET,
+        max_recent=max(MAX_HISTORY_MESSAGES - 2, 2),
+        max_users=HISTORY_MAX_USERS,
+        # С HISTORY_BACKEND=sqlite краткое содержание хранится в той же базе
+        store=user_history if isinstance(user_history, SQLiteConversationStore) else None,
+    )
 
 
 def generate_image_proxyapi(prompt):
@@ -269,160 +905,582 @@ def generate_image_proxyapi(prompt):
     Генерирует изображение через ProxyAPI (GPT-Image 1)
     Возвращает bytes изображения
     """
-    if not PROXY_API:
+    if not proxyapi_client:
         return None
     
+    return deduplicate('image', _generate_image_proxyapi, prompt)
+
+
+@metrics.timed('image_generation')
+def _generate_image_proxyapi(prompt):
+    """Запрос картинки к ProxyAPI (без объединения запросов)"""
     try:
-        # Создаем клиент OpenAI с base_url для ProxyAPI
-        client = OpenAI(
-            api_key=PROXY_API,
-            base_url="https://api.proxyapi.ru/openai/v1",
-        )
-        
-        # Генерируем изображение
-        result = client.images.generate(
-            model="gpt-image-1",
-            prompt=prompt
-        )
-        
-        # Получаем base64 данные изображения
-        image_base64 = result.data[0].b64_json
-        if image_base64:
-            # Декодируем base64 в bytes
-            image_bytes = base64.b64decode(image_base64)
-            # Возвращаем bytes для отправки в Telegram
-            return image_bytes
+        # Генерируем изображение через общий клиент ProxyAPI
+        result = image_policy.call(_request_image_once, prompt)
         
-        return None
+        # Получаем base64 данные изображения и готовим bytes для отправки в Telegram
+        return prepare_image(result.data[0].b64_json)
             
     except Exception as e:
         print(f"❌ Ошибка при генерации изображения ProxyAPI: {e}")
         return None
 
 
+@metrics.timed('image_postprocess')
+def prepare_image(image_base64):
+    """
+    Декодирует картинку из base64 и пережимает её (image_postprocessor)
+    Возвращает bytes (bytearray) или None, если картинки нет
+    """
+    if not image_base64:
+        return None
+    image_bytes = decode_b64(image_base64)
+    if image_postprocessor:
+        image_bytes = image_postprocessor.process(image_bytes)
+    return image_bytes
+
+
+@metrics.timed('proxyapi_request')
+def _request_image_once(prompt):
+    """Одна попытка запроса картинки к ProxyAPI"""
+    return proxyapi_client.images.generate(model="gpt-image-1", prompt=prompt)
+
+
+# Тексты ответов на команды
+WELCOME_TEXT = (
+    "👋 Привет! Я бот с интеграцией GigaChat AI.\n\n"
+    "Задай мне любой вопрос, и я постараюсь на него ответить!\n\n"
+    "Используй /help для справки."
+)
+
+HELP_TEXT = (
+    "📖 Доступные команды:\n\n"
+    "/start - Начать работу с ботом\n"
+    "/help - Показать эту справку\n"
+    "/clear - Очистить историю сообщений\n\n"
+    "💼 Я менеджер по продажам офисной техники. Могу помочь:\n"
+    "• Подобрать подходящую технику\n"
+    "• Рассказать о характеристиках\n"
+    "• Ответить на вопросы о ценах и условиях\n"
+    "• Показать визуализацию техники\n\n"
+)
+if history_compactor:
+    HELP_TEXT += "📝 Я помню последние сообщения разговора, а более ранние - в кратком пересказе."
+else:
+    HELP_TEXT += f"📝 Я помню до {MAX_HISTORY_MESSAGES} последних сообщений для контекста."
+
+# Ограничиваем длину запроса до 1000 символов
+MAX_QUESTION_LENGTH = 1000
+
+
+def question_too_long_text(user_question):
+    """Возвращает текст ошибки, если вопрос длиннее MAX_QUESTION_LENGTH, иначе None"""
+    if len(user_question) <= MAX_QUESTION_LENGTH:
+        return None
+    return (f"❌ Ваше сообщение слишком длинное ({len(user_question)} символов).\n"
+            f"Максимальная длина запроса: {MAX_QUESTION_LENGTH} символов.\n"
+            f"Пожалуйста, сократите ваш вопрос.")
+
+
 @bot.message_handler(commands=['start'])
 def send_welcome(message):
     """Обработчик команды /start"""
-    welcome_text = (
-        "👋 Привет! Я бот с интеграцией GigaChat AI.\n\n"
-        "Задай мне любой вопрос, и я постараюсь на него ответить!\n\n"
-        "Используй /help для справки."
-    )
-    bot.reply_to(message, welcome_text)
+    bot.reply_to(message, WELCOME_TEXT)
 
 
 @bot.message_handler(commands=['help'])
 def send_help(message):
     """Обработчик команды /help"""
-    help_text = (
-        "📖 Доступные команды:\n\n"
-        "/start - Начать работу с ботом\n"
-        "/help - Показать эту справку\n"
-        "/clear - Очистить историю сообщений\n\n"
-        "💼 Я менеджер по продажам офисной техники. Могу помочь:\n"
-        "• Подобрать подходящую технику\n"
-        "• Рассказать о характеристиках\n"
-        "• Ответить на вопросы о ценах и условиях\n"
-        "• Показать визуализацию техники\n\n"
-        "📝 Я помню до 10 последних сообщений для контекста."
-    )
-    bot.reply_to(message, help_text)
+    bot.reply_to(message, HELP_TEXT)
 
 
 @bot.message_handler(commands=['clear'])
 def clear_history(message):
     """Обработчик команды /clear - очищает историю сообщений"""
     user_id = message.from_user.id
-    if user_id in user_history:
-        user_history[user_id] = []
+    if clear_user_history(user_id):
         bot.reply_to(message, "✅ История сообщений очищена!")
     else:
         bot.reply_to(message, "ℹ️ История сообщений пуста.")
 
 
+def get_history(user_id):
+    """
+    Возвращает копию истории пользователя для запроса к GigaChat:
+    последние сообщения в пределах HISTORY_TOKEN_BUDGET и краткое содержание
+    более старых (или просто последние MAX_HISTORY_MESSAGES, если сжатие выключено)
+    """
+    history = user_history.get(user_id)
+    if history_compactor:
+        history = history_compactor.compact(user_id, history)
+    return history
+
+
+def remember_turn(user_id, user_question, answer):
+    """Сохраняет вопрос и ответ в историю пользователя"""
+    user_history.append_turn(user_id, user_question, answer)
+    if history_compactor:
+        # Краткое содержание обновляется в фоне, ответ пользователю не ждёт;
+        # при переполненной очереди обновится после следующего сообщения
+        try:
+            chat_pool.submit(user_id, _refresh_history_summary, user_id,
+                             priority=PRIORITY_BACKGROUND)
+        except QueueFull:
+            pass
+
+
+def _refresh_history_summary(user_id):
+    """Сворачивает вышедшие за бюджет сообщения в краткое содержание"""
+    history_compactor.refresh(user_id, user_history.get(user_id))
+
+
+def clear_user_history(user_id):
+    """Удаляет историю пользователя и её краткое содержание; True, если история была"""
+    if history_compactor:
+        history_compactor.forget(user_id)
+    return user_history.clear(user_id)
+
+
+def make_caption(answer):
+    """Обрезает ответ до длины подписи к фото (лимит Telegram - 1024 символа)"""
+    MAX_CAPTION_LENGTH = 1024
+    if len(answer) <= MAX_CAPTION_LENGTH:
+        return answer
+    return answer[:MAX_CAPTION_LENGTH] + "\n\n... (сообщение обрезано)"
+
+
+def wants_image(user_question):
+    """Решает, нужна ли картинка к ответу; решение классификатора пишется в лог"""
+    if not PROXY_API:
+        return False
+    if image_pool.depth >= IMAGE_QUEUE_LIMIT:
+        # Очередь картинок переполнена - отвечаем только текстом
+        print(f"🖼  Картинка: нет (очередь картинок: {image_pool.depth}) - {user_question[:60]!r}")
+        return False
+    if image_policy.breaker.is_open:
+        # ProxyAPI недоступен - отвечаем только текстом, не тратя запрос на промпт
+        print(f"🖼  Картинка: нет (ProxyAPI временно отключён) - {user_question[:60]!r}")
+        return False
+    if not image_intent:
+        return True
+    decision = image_intent.decide(user_question)
+    print(f"🖼  Картинка: {decision} - {user_question[:60]!r}")
+    return decision.want_image
+
+
+def find_category_image(user_question):
+    """Ищет готовую картинку по категории товара из вопроса (без запроса промпта)"""
+    if not image_cache or not IMAGE_CACHE_BY_CATEGORY:
+        return None
+    category = detect_category(user_question)
+    return image_cache.lookup(category=category) if category else None
+
+
+def get_image(user_question, image_prompt):
+    """
+    Возвращает картинку для промпта: из кеша (по промпту или категории товара)
+    или новую, сгенерированную через ProxyAPI
+    """
+    category = detect_category(user_question, image_prompt) if IMAGE_CACHE_BY_CATEGORY else None
+    if image_cache:
+        cached = image_cache.lookup(prompt=image_prompt, category=category)
+        if cached:
+            return cached
+    
+    image_data = generate_image_proxyapi(image_prompt)
+    if not image_data:
+        return None
+    if image_cache:
+        return image_cache.store(image_prompt, category, image_data)
+    return CachedImage(data=image_data)
+
+
+@metrics.timed('send_photo')
+def send_image(chat_id, image, **kwargs):
+    """Отправляет картинку; повторно - по file_id Telegram, без загрузки байтов"""
+    if image.file_id:
+        try:
+            return bot.send_photo(chat_id, image.file_id, **kwargs)
+        except telebot.apihelper.ApiTelegramException as e:
+            print(f"⚠️  file_id картинки больше не принимается, загружаем заново: {e}")
+            image_cache.forget_file_id(image.blob)
+    
+    sent = bot.send_photo(chat_id, BytesIO(image.read()), **kwargs)
+    # Запоминаем file_id самого большого размера, который вернул Telegram
+    if image_cache and image.blob and sent.photo:
+        image_cache.remember_file_id(image.blob, sent.photo[-1].file_id)
+    return sent
+
+
+def superseded(turn):
+    """
+    True, если вопрос уже поглощён более новыми сообщениями пользователя
+    и отвечать на него не нужно; иначе отмечает, что ответ отправляется
+    """
+    return turn is not None and not turn.try_answer()
+
+
+def _reply_sequential(message, user_question, history, turn=None):
+    """Последовательный режим: ответ, промпт и картинка, затем одно сообщение"""
+    image = None
+    image_prompt = None
+    need_prompt = False
+    if wants_image(user_question):
+        # Картинка этой категории товара уже есть - промпт не нужен
+        image = find_category_image(user_question)
+        need_prompt = image is None
+    
+    if need_prompt:
+        # Ответ и промпт для изображения (одним запросом, если включено)
+        answer, image_prompt = answer_with_image_prompt(user_question, history)
+    else:
+        # Получаем ответ от GigaChat с учетом истории
+        answer = ask_gigachat(user_question, history)
+    
+    # Пока ждали ответ, пользователь дописал вопрос - ответим на него целиком
+    if superseded(turn):
+        return
+    
+    remember_turn(message.from_user.id, user_question, answer)
+    
+    # Картинка генерируется и отправляется с подписью в пуле картинок,
+    # поток ответов сразу освобождается
+    if (image or image_prompt) and submit_image_job(
+            message.from_user.id, _send_answer_with_image,
+            message, user_question, answer, image, image_prompt):
+        return
+    
+    # Отправляем только текстовый ответ
+    bot.reply_to(message, answer)
+
+
+def _send_answer_with_image(message, user_question, answer, image, image_prompt):
+    """Генерирует картинку (если её ещё нет) и отправляет её с ответом в подписи"""
+    try:
+        if image is None:
+            # Генерируем изображение через ProxyAPI (или берём из кеша)
+            bot.send_chat_action(message.chat.id, 'upload_photo')
+            image = get_image(user_question, image_prompt)
+        if image:
+            # Отправляем изображение с подписью (ответ от GigaChat)
+            send_image(message.chat.id, image, caption=make_caption(answer))
+            return
+    except Exception as e:
+        print(f"❌ Ошибка при отправке изображения: {e}")
+    # Картинки нет - ответ всё равно должен дойти
+    bot.reply_to(message, answer)
+
+
+def submit_image_job(user_id, fn, *args):
+    """Ставит задачу в пул картинок; None, если очередь переполнена или бот останавливается"""
+    try:
+        return image_pool.submit(user_id, fn, *args)
+    except PoolClosed:
+        print("🖼  Бот останавливается, картинка пропущена")
+        return None
+    except QueueFull:
+        print(f"🖼  Очередь картинок переполнена ({image_pool.depth}), картинка пропущена")
+        return None
+
+
+def _deliver_image(chat_id, image, reply_to_message_id):
+    """Отправляет готовую картинку ответом на уже отправленный текст"""
+    try:
+        send_image(chat_id, image, reply_to_message_id=reply_to_message_id)
+    except Exception as e:
+        print(f"❌ Ошибка при отправке изображения: {e}")
+
+
+def _generate_and_deliver_image(chat_id, user_question, image_prompt, reply_to_message_id):
+    """Генерирует картинку и отправляет её ответом на уже отправленный текст"""
+    try:
+        bot.send_chat_action(chat_id, 'upload_photo')
+        image = get_image(user_question, image_prompt)
+        if image:
+            send_image(chat_id, image, reply_to_message_id=reply_to_message_id)
+    except Exception as e:
+        print(f"❌ Ошибка при отправке изображения: {e}")
+
+
+def _schedule_image(prompt_future, user_id, chat_id, user_question, reply_to_message_id):
+    """Ставит генерацию картинки в пул изображений, когда будет готов промпт"""
+    def on_prompt_ready(future):
+        try:
+            image_prompt = future.result()
+        except Exception as e:
+            print(f"❌ Ошибка при генерации промпта: {e}")
+            return
+        if image_prompt:
+            submit_image_job(user_id, _generate_and_deliver_image, chat_id, user_question,
+                             image_prompt, reply_to_message_id)
+    
+    # Колбэк выполнится в потоке llm_executor - картинка остаётся в трассировке сообщения
+    context = contextvars.copy_context()
+    prompt_future.add_done_callback(lambda future: context.run(on_prompt_ready, future))
+
+
+def edit_streamed_text(sent, text):
+    """Правит сообщение с потоковым ответом, не прерываясь на ошибках Telegram"""
+    try:
+        bot.edit_message_text(text, sent.chat.id, sent.message_id)
+    except telebot.apihelper.ApiTelegramException as e:
+        # "message is not modified" и превышение лимита правок не критичны
+        print(f"⚠️  Не удалось обновить сообщение: {e}")
+
+
+def finish_streamed_reply(sent, answer):
+    """Записывает итоговый ответ в сообщение; длинный ответ дописывается новыми сообщениями"""
+    parts = telebot.util.smart_split(answer, TELEGRAM_MESSAGE_LIMIT)
+    edit_streamed_text(sent, parts[0])
+    for part in parts[1:]:
+        bot.send_message(sent.chat.id, part)
+
+
+@metrics.timed('gigachat_stream')
+def stream_answer(message, user_question, history):
+    """
+    Отвечает потоково: сразу отправляет заглушку и правит её по мере генерации
+    (не чаще STREAM_EDIT_INTERVAL); возвращает (answer, отправленное сообщение)
+    """
+    if response_cache:
+        cached = response_cache.get(user_question, history)
+        if cached is not None:
+            return cached, bot.reply_to(message, cached)
+    
+    sent = bot.reply_to(message, STREAM_PLACEHOLDER)
+    throttle = EditThrottle(interval=STREAM_EDIT_INTERVAL)
+    answer = None
+    try:
+        for delta in stream_gigachat(user_question, history):
+            text = throttle.feed(delta)
+            if text:
+                edit_streamed_text(sent, text)
+        answer = throttle.text or 'Не удалось получить ответ'
+        if response_cache and throttle.text:
+            response_cache.put(user_question, history, throttle.text)
+    except GIGACHAT_ERRORS as e:
+        print(f"❌ Ошибка при потоковом запросе к GigaChat: {e}")
+        # Если часть ответа уже пришла, оставляем её
+        answer = throttle.text or ERROR_ANSWER
+    
+    finish_streamed_reply(sent, answer)
+    return answer, sent
+
+
+def _reply_pipelined(message, user_question, history, turn=None):
+    """
+    Конвейерный режим: ответ и промпт запрашиваются параллельно (или одним запросом),
+    текст отправляется сразу, картинка - отдельным сообщением, когда будет готова
+    """
+    image = None
+    need_prompt = False
+    if wants_image(user_question):
+        # Картинка этой категории товара уже есть - промпт не нужен
+        image = find_category_image(user_question)
+        need_prompt = image is None
+    
+    image_prompt = None
+    prompt_future = None
+    if need_prompt and COMBINED_COMPLETION and not STREAM_REPLIES:
+        # Один структурированный запрос: ответ и промпт картинки вместе
+        answer, image_prompt = answer_with_image_prompt(user_question, history)
+        if superseded(turn):
+            return
+        remember_turn(message.from_user.id, user_question, answer)
+        sent = bot.reply_to(message, answer)
+    else:
+        # Потоковый ответ начинает уходить пользователю сразу
+        if STREAM_REPLIES and superseded(turn):
+            return
+
+        if need_prompt:
+            prompt_future = submit_llm(generate_image_prompt, user_question, history)
+
+        if STREAM_REPLIES:
+            # Ответ появляется у пользователя по мере генерации
+            answer, sent = stream_answer(message, user_question, history)
+            remember_turn(message.from_user.id, user_question, answer)
+        else:
+            answer = ask_gigachat(user_question, history)
+            if superseded(turn):
+                # Промпт картинки к заменённому вопросу тоже не нужен
+                if prompt_future:
+                    prompt_future.cancel()
+                return
+            remember_turn(message.from_user.id, user_question, answer)
+            
+            # Текст уходит пользователю, не дожидаясь картинки
+            sent = bot.reply_to(message, answer)
+    
+    user_id = message.from_user.id
+    if image:
+        submit_image_job(user_id, _deliver_image, message.chat.id, image, sent.message_id)
+    elif image_prompt:
+        submit_image_job(user_id, _generate_and_deliver_image, message.chat.id, user_question,
+                         image_prompt, sent.message_id)
+    elif prompt_future:
+        _schedule_image(prompt_future, user_id, message.chat.id, user_question, sent.message_id)
+
+
 @bot.message_handler(func=lambda message: True)
 def handle_message(message):
     """Обработчик всех текстовых сообщений"""
     user_id = message.from_user.id
     user_question = message.text
     
-    # Ограничиваем длину запроса до 1000 символов
-    MAX_QUESTION_LENGTH = 1000
-    if len(user_question) > MAX_QUESTION_LENGTH:
-        bot.reply_to(message, f"❌ Ваше сообщение слишком длинное ({len(user_question)} символов).\nМаксимальная длина запроса: {MAX_QUESTION_LENGTH} символов.\nПожалуйста, сократите ваш вопрос.")
+    # Ограничиваем длину запроса
+    error_text = question_too_long_text(user_question)
+    if error_text:
+        bot.reply_to(message, error_text)
         return
     
-    # Инициализируем историю для пользователя, если её нет
-    if user_id not in user_history:
-        user_history[user_id] = []
-    
     # Отправляем сообщение о том, что бот думает
     bot.send_chat_action(message.chat.id, 'typing')
     
-    # Получаем историю сообщений для контекста (до MAX_HISTORY_MESSAGES)
-    history = user_history[user_id][-MAX_HISTORY_MESSAGES:] if len(user_history[user_id]) > MAX_HISTORY_MESSAGES else user_history[user_id]
-    
-    # Получаем ответ от GigaChat с учетом истории
-    answer = ask_gigachat(user_question, history)
-    
-    # Генерируем промпт для изображения через GigaChat
-    image_prompt = None
-    if PROXY_API:
-        bot.send_chat_action(message.chat.id, 'typing')
-        image_prompt = generate_image_prompt(user_question, history)
-    
-    # Генерируем изображение через ProxyAPI, если есть промпт и ключ
-    image_data = None
-    if image_prompt and PROXY_API:
-        bot.send_chat_action(message.chat.id, 'upload_photo')
-        image_data = generate_image_proxyapi(image_prompt)
-    
-    # Сохраняем вопрос пользователя в историю
-    user_history[user_id].append({
-        "role": "user",
-        "content": user_question
-    })
-    
-    # Сохраняем ответ бота в историю
-    user_history[user_id].append({
-        "role": "assistant",
-        "content": answer
-    })
+    if message_coalescer:
+        # Ждём, не допишет ли пользователь вопрос следующими сообщениями
+        message_coalescer.add(user_id, message, user_question)
+    else:
+        schedule_answer(message, user_question)
+
+
+def schedule_answer(message, user_question, turn=None):
+    """
+    Ставит ответ в очередь пула ответов; если очередь переполнена, сразу
+    просит пользователя повторить вопрос позже. Возвращает Future или None
+    """
+    try:
+        return chat_pool.submit(message.from_user.id, answer_message, message, user_question, turn)
+    except PoolClosed:
+        print("⚠️  Бот останавливается, вопрос отклонён")
+        bot.reply_to(message, BUSY_ANSWER)
+        return None
+    except QueueFull:
+        print(f"⚠️  Очередь ответов переполнена ({chat_pool.depth}), вопрос отклонён")
+        bot.reply_to(message, BUSY_ANSWER)
+        return None
+
+
+@metrics.timed('answer', new_trace=True)
+def answer_message(message, user_question, turn=None):
+    """Отвечает на вопрос пользователя (turn - склеенный вопрос из нескольких сообщений)"""
+    # Получаем копию истории сообщений для контекста (до MAX_HISTORY_MESSAGES)
+    # Копия нужна, т.к. в конвейерном режиме история читается из других потоков
+    history = get_history(message.from_user.id)
     
-    # Ограничиваем историю до MAX_HISTORY_MESSAGES
-    if len(user_history[user_id]) > MAX_HISTORY_MESSAGES:
-        user_history[user_id] = user_history[user_id][-MAX_HISTORY_MESSAGES:]
-    
-    # Отправляем ответ пользователю
-    if image_data:
-        # Отправляем изображение (bytes) с подписью (ответ от GigaChat)
-        # Ограничиваем длину подписи до 1024 символов (лимит Telegram)
-        MAX_CAPTION_LENGTH = 1024
-        caption = answer[:MAX_CAPTION_LENGTH] if len(answer) > MAX_CAPTION_LENGTH else answer
-        if len(answer) > MAX_CAPTION_LENGTH:
-            caption += "\n\n... (сообщение обрезано)"
-        bot.send_photo(message.chat.id, BytesIO(image_data), caption=caption)
+    if PIPELINE_MODE == 'pipelined':
+        _reply_pipelined(message, user_question, history, turn)
     else:
-        # Отправляем только текстовый ответ
-        bot.reply_to(message, answer)
+        _reply_sequential(message, user_question, history, turn)
 
 
-def main():
-    """Основная функция для запуска бота"""
+def _answer_turn(turn):
+    """
+    Ставит склеенный вопрос в пул ответов (ответ - на последнее из его сообщений)
+    Возвращает Future: по нему склейка узнаёт, что вопрос обработан
+    """
+    return schedule_answer(turn.last, turn.text, turn)
+
+
+message_coalescer = None
+if COALESCE_WINDOW_MS > 0:
+    message_coalescer = MessageCoalescer(
+        _answer_turn,
+        window=COALESCE_WINDOW_MS / 1000,
+        max_delay=COALESCE_MAX_DELAY_MS / 1000,
+    )
+
+
+_workers_stopped = False
+
+
+def _shutdown_executor(executor, timeout):
+    """
+    Останавливает ThreadPoolExecutor, дожидаясь начатых задач и их колбэков
+    не дольше timeout секунд; True, если все задачи завершились
+    """
+    # shutdown(wait=True) не принимает таймаут - ждём его в отдельном потоке
+    stopper = threading.Thread(target=executor.shutdown, name='llm-shutdown', daemon=True)
+    stopper.start()
+    stopper.join(timeout)
+    return not stopper.is_alive()
+
+
+def shutdown_workers(timeout=WEBHOOK_DRAIN_TIMEOUT):
+    """
+    Дорабатывает принятые вопросы перед выходом: отправляет в пул склеиваемые
+    сообщения, затем ждёт пул ответов, запросы промптов картинок в llm_executor
+    (их колбэки ставят задачи картинок) и пул картинок, каждый не дольше timeout секунд
+    """
+    global _workers_stopped
+    if _workers_stopped:
+        return
+    _workers_stopped = True
+    if message_coalescer:
+        message_coalescer.flush()
+    if not chat_pool.shutdown(wait=True, timeout=timeout):
+        print(f"⚠️  Пул {chat_pool.name}: при остановке не завершены задачи (в очереди {chat_pool.depth})")
+    if not _shutdown_executor(llm_executor, timeout):
+        print("⚠️  При остановке не завершены запросы промптов картинок")
+    if not image_pool.shutdown(wait=True, timeout=timeout):
+        print(f"⚠️  Пул {image_pool.name}: при остановке не завершены задачи (в очереди {image_pool.depth})")
+
+
+# При обычном выходе тоже дожидаемся ответов; atexit вызывает функции в обратном
+# порядке, так что история сохраняется (user_history.close) уже после них
+atexit.register(shutdown_workers)
+
+
+def register_metrics():
+    """Подключает к метрикам статистику очередей, кешей, политик и объединения запросов"""
+    metrics.add_collector('gigachat', gigachat_policy.stats)
+    metrics.add_collector('proxyapi', image_policy.stats)
+    metrics.add_collector('chat_pool', chat_pool.stats)
+    metrics.add_collector('image_pool', image_pool.stats)
+    metrics.add_collector('history', user_history.stats)
+    if inflight:
+        metrics.add_collector('inflight', inflight.stats, label='kind')
+    if response_cache:
+        metrics.add_collector('response_cache', response_cache.stats)
+    if image_cache:
+        metrics.add_collector('image_cache', image_cache.stats)
+    if image_postprocessor:
+        metrics.add_collector('image_postprocess', image_postprocessor.stats)
+    if catalog_index:
+        metrics.add_collector('catalog_index', catalog_index.stats)
+    if history_compactor:
+        metrics.add_collector('history_compactor', history_compactor.stats)
+    if message_coalescer:
+        metrics.add_collector('coalescer', message_coalescer.stats)
+
+
+register_metrics()
+
+
+def start_metrics():
+    """Запускает эндпоинт метрик и периодическую сводку, если они включены"""
+    if METRICS_PORT:
+        start_metrics_server(metrics, METRICS_HOST, METRICS_PORT)
+    if METRICS_DUMP_INTERVAL > 0:
+        start_periodic_dump(metrics, METRICS_DUMP_INTERVAL)
+
+
+def check_config():
+    """Проверяет настройки из .env перед запуском, возвращает True если можно стартовать"""
     # Проверяем наличие файла .env
     env_file = os.path.join(os.path.dirname(__file__), '.env')
     if not os.path.exists(env_file):
         print("❌ Ошибка: Файл .env не найден!")
         print(f"Создайте файл .env в директории: {os.path.dirname(__file__)}")
         print("Можно скопировать env.example в .env и заполнить значениями")
-        return
+        return False
     
     # Проверяем наличие необходимых токенов
     if not TELEGRAM_BOT_TOKEN or TELEGRAM_BOT_TOKEN == "ваш_токен_бота_здесь":
         print("❌ Ошибка: TELEGRAM_BOT_TOKEN не найден или не заполнен!")
         print("Проверьте файл .env и убедитесь, что токен указан.")
         print("Получите токен у @BotFather в Telegram")
-        return
+        return False
     
     # Проверяем наличие данных для GigaChat авторизации
     has_auth_key = GIGACHAT_AUTHORIZATION_KEY and GIGACHAT_AUTHORIZATION_KEY != "ваш_ключ_авторизации_здесь"
@@ -435,7 +1493,7 @@ def main():
         print("  1. GIGACHAT_AUTHORIZATION_KEY=ваш_Base64_ключ (рекомендуется)")
         print("  2. GIGACHAT_CLIENT_ID=ваш_client_id и GIGACHAT_CLIENT_SECRET=ваш_client_secret")
         print("Получите данные в личном кабинете GigaChat")
-        return
+        return False
     
     # Предупреждение, если нет ключа ProxyAPI (но не критично)
     if not PROXY_API or PROXY_API == "ваш_proxy_api_ключ_здесь":
@@ -444,11 +1502,65 @@ def main():
     else:
         print("✓ Генерация изображений через ProxyAPI включена")
     
+    return True
+
+
+def process_update_json(update_json):
+    """Передаёт обновление Telegram (dict из JSON) обработчикам бота"""
+    bot.process_new_updates([telebot.types.Update.de_json(update_json)])
+
+
+def run_webhook():
+    """Запускает приём обновлений через webhook вместо long polling"""
+    server = WebhookServer(
+        process_update_json,
+        host=WEBHOOK_HOST,
+        port=WEBHOOK_PORT,
+        path=WEBHOOK_PATH,
+        secret_token=WEBHOOK_SECRET or None,
+        workers=WEBHOOK_WORKERS,
+        queue_size=WEBHOOK_QUEUE_SIZE,
+    )
+    
+    # Регистрируем webhook в Telegram, если указан публичный адрес
+    # (при нескольких процессах за балансировщиком достаточно одного)
+    if WEBHOOK_URL:
+        bot.set_webhook(url=WEBHOOK_URL, secret_token=WEBHOOK_SECRET or None)
+        print(f"✓ Webhook зарегистрирован: {WEBHOOK_URL}")
+    
+    print(f"🤖 Бот запущен (webhook): http://{WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}, "
+          f"обработчиков: {WEBHOOK_WORKERS}")
+    print("Нажмите Ctrl+C для остановки")
+    server.serve_until_signal(drain_timeout=WEBHOOK_DRAIN_TIMEOUT)
+    shutdown_workers()
+
+
+def main():
+    """Основная функция для запуска бота"""
+    if not check_config():
+        return
+    
+    start_metrics()
+    
+    if BOT_RUNTIME == 'asyncio':
+        # Асинхронный движок (см. async_bot.py)
+        import async_bot
+        async_bot.run()
+        return
+    
+    if BOT_INGESTION == 'webhook':
+        run_webhook()
+        return
+    
     print("🤖 Бот запущен и готов к работе!")
     print("Нажмите Ctrl+C для остановки")
     
-    # Запускаем бота
+    # Запускаем бота; SIGTERM останавливает опрос так же, как Ctrl+C
+    signal.signal(signal.SIGTERM, lambda signum, frame: bot.stop_polling())
     bot.polling(none_stop=True)
+    print("⏳ Остановка, дорабатываем принятые вопросы...")
+    shutdown_workers()
+    print("✓ Бот остановлен")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,324 @@
+"""
+Колоночный каталог товаров с индексом по категориям
+Цены хранятся в массиве (NumPy, без него - array из стандартной библиотеки),
+строки каждой категории - в индексе, а суммы по категориям и общая сумма
+поддерживаются при каждом изменении. Поиск по категории и итоги - O(1),
+скидка на категорию считается одной векторной операцией. Суммы хранятся в
+целых копейках, поэтому не накапливают ошибку округления при изменениях
+"""
+
+from array import array
+from collections.abc import Sequence
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Начальная ёмкость колонок; при заполнении ёмкость удваивается
+INITIAL_CAPACITY = 1024
+
+
+def _kopecks(price: float) -> int:
+    """Цена в целых копейках (слагаемое сумм каталога)"""
+    return round(price * 100)
+
+
+class ReadOnlyItems(Sequence):
+    """Объекты товаров каталога только для чтения, без копирования списка"""
+
+    __slots__ = ("_items",)
+
+    def __init__(self, items: List[Any]):
+        self._items = items
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __getitem__(self, index):
+        return self._items[index]
+
+    def __iter__(self):
+        return iter(self._items)
+
+
+class Catalog:
+    """
+    Колоночное хранилище строк (цена, категория, объект товара)
+
+    validate_range(low, high) - проверка диапазона новых цен при массовых
+    изменениях (бросает ValueError); одиночные цены проверяет вызывающий код
+    """
+
+    def __init__(self, validate_range: Optional[Callable[[float, float], None]] = None):
+        self.validate_range = validate_range
+        self._size = 0
+        if np is not None:
+            self._prices = np.zeros(INITIAL_CAPACITY, dtype=np.float64)
+        else:
+            self._prices = array("d")
+        self._codes = array("i")      # код категории строки
+        self._slots = array("i")      # позиция строки в списке её категории
+        self._items: List[Any] = []   # объект товара строки
+
+        # Категории: имя <-> код, строки и сумма цен каждой категории
+        self._category_codes: Dict[str, int] = {}
+        self._category_names: List[str] = []
+        self._category_rows: List[List[int]] = []
+        self._category_sums: List[int] = []   # в копейках
+        self._total = 0                        # в копейках
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def items(self) -> ReadOnlyItems:
+        """Объекты товаров в порядке строк (только для чтения)"""
+        return ReadOnlyItems(self._items)
+
+    @property
+    def total(self) -> float:
+        """Сумма цен всех строк (с точностью до копейки)"""
+        return self._total / 100
+
+    @property
+    def categories(self) -> List[str]:
+        """Категории, в которых есть товары"""
+        return [name for name, rows in zip(self._category_names, self._category_rows) if rows]
+
+    def add(self, item: Any, price: float, category: str) -> int:
+        """Добавляет строку, возвращает её номер"""
+        row = self._size
+        if np is not None:
+            if row == len(self._prices):
+                self._prices = np.concatenate([self._prices, np.zeros(len(self._prices))])
+            self._prices[row] = price
+        else:
+            self._prices.append(price)
+        code = self._category_code(category)
+        self._codes.append(code)
+        self._slots.append(len(self._category_rows[code]))
+        self._category_rows[code].append(row)
+        self._items.append(item)
+        kopecks = _kopecks(price)
+        self._category_sums[code] += kopecks
+        self._total += kopecks
+        self._size += 1
+        return row
+
+    def extend(self, items: List[Any], prices: List[float], categories: List[str]) -> int:
+        """
+        Добавляет строки пачкой (при загрузке каталога из файла)
+        Возвращает номер первой добавленной строки, остальные идут подряд
+        """
+        known = self._category_codes
+        codes = [known.get(category) for category in categories]
+        if None in codes:
+            for category in dict.fromkeys(categories):
+                self._category_code(category)
+            codes = [known[category] for category in categories]
+        start = self._size
+        count = len(items)
+
+        if np is not None:
+            if start + count > len(self._prices):
+                capacity = max(len(self._prices) * 2, start + count)
+                self._prices = np.concatenate([self._prices, np.zeros(capacity - len(self._prices))])
+            new_prices = np.asarray(prices, dtype=np.float64)
+            self._prices[start:start + count] = new_prices
+            self._link_many(start, np.asarray(codes, dtype=np.int32), new_prices)
+        else:
+            self._prices.extend(prices)
+            category_rows = self._category_rows
+            category_sums = self._category_sums
+            kopecks = [round(price * 100) for price in prices]
+            for row, code, amount in zip(range(start, start + count), codes, kopecks):
+                rows = category_rows[code]
+                self._codes.append(code)
+                self._slots.append(len(rows))
+                rows.append(row)
+                category_sums[code] += amount
+            self._total += sum(kopecks)
+
+        self._items.extend(items)
+        self._size += count
+        return start
+
+    def price_column(self, start: int = 0, stop: Optional[int] = None) -> List[float]:
+        """Цены строк start..stop (по умолчанию всех) списком (для выгрузки)"""
+        stop = self._size if stop is None else min(stop, self._size)
+        return self._prices[start:stop].tolist()
+
+    def category_column(self, start: int = 0, stop: Optional[int] = None) -> List[str]:
+        """Категории строк start..stop (по умолчанию всех) списком (для выгрузки)"""
+        names = self._category_names
+        return [names[code] for code in self._codes[start:stop]]
+
+    def remove(self, row: int) -> Optional[Tuple[Any, int]]:
+        """
+        Удаляет строку: на её место переносится последняя строка
+        Возвращает (перенесённый объект, его новый номер строки) или None
+        """
+        self._check_row(row)
+        kopecks = _kopecks(float(self._prices[row]))
+        code = self._codes[row]
+        self._unlink(row)
+        self._category_sums[code] -= kopecks
+        self._total -= kopecks
+
+        last = self._size - 1
+        moved = None
+        if row != last:
+            # Последняя строка занимает освободившееся место
+            self._prices[row] = self._prices[last]
+            self._codes[row] = self._codes[last]
+            self._slots[row] = self._slots[last]
+            self._items[row] = self._items[last]
+            self._category_rows[self._codes[row]][self._slots[row]] = row
+            moved = (self._items[row], row)
+
+        if np is None:
+            self._prices.pop()
+        self._codes.pop()
+        self._slots.pop()
+        self._items.pop()
+        self._size -= 1
+        return moved
+
+    def price(self, row: int) -> float:
+        return float(self._prices[row])
+
+    def set_price(self, row: int, price: float):
+        """Меняет цену строки и пересчитывает суммы"""
+        self._check_row(row)
+        delta = _kopecks(price) - _kopecks(float(self._prices[row]))
+        self._prices[row] = price
+        self._category_sums[self._codes[row]] += delta
+        self._total += delta
+
+    def category(self, row: int) -> str:
+        return self._category_names[self._codes[row]]
+
+    def set_category(self, row: int, category: str):
+        """Переносит строку в другую категорию"""
+        self._check_row(row)
+        code = self._category_code(category)
+        old_code = self._codes[row]
+        if code == old_code:
+            return
+        kopecks = _kopecks(float(self._prices[row]))
+        self._unlink(row)
+        self._category_sums[old_code] -= kopecks
+        self._codes[row] = code
+        self._slots[row] = len(self._category_rows[code])
+        self._category_rows[code].append(row)
+        self._category_sums[code] += kopecks
+
+    def rows(self, category: str) -> List[int]:
+        """Номера строк категории (копия списка из индекса)"""
+        code = self._category_codes.get(category)
+        return list(self._category_rows[code]) if code is not None else []
+
+    def items_in(self, category: str) -> List[Any]:
+        """Объекты товаров категории"""
+        code = self._category_codes.get(category)
+        if code is None:
+            return []
+        items = self._items
+        return [items[row] for row in self._category_rows[code]]
+
+    def count(self, category: str) -> int:
+        code = self._category_codes.get(category)
+        return len(self._category_rows[code]) if code is not None else 0
+
+    def category_total(self, category: str) -> float:
+        """Сумма цен категории (с точностью до копейки)"""
+        code = self._category_codes.get(category)
+        return self._category_sums[code] / 100 if code is not None else 0.0
+
+    def apply_discount(self, category: str, percent: float) -> int:
+        """
+        Снижает цены категории на percent процентов (с округлением до копеек)
+        Новые цены проверяются validate_range до записи: при ошибке ничего не меняется
+        Возвращает число изменённых строк
+        """
+        code = self._category_codes.get(category)
+        if code is None or not self._category_rows[code]:
+            return 0
+        rows = self._category_rows[code]
+        factor = percent / 100
+
+        if np is not None:
+            index = np.fromiter(rows, dtype=np.intp, count=len(rows))
+            old = self._prices[index]
+            new = np.round(old - old * factor, 2)
+            if self.validate_range:
+                self.validate_range(float(new.min()), float(new.max()))
+            self._prices[index] = new
+            new_sum = int(np.round(new * 100).sum())
+        else:
+            prices = self._prices
+            new = [round(prices[row] - prices[row] * factor, 2) for row in rows]
+            if self.validate_range:
+                self.validate_range(min(new), max(new))
+            for row, price in zip(rows, new):
+                prices[row] = price
+            new_sum = sum(map(_kopecks, new))
+
+        self._total += new_sum - self._category_sums[code]
+        self._category_sums[code] = new_sum
+        return len(rows)
+
+    def recompute(self):
+        """Пересчитывает суммы с нуля (проверка согласованности индекса)"""
+        sums = [0] * len(self._category_names)
+        for row in range(self._size):
+            sums[self._codes[row]] += _kopecks(float(self._prices[row]))
+        self._category_sums = sums
+        self._total = sum(sums)
+
+    def _category_code(self, category: str) -> int:
+        code = self._category_codes.get(category)
+        if code is None:
+            code = self._category_codes[category] = len(self._category_names)
+            self._category_names.append(category)
+            self._category_rows.append([])
+            self._category_sums.append(0)
+        return code
+
+    def _link_many(self, start: int, codes, prices):
+        """
+        Заносит строки start, start+1, ... в индекс категорий (ветка NumPy)
+        Строки группируются по категориям одной сортировкой вместо цикла по строкам
+        """
+        order = np.argsort(codes, kind="stable")
+        counts = np.bincount(codes, minlength=len(self._category_names))
+        # Суммы целых копеек во float64 точны, пока меньше 2**53 (~9e13 ₽)
+        sums = np.bincount(codes, weights=np.round(prices * 100), minlength=len(self._category_names))
+        slots = np.empty(len(codes), dtype=np.int32)
+        offset = 0
+        for code in np.flatnonzero(counts).tolist():
+            count = int(counts[code])
+            group = order[offset:offset + count]
+            rows = self._category_rows[code]
+            slots[group] = np.arange(len(rows), len(rows) + count, dtype=np.int32)
+            rows.extend((group + start).tolist())
+            self._category_sums[code] += int(sums[code])
+            offset += count
+        self._codes.frombytes(codes.astype(np.int32).tobytes())
+        self._slots.frombytes(slots.tobytes())
+        self._total += int(sums.sum())
+
+    def _unlink(self, row: int):
+        """Убирает строку из списка её категории (последний элемент встаёт на её место)"""
+        rows = self._category_rows[self._codes[row]]
+        slot = self._slots[row]
+        last_row = rows.pop()
+        if last_row != row:
+            rows[slot] = last_row
+            self._slots[last_row] = slot
+
+    def _check_row(self, row: int):
+        if not 0 <= row < self._size:
+            raise IndexError(f"нет строки {row} в каталоге")
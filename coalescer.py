@@ -0,0 +1,272 @@
+"""
+Склейка сообщений пользователя перед запросом к GigaChat
+Клиенты часто пишут вопрос несколькими короткими сообщениями подряд: сообщения,
+пришедшие с паузой меньше окна, объединяются в один вопрос, а ещё не ответивший
+конвейер этого пользователя отменяется - его сообщения войдут в новый вопрос
+"""
+
+import asyncio
+import heapq
+import itertools
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+
+class Turn:
+    """
+    Один вопрос пользователя из нескольких сообщений
+
+    items - исходные сообщения (для ответа используется последнее)
+    texts - их тексты, вопрос - тексты через перевод строки
+    """
+
+    def __init__(self, user_id: int, items: List[Any], texts: List[str]):
+        self.user_id = user_id
+        self.items = items
+        self.texts = texts
+        self.cancelled = False
+        self.answered = False
+        self._lock = threading.Lock()
+
+    @property
+    def text(self) -> str:
+        return "\n".join(self.texts)
+
+    @property
+    def last(self) -> Any:
+        return self.items[-1]
+
+    def try_answer(self) -> bool:
+        """Отмечает, что ответ отправляется; False, если вопрос уже заменён новым"""
+        with self._lock:
+            if self.cancelled:
+                return False
+            self.answered = True
+            return True
+
+    def try_cancel(self) -> bool:
+        """Отменяет вопрос, если ответ на него ещё не начали отправлять"""
+        with self._lock:
+            if self.answered:
+                return False
+            self.cancelled = True
+            return True
+
+
+class _UserState:
+    __slots__ = ("items", "texts", "first_arrival", "timer", "running")
+
+    def __init__(self):
+        self.items: List[Any] = []
+        self.texts: List[str] = []
+        self.first_arrival = 0.0
+        # Срок склейки (time.monotonic) или asyncio.TimerHandle отложенной склейки
+        self.timer = None
+        # Turn, который сейчас обрабатывается
+        self.running = None
+
+
+class _BaseCoalescer:
+    def __init__(self, window: float, max_delay: float):
+        self.window = window
+        self.max_delay = max(max_delay, window)
+        self._users: Dict[int, _UserState] = {}
+
+        # Счётчики
+        self.messages = 0
+        self.turns = 0
+        self.superseded = 0
+
+    def stats(self) -> Dict[str, int]:
+        """Сколько сообщений пришло, сколько вопросов обработано и сколько заменено"""
+        return {
+            "messages": self.messages,
+            "turns": self.turns,
+            "merged": self.messages - self.turns,
+            "superseded": self.superseded,
+            "waiting_users": len(self._users),
+        }
+
+    def _buffer(self, user_id: int, item: Any, text: str) -> tuple:
+        """Добавляет сообщение в буфер пользователя; возвращает (состояние, задержку)"""
+        now = time.monotonic()
+        state = self._users.get(user_id)
+        if state is None:
+            state = self._users[user_id] = _UserState()
+        if not state.items:
+            state.first_arrival = now
+        state.items.append(item)
+        state.texts.append(text)
+        self.messages += 1
+        # Окно отсчитывается от последнего сообщения, но не дольше max_delay от первого
+        delay = min(self.window, state.first_arrival + self.max_delay - now)
+        return state, max(delay, 0.0)
+
+    def _take_turn(self, user_id: int) -> tuple:
+        """
+        Забирает накопленные сообщения в Turn, поглощая неотвеченный предыдущий
+        Возвращает (turn или None, был ли отменён предыдущий вопрос)
+        """
+        state = self._users.get(user_id)
+        if state is None or not state.items:
+            return None, False
+        items, texts = state.items, state.texts
+        state.items, state.texts, state.timer = [], [], None
+
+        superseded = False
+        previous = state.running
+        if previous is not None and previous.try_cancel():
+            # Ответ на прошлый вопрос ещё не ушёл - отвечаем на всё сразу
+            items = previous.items + items
+            texts = previous.texts + texts
+            superseded = True
+            self.superseded += 1
+            self.turns -= 1
+
+        turn = Turn(user_id, items, texts)
+        state.running = turn
+        self.turns += 1
+        return turn, superseded
+
+    def _finish(self, turn: Turn):
+        state = self._users.get(turn.user_id)
+        if state is not None and state.running is turn:
+            state.running = None
+            if not state.items:
+                del self._users[turn.user_id]
+
+
+class MessageCoalescer(_BaseCoalescer):
+    """
+    Склейка сообщений для потокового движка
+
+    submit(turn) - ставит обработку вопроса в пул потоков и возвращает Future
+        (None, если вопрос не принят); не должна ждать самого ответа
+    window - пауза между сообщениями (сек), после которой вопрос считается полным
+    max_delay - сколько максимум ждать с первого сообщения, если пишут без пауз
+
+    Сроки склейки всех пользователей ждёт один поток (куча сроков); вопрос
+    считается обработанным, когда завершится его Future
+    """
+
+    def __init__(self, submit: Callable[[Turn], Optional[Future]], window: float = 0.6,
+                 max_delay: float = 3.0):
+        super().__init__(window, max_delay)
+        self.submit = submit
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        # Куча (срок, номер, user_id); записи, срок которых сдвинуло новое
+        # сообщение, пропускаются (срок не совпадает с state.timer)
+        self._deadlines: List[tuple] = []
+        self._sequence = itertools.count()
+        self._thread = None
+
+    def add(self, user_id: int, item: Any, text: str):
+        """Принимает сообщение; вопрос обработается, когда пользователь сделает паузу"""
+        with self._lock:
+            state, delay = self._buffer(user_id, item, text)
+            state.timer = time.monotonic() + delay
+            heapq.heappush(self._deadlines, (state.timer, next(self._sequence), user_id))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="coalescer", daemon=True)
+                self._thread.start()
+            self._wakeup.notify()
+
+    def flush(self):
+        """Сразу отправляет в обработку все накопленные сообщения (например, перед остановкой)"""
+        with self._lock:
+            turns = [self._take_turn(user_id)[0] for user_id, state in list(self._users.items())
+                     if state.items]
+            self._deadlines.clear()
+        for turn in turns:
+            self._dispatch(turn)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return super().stats()
+
+    def _run(self):
+        while True:
+            with self._lock:
+                user_id = self._next_due()
+                turn, _ = self._take_turn(user_id)
+            if turn is not None:
+                self._dispatch(turn)
+
+    def _next_due(self) -> int:
+        """Ждёт (под блокировкой) ближайший срок склейки и возвращает его user_id"""
+        while True:
+            if not self._deadlines:
+                self._wakeup.wait()
+                continue
+            deadline, _, user_id = self._deadlines[0]
+            wait = deadline - time.monotonic()
+            if wait > 0:
+                self._wakeup.wait(wait)
+                continue
+            heapq.heappop(self._deadlines)
+            state = self._users.get(user_id)
+            if state is not None and state.timer == deadline:
+                return user_id
+
+    def _dispatch(self, turn: Turn):
+        try:
+            future = self.submit(turn)
+        except Exception as e:
+            print(f"❌ Ошибка при обработке сообщения: {e}")
+            future = None
+        if future is None:
+            self._done(turn)
+        else:
+            future.add_done_callback(lambda _: self._done(turn))
+
+    def _done(self, turn: Turn):
+        with self._lock:
+            self._finish(turn)
+
+
+class AsyncMessageCoalescer(_BaseCoalescer):
+    """
+    Склейка сообщений для asyncio-движка: то же, что MessageCoalescer, но
+    неотвеченный конвейер не просто отбрасывается, а отменяется (task.cancel())
+
+    Методы вызываются только из потока event loop
+    """
+
+    def __init__(self, process: Callable[[Turn], Awaitable[None]], window: float = 0.6,
+                 max_delay: float = 3.0):
+        super().__init__(window, max_delay)
+        self.process = process
+        self._tasks: Dict[int, asyncio.Task] = {}
+
+    def add(self, user_id: int, item: Any, text: str):
+        """Принимает сообщение; вопрос обработается, когда пользователь сделает паузу"""
+        state, delay = self._buffer(user_id, item, text)
+        if state.timer is not None:
+            state.timer.cancel()
+        loop = asyncio.get_running_loop()
+        state.timer = loop.call_later(delay, self._flush, user_id)
+
+    def _flush(self, user_id: int):
+        turn, superseded = self._take_turn(user_id)
+        if turn is None:
+            return
+        previous_task = self._tasks.pop(user_id, None)
+        if superseded and previous_task is not None:
+            # Ответ на прошлый вопрос ещё не начали отправлять - прерываем его запросы
+            previous_task.cancel()
+        self._tasks[user_id] = asyncio.ensure_future(self._run(turn))
+
+    async def _run(self, turn: Turn):
+        try:
+            await self.process(turn)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            print(f"❌ Ошибка при обработке сообщения: {e}")
+        finally:
+            self._finish(turn)
+            if self._tasks.get(turn.user_id) is asyncio.current_task():
+                del self._tasks[turn.user_id]
@@ -0,0 +1,97 @@
+"""
+Кеш токена доступа GigaChat
+Хранит токен до истечения срока, обновляет его заранее в фоне
+и не допускает параллельных запросов за новым токеном
+"""
+
+import threading
+import time
+from typing import Callable, Optional, Tuple
+
+# Время жизни токена GigaChat по умолчанию (30 минут)
+DEFAULT_TOKEN_TTL = 30 * 60
+
+
+class GigaChatTokenManager:
+    """
+    Менеджер токена доступа GigaChat
+
+    fetch_token - функция без аргументов, возвращающая (token, expires_at)
+    или None при ошибке; expires_at - unix-время в секундах или None
+    refresh_ahead - за сколько секунд до истечения начинать фоновое обновление
+    expiry_margin - за сколько секунд до истечения токен считается недействительным
+    """
+
+    def __init__(self, fetch_token: Callable[[], Optional[Tuple[str, Optional[float]]]],
+                 refresh_ahead: float = 300, expiry_margin: float = 60):
+        self._fetch_token = fetch_token
+        self.refresh_ahead = refresh_ahead
+        self.expiry_margin = expiry_margin
+
+        self._token: Optional[str] = None
+        self._expires_at = 0.0
+
+        # Одно обновление в полёте: остальные вызывающие ждут его результата
+        self._lock = threading.Lock()
+        self._refresh_done = threading.Condition(self._lock)
+        self._refreshing = False
+
+    def cached_token(self) -> Optional[str]:
+        """
+        Действующий токен из кеша без ожидания (None, если его нужно запросить)
+        Если токен скоро истечёт, обновление запускается в фоне
+        """
+        with self._lock:
+            return self._cached_locked()
+
+    def get_token(self) -> Optional[str]:
+        """Возвращает действующий токен, при необходимости обновляя его"""
+        with self._lock:
+            token = self._cached_locked()
+            if token:
+                return token
+
+            # Токена нет или он истёк: ждём уже идущее обновление или запускаем своё
+            if self._refreshing:
+                while self._refreshing:
+                    self._refresh_done.wait()
+                return self._token if self._is_valid(time.time()) else None
+
+            self._refreshing = True
+
+        self._refresh()
+        with self._lock:
+            return self._token if self._is_valid(time.time()) else None
+
+    def invalidate(self):
+        """Сбрасывает токен (например, после ответа 401 от API)"""
+        with self._lock:
+            self._token = None
+            self._expires_at = 0.0
+
+    def _cached_locked(self) -> Optional[str]:
+        remaining = self._expires_at - time.time()
+        if not self._token or remaining <= self.expiry_margin:
+            return None
+        # Токен ещё действителен; если он скоро истечёт - обновляем в фоне
+        if remaining <= self.refresh_ahead and not self._refreshing:
+            self._refreshing = True
+            threading.Thread(target=self._refresh, daemon=True).start()
+        return self._token
+
+    def _is_valid(self, now: float) -> bool:
+        return bool(self._token) and self._expires_at - now > self.expiry_margin
+
+    def _refresh(self):
+        """Запрашивает новый токен и будит всех ожидающих"""
+        result = None
+        try:
+            result = self._fetch_token()
+        finally:
+            with self._lock:
+                if result:
+                    token, expires_at = result
+                    self._token = token
+                    self._expires_at = expires_at or (time.time() + DEFAULT_TOKEN_TTL)
+                self._refreshing = False
+                self._refresh_done.notify_all()
@@ -0,0 +1,257 @@
+"""
+Сжатие истории диалога по бюджету токенов
+Свежие сообщения отправляются в GigaChat как есть, пока укладываются в бюджет;
+более старые сворачиваются в накопительное краткое содержание, которое
+кешируется для каждого пользователя и дополняется по мере разговора.
+С хранилищем SQLite краткое содержание сохраняется в той же базе, что и история
+"""
+
+import math
+import re
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+_TOKEN = re.compile(r"\w+|[^\w\s]")
+
+# Сколько символов слова в среднем приходится на один токен
+CHARS_PER_TOKEN_ASCII = 4
+CHARS_PER_TOKEN_OTHER = 3
+
+# Служебные токены на каждое сообщение (роль, разделители)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# Заголовок сообщения с кратким содержанием (уходит в system prompt)
+SUMMARY_HEADER = "Краткое содержание предыдущей части разговора с клиентом:"
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Приблизительное число токенов текста без настоящего токенизатора:
+    слово длиной n даёт ceil(n / 4) токенов для латиницы и ceil(n / 3) для
+    кириллицы (она дробится мельче), каждый знак препинания - один токен
+    """
+    tokens = 0
+    for word in _TOKEN.findall(text or ""):
+        per_token = CHARS_PER_TOKEN_ASCII if word.isascii() else CHARS_PER_TOKEN_OTHER
+        tokens += math.ceil(len(word) / per_token)
+    return tokens
+
+
+def message_tokens(message: Dict[str, str]) -> int:
+    """Приблизительное число токенов сообщения вместе со служебными"""
+    return estimate_tokens(message.get("content", "")) + MESSAGE_OVERHEAD_TOKENS
+
+
+def summary_message(summary: str) -> Dict[str, str]:
+    """Сообщение с кратким содержанием в формате истории GigaChat"""
+    return {"role": "system", "content": f"{SUMMARY_HEADER}\n{summary}"}
+
+
+def extractive_summary(previous: Optional[str], messages: List[Dict[str, str]],
+                       max_tokens: int = 300) -> str:
+    """
+    Краткое содержание без обращения к модели: первые предложения реплик
+    Используется, если суммаризация через GigaChat недоступна
+    """
+    lines = previous.splitlines() if previous else []
+    for message in messages:
+        speaker = "Клиент" if message.get("role") == "user" else "Менеджер"
+        first_sentence = re.split(r"(?<=[.!?])\s", message.get("content", "").strip(), maxsplit=1)[0]
+        lines.append(f"{speaker}: {first_sentence[:200]}")
+
+    # Оставляем самые свежие строки, укладывающиеся в max_tokens
+    kept, total = [], 0
+    for line in reversed(lines):
+        total += estimate_tokens(line)
+        if kept and total > max_tokens:
+            break
+        kept.append(line)
+    return "\n".join(reversed(kept))
+
+
+def split_history(history: List[Dict[str, str]], budget: int,
+                  max_recent: int) -> Tuple[List[Dict[str, str]], List[Dict[str, str]]]:
+    """
+    Делит историю на (старые, свежие): свежие - самые новые сообщения, которые
+    укладываются в budget токенов, но не больше max_recent штук. Свежая часть
+    по возможности начинается с вопроса клиента; последнее сообщение
+    остаётся всегда, даже если одно не помещается в бюджет
+    """
+    start = len(history)
+    total = 0
+    while start > 0 and len(history) - start < max_recent:
+        tokens = message_tokens(history[start - 1])
+        if start < len(history) and total + tokens > budget:
+            break
+        total += tokens
+        start -= 1
+
+    # Не начинаем свежую часть с ответа менеджера без вопроса
+    while start < len(history) - 1 and history[start].get("role") != "user":
+        start += 1
+    return history[:start], history[start:]
+
+
+class _Summary:
+    __slots__ = ("text", "tokens", "folded")
+
+    def __init__(self):
+        self.text = ""
+        self.tokens = 0
+        # Сообщения (role, content), уже вошедшие в краткое содержание
+        self.folded = set()
+
+
+class HistoryCompactor:
+    """
+    Укладывает историю пользователей в бюджет токенов
+
+    summarize(previous, messages) - функция, дописывающая к предыдущему
+        краткому содержанию новые сообщения (например, запросом к GigaChat)
+    token_budget - сколько токенов истории (вместе с кратким содержанием)
+        отправлять в модель
+    max_recent - сколько последних сообщений максимум отправлять как есть;
+        должно быть меньше длины истории в хранилище, чтобы сообщения
+        попадали в краткое содержание до того, как хранилище их вытеснит
+    max_users - для скольких пользователей держать краткое содержание в памяти (LRU)
+    store - хранилище с get_summary/put_summary (SQLiteConversationStore), где
+        краткое содержание переживает перезапуск; None - только в памяти
+    """
+
+    def __init__(self, summarize: Callable[[Optional[str], List[Dict[str, str]]], Optional[str]],
+                 token_budget: int = 1500, max_recent: int = 8, max_users: int = 10000,
+                 store=None):
+        self.summarize = summarize
+        self.token_budget = token_budget
+        self.max_recent = max_recent
+        self.max_users = max_users
+        self.store = store
+
+        self._summaries: "OrderedDict[int, _Summary]" = OrderedDict()
+        self._lock = threading.Lock()
+        # Пользователи, для которых сейчас идёт суммаризация
+        self._refreshing = set()
+
+        # Счётчики
+        self.summaries = 0
+        self.summary_failures = 0
+        self.tokens_in = 0
+        self.tokens_out = 0
+
+    def compact(self, user_id: int, history: List[Dict[str, str]]) -> List[Dict[str, str]]:
+        """
+        Возвращает историю для запроса: краткое содержание (если есть) и
+        свежие сообщения в пределах бюджета. Не обращается к модели
+        """
+        state = self._state(user_id)
+        with self._lock:
+            summary, summary_tokens = state.text, state.tokens
+
+        budget = max(self.token_budget - summary_tokens, 0)
+        _, recent = split_history(history, budget, self.max_recent)
+        compacted = ([summary_message(summary)] if summary else []) + recent
+
+        tokens_in = sum(message_tokens(m) for m in history)
+        tokens_out = sum(message_tokens(m) for m in compacted)
+        with self._lock:
+            self.tokens_in += tokens_in
+            self.tokens_out += tokens_out
+        return compacted
+
+    def refresh(self, user_id: int, history: List[Dict[str, str]]):
+        """
+        Сворачивает в краткое содержание сообщения, вышедшие за бюджет
+        Вызывается после ответа (в фоне): делает запрос к модели, если есть что свернуть
+        """
+        state = self._state(user_id)
+        with self._lock:
+            if user_id in self._refreshing:
+                return
+            budget = max(self.token_budget - state.tokens, 0)
+            older, _ = split_history(history, budget, self.max_recent)
+            pending = [m for m in older if (m.get("role"), m.get("content")) not in state.folded]
+            if not pending:
+                return
+            self._refreshing.add(user_id)
+            previous = state.text
+
+        try:
+            summary = self.summarize(previous or None, pending)
+        except Exception as e:
+            print(f"❌ Ошибка при сжатии истории: {e}")
+            summary = None
+
+        with self._lock:
+            self._refreshing.discard(user_id)
+            if not summary:
+                self.summary_failures += 1
+                return
+            state = self._summaries.get(user_id) or _Summary()
+            state.text = summary.strip()
+            state.tokens = message_tokens(summary_message(state.text))
+            # Помним только сообщения, которые ещё есть в истории хранилища
+            present = {(m.get("role"), m.get("content")) for m in history}
+            state.folded = (state.folded | {(m.get("role"), m.get("content")) for m in pending}) & present
+            self._remember(user_id, state)
+            self.summaries += 1
+            text, folded = state.text, sorted(state.folded)
+
+        if self.store is not None:
+            try:
+                self.store.put_summary(user_id, text, folded)
+            except Exception as e:
+                print(f"❌ Ошибка сохранения краткого содержания: {e}")
+
+    def forget(self, user_id: int):
+        """Удаляет краткое содержание пользователя (например, по /clear)"""
+        with self._lock:
+            self._summaries.pop(user_id, None)
+
+    def _state(self, user_id: int) -> _Summary:
+        """Краткое содержание пользователя: из памяти или, при промахе, из хранилища"""
+        with self._lock:
+            state = self._summaries.get(user_id)
+            if state is not None:
+                self._summaries.move_to_end(user_id)
+                return state
+
+        state = _Summary()
+        if self.store is None:
+            return state
+        try:
+            saved = self.store.get_summary(user_id)
+        except Exception as e:
+            print(f"❌ Ошибка чтения краткого содержания: {e}")
+            saved = None
+        if saved:
+            state.text, folded = saved
+            state.tokens = message_tokens(summary_message(state.text))
+            state.folded = set(folded)
+
+        with self._lock:
+            # Пока читали из хранилища, краткое содержание могло обновиться
+            current = self._summaries.get(user_id)
+            if current is not None:
+                return current
+            # Пустое состояние тоже запоминаем, чтобы не обращаться к базе на каждый вопрос
+            self._remember(user_id, state)
+            return state
+
+    def _remember(self, user_id: int, state: _Summary):
+        self._summaries[user_id] = state
+        self._summaries.move_to_end(user_id)
+        while len(self._summaries) > self.max_users:
+            self._summaries.popitem(last=False)
+
+    def stats(self) -> Dict[str, float]:
+        """Счётчики сжатия и экономия входных токенов"""
+        with self._lock:
+            return {
+                "users": len(self._summaries),
+                "summaries": self.summaries,
+                "summary_failures": self.summary_failures,
+                "tokens_in": self.tokens_in,
+                "tokens_out": self.tokens_out,
+                "saved_ratio": round(1 - self.tokens_out / self.tokens_in, 4) if self.tokens_in else 0.0,
+            }
@@ -0,0 +1,367 @@
+"""
+Хранилища истории диалогов
+
+ConversationStore - в памяти процесса: ограничивает число пользователей (LRU),
+время хранения (TTL) и общий объём памяти; история каждого пользователя -
+кольцевой буфер фиксированной длины
+
+SQLiteConversationStore - общий файл SQLite (WAL): история переживает перезапуск
+и доступна нескольким процессам бота на одной машине; там же хранится краткое
+содержание старой части диалога (history_compactor)
+"""
+
+import json
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Dict, List, Optional, Tuple
+
+
+class _Conversation:
+    """История одного пользователя: кольцевой буфер пар (role, content)"""
+
+    __slots__ = ("messages", "size", "last_access")
+
+    def __init__(self, max_messages: int):
+        self.messages: deque = deque(maxlen=max_messages)
+        self.size = 0
+        self.last_access = 0.0
+
+
+def _message_size(content: str) -> int:
+    """Приблизительный размер сообщения в памяти (байт)"""
+    return sys.getsizeof(content) + 64
+
+
+class ConversationStore:
+    """
+    Потокобезопасное хранилище историй с вытеснением
+
+    max_messages - длина истории одного пользователя
+    max_users - сколько пользователей держать в памяти (вытесняются давно неактивные)
+    ttl - через сколько секунд без сообщений история удаляется (0 - не удалять)
+    max_bytes - ограничение на приблизительный объём всех историй
+    """
+
+    def __init__(self, max_messages: int = 10, max_users: int = 10000,
+                 ttl: float = 24 * 60 * 60, max_bytes: int = 64 * 1024 * 1024):
+        self.max_messages = max_messages
+        self.max_users = max_users
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+
+        # Порядок ключей - от давно неактивных к недавним (LRU)
+        self._conversations: "OrderedDict[int, _Conversation]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self._messages = 0
+
+        # Счётчики вытеснений
+        self.evicted_lru = 0
+        self.evicted_ttl = 0
+        self.evicted_memory = 0
+
+    def get(self, user_id: int) -> List[Dict[str, str]]:
+        """Возвращает копию истории пользователя в формате сообщений GigaChat"""
+        with self._lock:
+            now = time.time()
+            self._expire(now)
+            conversation = self._conversations.get(user_id)
+            if conversation is None:
+                return []
+            conversation.last_access = now
+            self._conversations.move_to_end(user_id)
+            return [{"role": role, "content": content} for role, content in conversation.messages]
+
+    def append(self, user_id: int, messages: List[Tuple[str, str]]):
+        """Добавляет сообщения (role, content) в конец истории пользователя"""
+        with self._lock:
+            now = time.time()
+            self._expire(now)
+            conversation = self._conversations.get(user_id)
+            if conversation is None:
+                conversation = _Conversation(self.max_messages)
+                self._conversations[user_id] = conversation
+            else:
+                self._conversations.move_to_end(user_id)
+            conversation.last_access = now
+
+            for role, content in messages:
+                if len(conversation.messages) == conversation.messages.maxlen:
+                    # Самое старое сообщение выпадет из кольцевого буфера
+                    dropped = _message_size(conversation.messages[0][1])
+                    conversation.size -= dropped
+                    self._bytes -= dropped
+                    self._messages -= 1
+                conversation.messages.append((role, content))
+                size = _message_size(content)
+                conversation.size += size
+                self._bytes += size
+                self._messages += 1
+
+            self._enforce_limits()
+
+    def append_turn(self, user_id: int, question: str, answer: str):
+        """Сохраняет вопрос пользователя и ответ бота"""
+        self.append(user_id, [("user", question), ("assistant", answer)])
+
+    def clear(self, user_id: int) -> bool:
+        """Удаляет историю пользователя; возвращает True, если она была"""
+        with self._lock:
+            conversation = self._conversations.pop(user_id, None)
+            if conversation is None:
+                return False
+            self._forget(conversation)
+            return True
+
+    def __contains__(self, user_id: int) -> bool:
+        with self._lock:
+            return user_id in self._conversations
+
+    def __len__(self) -> int:
+        return len(self._conversations)
+
+    def stats(self) -> Dict[str, int]:
+        """Размер хранилища и счётчики вытеснений"""
+        with self._lock:
+            return {
+                "users": len(self._conversations),
+                "messages": self._messages,
+                "bytes": self._bytes,
+                "evicted_lru": self.evicted_lru,
+                "evicted_ttl": self.evicted_ttl,
+                "evicted_memory": self.evicted_memory,
+            }
+
+    def close(self):
+        """Нечего сохранять: история живёт только в памяти"""
+
+    def _forget(self, conversation: _Conversation):
+        self._bytes -= conversation.size
+        self._messages -= len(conversation.messages)
+
+    def _expire(self, now: float):
+        """Удаляет истории без активности дольше ttl (они в начале LRU-порядка)"""
+        if not self.ttl:
+            return
+        while self._conversations:
+            user_id, conversation = next(iter(self._conversations.items()))
+            if now - conversation.last_access <= self.ttl:
+                break
+            self._conversations.popitem(last=False)
+            self._forget(conversation)
+            self.evicted_ttl += 1
+
+    def _enforce_limits(self):
+        """
+        Вытесняет давно неактивных пользователей сверх лимитов
+        История текущего пользователя стоит в конце LRU-порядка и не вытесняется
+        """
+        while len(self._conversations) > self.max_users:
+            _, conversation = self._conversations.popitem(last=False)
+            self._forget(conversation)
+            self.evicted_lru += 1
+
+        while self._bytes > self.max_bytes and len(self._conversations) > 1:
+            _, conversation = self._conversations.popitem(last=False)
+            self._forget(conversation)
+            self.evicted_memory += 1
+
+
+class SQLiteConversationStore:
+    """
+    История диалогов в SQLite с тем же интерфейсом, что у ConversationStore
+
+    Файл базы открывается в режиме WAL, поэтому несколько процессов бота
+    могут одновременно читать и писать одну историю. Записи копятся в буфере
+    и сбрасываются одной транзакцией фоновым потоком: когда набралось
+    batch_size сообщений или прошло flush_interval секунд.
+    Несброшенные записи видны чтению в этом же процессе сразу.
+    """
+
+    def __init__(self, path: str, max_messages: int = 10, ttl: float = 24 * 60 * 60,
+                 batch_size: int = 50, flush_interval: float = 0.2):
+        self.path = path
+        self.max_messages = max_messages
+        self.ttl = ttl
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        self._connection = sqlite3.connect(path, timeout=5.0, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.executescript("""
+            CREATE TABLE IF NOT EXISTS messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                role TEXT NOT NULL,
+                content TEXT NOT NULL,
+                created_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_messages_user ON messages(user_id, id);
+            CREATE INDEX IF NOT EXISTS idx_messages_created ON messages(created_at);
+            CREATE TABLE IF NOT EXISTS summaries (
+                user_id INTEGER PRIMARY KEY,
+                text TEXT NOT NULL,
+                folded TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            );
+        """)
+        self._connection.commit()
+
+        # Буфер записей (user_id, role, content, created_at); соединение и буфер
+        # защищены одной блокировкой
+        self._pending: List[Tuple[int, str, str, float]] = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._closed = False
+        self._last_expire = 0.0
+
+        # Счётчики записи
+        self.flushes = 0
+        self.rows_written = 0
+
+        self._writer = threading.Thread(target=self._flush_loop, name="history-writer", daemon=True)
+        self._writer.start()
+
+    def get(self, user_id: int) -> List[Dict[str, str]]:
+        """Возвращает последние max_messages сообщений пользователя"""
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT role, content, created_at FROM messages WHERE user_id = ? "
+                "ORDER BY id DESC LIMIT ?",
+                (user_id, self.max_messages),
+            ).fetchall()
+            rows.reverse()
+            rows.extend((role, content, created_at)
+                        for uid, role, content, created_at in self._pending if uid == user_id)
+
+        if self.ttl:
+            # Если пользователь молчал дольше ttl, история считается устаревшей
+            if rows and time.time() - rows[-1][2] > self.ttl:
+                return []
+        return [{"role": role, "content": content}
+                for role, content, _ in rows[-self.max_messages:]]
+
+    def get_summary(self, user_id: int) -> Optional[Tuple[str, List[Tuple[str, str]]]]:
+        """Краткое содержание диалога и свёрнутые в него сообщения (role, content) или None"""
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT text, folded, updated_at FROM summaries WHERE user_id = ?", (user_id,)
+            ).fetchone()
+        if row is None or (self.ttl and time.time() - row[2] > self.ttl):
+            return None
+        return row[0], [tuple(message) for message in json.loads(row[1])]
+
+    def put_summary(self, user_id: int, text: str, folded: List[Tuple[str, str]]):
+        """Сохраняет краткое содержание диалога (сразу, без буфера)"""
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO summaries (user_id, text, folded, updated_at) VALUES (?, ?, ?, ?)",
+                (user_id, text, json.dumps(folded, ensure_ascii=False), time.time()),
+            )
+            self._connection.commit()
+
+    def append(self, user_id: int, messages: List[Tuple[str, str]]):
+        """Добавляет сообщения (role, content) в буфер записи"""
+        now = time.time()
+        with self._lock:
+            self._pending.extend((user_id, role, content, now) for role, content in messages)
+            if len(self._pending) >= self.batch_size:
+                self._wakeup.notify()
+
+    def append_turn(self, user_id: int, question: str, answer: str):
+        """Сохраняет вопрос пользователя и ответ бота"""
+        self.append(user_id, [("user", question), ("assistant", answer)])
+
+    def clear(self, user_id: int) -> bool:
+        """Удаляет историю пользователя; возвращает True, если она была"""
+        with self._lock:
+            pending = len(self._pending)
+            self._pending = [row for row in self._pending if row[0] != user_id]
+            deleted = self._connection.execute(
+                "DELETE FROM messages WHERE user_id = ?", (user_id,)
+            ).rowcount
+            self._connection.execute("DELETE FROM summaries WHERE user_id = ?", (user_id,))
+            self._connection.commit()
+            return deleted > 0 or len(self._pending) != pending
+
+    def __contains__(self, user_id: int) -> bool:
+        return bool(self.get(user_id))
+
+    def stats(self) -> Dict[str, int]:
+        """Размер базы и счётчики записи"""
+        with self._lock:
+            users, messages = self._connection.execute(
+                "SELECT COUNT(DISTINCT user_id), COUNT(*) FROM messages"
+            ).fetchone()
+            return {
+                "users": users,
+                "messages": messages,
+                "pending": len(self._pending),
+                "flushes": self.flushes,
+                "rows_written": self.rows_written,
+            }
+
+    def flush(self):
+        """Сбрасывает буфер записей в базу одной транзакцией"""
+        with self._lock:
+            self._flush_locked()
+
+    def close(self):
+        """Сбрасывает буфер, останавливает фоновый поток и закрывает базу"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._wakeup.notify()
+        self._writer.join(timeout=5)
+        with self._lock:
+            try:
+                self._flush_locked()
+            finally:
+                self._connection.close()
+
+    def _flush_loop(self):
+        with self._lock:
+            while not self._closed:
+                self._wakeup.wait(self.flush_interval)
+                try:
+                    self._flush_locked()
+                except sqlite3.Error as e:
+                    print(f"❌ Ошибка записи истории в SQLite: {e}")
+
+    def _flush_locked(self):
+        now = time.time()
+        if self._pending:
+            # Буфер очищается только после commit: при ошибке SQLite записи
+            # остаются в _pending и уходят в базу при следующем сбросе
+            batch = self._pending
+            users = {row[0] for row in batch}
+            try:
+                self._connection.executemany(
+                    "INSERT INTO messages (user_id, role, content, created_at) VALUES (?, ?, ?, ?)",
+                    batch,
+                )
+                # Оставляем только последние max_messages сообщений каждого пользователя
+                self._connection.executemany(
+                    "DELETE FROM messages WHERE user_id = ? AND id NOT IN "
+                    "(SELECT id FROM messages WHERE user_id = ? ORDER BY id DESC LIMIT ?)",
+                    [(user_id, user_id, self.max_messages) for user_id in users],
+                )
+                self._connection.commit()
+            except sqlite3.Error:
+                self._connection.rollback()
+                raise
+            self._pending = []
+            self.flushes += 1
+            self.rows_written += len(batch)
+
+        # Раз в минуту удаляем истории, устаревшие по ttl
+        if self.ttl and now - self._last_expire > 60:
+            self._last_expire = now
+            self._connection.execute("DELETE FROM messages WHERE created_at < ?", (now - self.ttl,))
+            self._connection.execute("DELETE FROM summaries WHERE updated_at < ?", (now - self.ttl,))
+            self._connection.commit()
@@ -0,0 +1,212 @@
+"""
+Кеш сгенерированных картинок товаров
+Картинки хранятся на диске по хешу содержимого и находятся по нормализованному
+промпту или по категории товара; для каждой картинки запоминается file_id
+Telegram, чтобы повторно отправлять её без загрузки байтов
+"""
+
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from typing import Dict, Optional
+
+from response_cache import normalize_question
+
+# Ключевые слова категорий офисной техники (в вопросах клиентов и в английских промптах)
+# Порядок важен: МФУ проверяется раньше принтера и сканера
+CATEGORY_KEYWORDS = {
+    "mfp": ("мфу", "многофункциональн", "mfp", "multifunction", "multi-function", "all-in-one"),
+    "copier": ("копир", "ксерокс", "copier", "photocopier"),
+    "printer": ("принтер", "printer"),
+    "scanner": ("сканер", "scanner"),
+    "fax": ("факс", "fax"),
+    "shredder": ("шредер", "уничтожител", "shredder"),
+    "laminator": ("ламинатор", "laminator"),
+    "projector": ("проектор", "projector"),
+}
+
+# Окончания существительных и прилагательных после основы: «принтера», «МФУ»,
+# «многофункциональное», «printers»; глаголы вроде «скопировать» и «копирование»
+# не совпадают ни с одной основой
+_ENDINGS = (r"(?:а|я|у|ю|ом|ем|ой|ей|е|и|ы|ь|ов|ев|ам|ям|ами|ями|ах|ях"
+            r"|ый|ий|ое|ее|ого|его|ому|ему|ые|ие|ых|их|ым|им|ыми|ими|ая|ую|s|es)?")
+_CATEGORY_PATTERNS = {
+    category: re.compile(r"\b(?:" + "|".join(map(re.escape, keywords)) + ")" + _ENDINGS + r"\b")
+    for category, keywords in CATEGORY_KEYWORDS.items()
+}
+
+
+def detect_category(*texts: Optional[str]) -> Optional[str]:
+    """Определяет категорию товара по первому тексту, где она упоминается (целым словом)"""
+    for text in texts:
+        if not text:
+            continue
+        lowered = text.lower().replace("ё", "е")
+        for category, pattern in _CATEGORY_PATTERNS.items():
+            if pattern.search(lowered):
+                return category
+    return None
+
+
+class CachedImage:
+    """Картинка для отправки: байты или файл из кеша и, если известен, file_id Telegram"""
+
+    __slots__ = ("blob", "path", "data", "file_id")
+
+    def __init__(self, blob: Optional[str] = None, path: Optional[str] = None,
+                 data: Optional[bytes] = None, file_id: Optional[str] = None):
+        self.blob = blob
+        self.path = path
+        self.data = data
+        self.file_id = file_id
+
+    def read(self) -> bytes:
+        """Возвращает байты картинки"""
+        if self.data is None:
+            with open(self.path, "rb") as f:
+                self.data = f.read()
+        return self.data
+
+
+class ImageCache:
+    """
+    Дисковый кеш картинок с адресацией по содержимому
+
+    directory - каталог кеша (картинки в blobs/, индекс в index.json)
+    max_bytes - ограничение объёма картинок; вытесняются давно не использованные
+    """
+
+    def __init__(self, directory: str, max_bytes: int = 500 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._blobs_dir = os.path.join(directory, "blobs")
+        self._index_path = os.path.join(directory, "index.json")
+        os.makedirs(self._blobs_dir, exist_ok=True)
+
+        # keys: "prompt:<хеш>" / "category:<имя>" -> хеш картинки
+        # blobs: хеш картинки -> {"size", "last_used", "file_id"}
+        self._keys: Dict[str, str] = {}
+        self._blobs: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+        self._load_index()
+
+        # Счётчики
+        self.prompt_hits = 0
+        self.category_hits = 0
+        self.misses = 0
+
+    def lookup(self, prompt: Optional[str] = None,
+               category: Optional[str] = None) -> Optional[CachedImage]:
+        """Ищет картинку сначала по промпту, затем по категории товара"""
+        with self._lock:
+            if prompt:
+                image = self._get(self._prompt_key(prompt))
+                if image:
+                    self.prompt_hits += 1
+                    return image
+            if category:
+                image = self._get(f"category:{category}")
+                if image:
+                    self.category_hits += 1
+                    return image
+            self.misses += 1
+            return None
+
+    def store(self, prompt: Optional[str], category: Optional[str],
+              image_bytes: bytes) -> CachedImage:
+        """Сохраняет картинку на диск и привязывает её к промпту и категории"""
+        blob = hashlib.sha256(image_bytes).hexdigest()
+        path = self._blob_path(blob)
+
+        with self._lock:
+            if blob not in self._blobs:
+                tmp_path = f"{path}.tmp"
+                with open(tmp_path, "wb") as f:
+                    f.write(image_bytes)
+                os.replace(tmp_path, path)
+                self._blobs[blob] = {"size": len(image_bytes), "last_used": time.time(), "file_id": None}
+
+            if prompt:
+                self._keys[self._prompt_key(prompt)] = blob
+            if category:
+                self._keys.setdefault(f"category:{category}", blob)
+
+            self._evict()
+            self._save_index()
+            return CachedImage(blob, path, image_bytes, self._blobs[blob]["file_id"])
+
+    def remember_file_id(self, blob: str, file_id: str):
+        """Запоминает file_id Telegram, полученный после первой загрузки картинки"""
+        with self._lock:
+            meta = self._blobs.get(blob)
+            if meta is not None:
+                meta["file_id"] = file_id
+                self._save_index()
+
+    def forget_file_id(self, blob: str):
+        """Сбрасывает file_id, если Telegram перестал его принимать"""
+        self.remember_file_id(blob, None)
+
+    def stats(self) -> Dict[str, int]:
+        """Размер кеша и счётчики попаданий"""
+        with self._lock:
+            return {
+                "images": len(self._blobs),
+                "bytes": sum(meta["size"] for meta in self._blobs.values()),
+                "prompt_hits": self.prompt_hits,
+                "category_hits": self.category_hits,
+                "misses": self.misses,
+            }
+
+    def _prompt_key(self, prompt: str) -> str:
+        normalized = normalize_question(prompt)
+        return "prompt:" + hashlib.sha1(normalized.encode("utf-8")).hexdigest()
+
+    def _blob_path(self, blob: str) -> str:
+        return os.path.join(self._blobs_dir, f"{blob}.img")
+
+    def _get(self, key: str) -> Optional[CachedImage]:
+        blob = self._keys.get(key)
+        if blob is None:
+            return None
+        path = self._blob_path(blob)
+        meta = self._blobs.get(blob)
+        if meta is None or not os.path.exists(path):
+            self._keys.pop(key, None)
+            return None
+        meta["last_used"] = time.time()
+        return CachedImage(blob, path, None, meta["file_id"])
+
+    def _evict(self):
+        """Удаляет давно не использованные картинки сверх max_bytes"""
+        total = sum(meta["size"] for meta in self._blobs.values())
+        if total <= self.max_bytes:
+            return
+        for blob, meta in sorted(self._blobs.items(), key=lambda item: item[1]["last_used"]):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(self._blob_path(blob))
+            except OSError:
+                pass
+            total -= meta["size"]
+            del self._blobs[blob]
+        self._keys = {key: blob for key, blob in self._keys.items() if blob in self._blobs}
+
+    def _load_index(self):
+        try:
+            with open(self._index_path, "r", encoding="utf-8") as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return
+        self._keys = index.get("keys", {})
+        self._blobs = index.get("blobs", {})
+
+    def _save_index(self):
+        tmp_path = f"{self._index_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"keys": self._keys, "blobs": self._blobs}, f)
+        os.replace(tmp_path, self._index_path)
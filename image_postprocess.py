@@ -0,0 +1,129 @@
+"""
+Подготовка сгенерированной картинки к отправке в Telegram
+gpt-image-1 возвращает PNG в полном разрешении (несколько МБ в base64), а Telegram
+всё равно пережимает фото; картинка уменьшается до нужного размера и
+перекодируется в JPEG или WebP, base64 декодируется по частям без лишних копий
+Для пережатия нужен Pillow; без него картинка отправляется как есть
+"""
+
+import binascii
+import threading
+from io import BytesIO
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+# Размер части base64 при декодировании (кратен 4 символам)
+B64_CHUNK_CHARS = 64 * 1024
+
+FORMATS = {"jpeg": "JPEG", "jpg": "JPEG", "webp": "WEBP"}
+
+
+def decode_b64(data: str, chunk_chars: int = B64_CHUNK_CHARS) -> bytearray:
+    """
+    Декодирует base64 по частям прямо в буфер результата
+    base64.b64decode(str) сначала копирует всю строку в bytes, здесь в памяти
+    одновременно только строка, результат и одна небольшая часть. Возвращается
+    сам буфер (bytearray) без копирования в bytes: Pillow, hashlib, запись в файл
+    и отправка в Telegram принимают его так же, как bytes
+    Base64 с переводами строк (MIME) тоже декодируется: пробельные символы
+    убираются из каждой части, а остаток до кратного 4 переносится в следующую
+    """
+    chunk_chars -= chunk_chars % 4
+    out = bytearray(len(data) // 4 * 3)
+    size = 0
+    carry = ""
+    for start in range(0, len(data), chunk_chars):
+        # Без пробельных символов split и join возвращают ту же строку без копирования
+        piece = carry + "".join(data[start:start + chunk_chars].split())
+        usable = len(piece) - len(piece) % 4
+        carry = piece[usable:]
+        decoded = binascii.a2b_base64(piece[:usable])
+        out[size:size + len(decoded)] = decoded
+        size += len(decoded)
+    if carry:
+        # Неполная группа в конце: a2b_base64 сообщит об ошибке так же, как b64decode
+        decoded = binascii.a2b_base64(carry)
+        out[size:size + len(decoded)] = decoded
+        size += len(decoded)
+    del out[size:]
+    return out
+
+
+class ImagePostprocessor:
+    """
+    Уменьшение и перекодирование картинок
+
+    max_side - максимальная сторона в пикселях (0 - не уменьшать)
+    image_format - jpeg или webp
+    quality - качество сжатия (1-95)
+    """
+
+    def __init__(self, max_side: int = 1280, image_format: str = "jpeg", quality: int = 85):
+        self.max_side = max_side
+        self.format = FORMATS.get(image_format.lower(), "JPEG")
+        self.quality = quality
+
+        # Счётчики (картинки обрабатываются в нескольких потоках)
+        self._lock = threading.Lock()
+        self.processed = 0
+        self.failed = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    @property
+    def available(self) -> bool:
+        return Image is not None
+
+    def process(self, data: bytes) -> bytes:
+        """Возвращает пережатую картинку; исходные байты, если пережать не удалось или нет смысла"""
+        if Image is None:
+            return data
+        try:
+            result = self._encode(data)
+        except (OSError, ValueError) as e:
+            print(f"⚠️  Не удалось пережать картинку, отправляем как есть: {e}")
+            with self._lock:
+                self.failed += 1
+            return data
+        if len(result) >= len(data):
+            result = data
+        with self._lock:
+            self.processed += 1
+            self.bytes_in += len(data)
+            self.bytes_out += len(result)
+        return result
+
+    def stats(self) -> dict:
+        """Число обработанных картинок и экономия объёма"""
+        with self._lock:
+            return {
+                "processed": self.processed,
+                "failed": self.failed,
+                "bytes_in": self.bytes_in,
+                "bytes_out": self.bytes_out,
+                "saved_ratio": round(1 - self.bytes_out / self.bytes_in, 4) if self.bytes_in else 0.0,
+            }
+
+    def _encode(self, data: bytes) -> bytes:
+        with Image.open(BytesIO(data)) as image:
+            if self.max_side:
+                # thumbnail сохраняет пропорции и не увеличивает маленькие картинки
+                image.thumbnail((self.max_side, self.max_side), Image.LANCZOS)
+            if image.mode in ("RGBA", "LA", "P"):
+                # Прозрачный фон - на белый (JPEG без альфа-канала)
+                image = image.convert("RGBA")
+                background = Image.new("RGB", image.size, (255, 255, 255))
+                background.paste(image, mask=image.getchannel("A"))
+                image = background
+            elif image.mode != "RGB":
+                image = image.convert("RGB")
+
+            out = BytesIO()
+            if self.format == "WEBP":
+                image.save(out, "WEBP", quality=self.quality, method=4)
+            else:
+                image.save(out, "JPEG", quality=self.quality, optimize=True, progressive=True)
+            return out.getvalue()
@@ -0,0 +1,152 @@
+"""
+Локальный классификатор: нужна ли картинка к ответу
+Правила по ключевым словам плюс маленький наивный байесовский классификатор,
+обученный на встроенных примерах; работает без сетевых запросов
+"""
+
+import math
+import re
+from collections import Counter
+from typing import Iterable, List, Optional, Tuple
+
+from image_cache import detect_category
+
+_WORD = re.compile(r"\w+")
+
+# Длина основы слова: грубая замена стемминга для русской морфологии
+STEM_LENGTH = 5
+
+# Явная просьба показать товар
+SHOW_KEYWORDS = ("покаж", "как выгляд", "фото", "картинк", "изображен", "внешн", "дизайн")
+
+# Темы, к которым картинка ничего не добавляет
+SKIP_KEYWORDS = (
+    "спасиб", "благодар", "привет", "здравств", "до свидан",
+    "достав", "гарант", "оплат", "возврат", "обмен", "рассрочк",
+    "кредит", "адрес", "телефон", "график", "режим работ", "самовывоз",
+)
+
+# Обучающие примеры: (текст, нужна ли картинка)
+TRAINING_EXAMPLES = [
+    ("Какое МФУ выбрать для небольшого офиса?", True),
+    ("Посоветуйте лазерный принтер для дома", True),
+    ("Нужен цветной принтер для печати фотографий", True),
+    ("Какой сканер подойдёт для документов?", True),
+    ("Подберите копир на 5000 страниц в месяц", True),
+    ("Хочу компактное МФУ с Wi-Fi", True),
+    ("Что лучше: струйный или лазерный принтер?", True),
+    ("Нужен шредер для офиса на 10 человек", True),
+    ("Посоветуйте проектор для переговорной", True),
+    ("Ищу недорогой ламинатор формата А4", True),
+    ("Какой принтер выбрать для бухгалтерии?", True),
+    ("Нужно оборудовать рабочее место менеджера", True),
+    ("Подберите технику для нового офиса", True),
+    ("Есть ли у вас широкоформатный плоттер?", True),
+    ("Какой документ-сканер с автоподатчиком посоветуете?", True),
+    ("Хочу принтер с двусторонней печатью", True),
+    ("Спасибо за помощь!", False),
+    ("Сколько стоит доставка?", False),
+    ("Какая гарантия на технику?", False),
+    ("Можно оплатить картой?", False),
+    ("Как оформить возврат?", False),
+    ("Где находится ваш магазин?", False),
+    ("Какой у вас режим работы?", False),
+    ("Хорошо, понятно", False),
+    ("Да, подходит", False),
+    ("Нет, дороговато", False),
+    ("Сколько страниц в минуту он печатает?", False),
+    ("А какой расход тонера?", False),
+    ("Есть ли скидки для юрлиц?", False),
+    ("Можно забрать самовывозом?", False),
+    ("Выставьте счёт на организацию", False),
+    ("Сколько ждать заказ?", False),
+    ("Ок, беру", False),
+    ("Добрый день", False),
+]
+
+
+def tokenize(text: str) -> List[str]:
+    """Разбивает текст на основы слов"""
+    return [word[:STEM_LENGTH] for word in _WORD.findall(text.lower().replace("ё", "е"))]
+
+
+class NaiveBayesModel:
+    """Мультиномиальный наивный Байес с двумя классами и сглаживанием Лапласа"""
+
+    def __init__(self, examples: Iterable[Tuple[str, bool]]):
+        self._counts = {True: Counter(), False: Counter()}
+        self._docs = {True: 0, False: 0}
+        for text, label in examples:
+            self._counts[label].update(tokenize(text))
+            self._docs[label] += 1
+        self._totals = {label: sum(counts.values()) for label, counts in self._counts.items()}
+        self._vocabulary = len(set(self._counts[True]) | set(self._counts[False]))
+
+    def probability(self, text: str) -> float:
+        """Вероятность того, что к сообщению нужна картинка"""
+        total_docs = self._docs[True] + self._docs[False]
+        log_scores = {}
+        for label in (True, False):
+            score = math.log(self._docs[label] / total_docs)
+            denominator = self._totals[label] + self._vocabulary
+            for token in tokenize(text):
+                score += math.log((self._counts[label][token] + 1) / denominator)
+            log_scores[label] = score
+        # Нормируем через разность логарифмов, чтобы не было переполнения
+        diff = log_scores[False] - log_scores[True]
+        if diff > 50:
+            return 0.0
+        return 1.0 / (1.0 + math.exp(diff))
+
+
+class ImageDecision:
+    """Решение классификатора с причиной (для логов и настройки)"""
+
+    __slots__ = ("want_image", "reason", "score")
+
+    def __init__(self, want_image: bool, reason: str, score: Optional[float] = None):
+        self.want_image = want_image
+        self.reason = reason
+        self.score = score
+
+    def __str__(self):
+        verdict = "да" if self.want_image else "нет"
+        score = f", p={self.score:.2f}" if self.score is not None else ""
+        return f"{verdict} ({self.reason}{score})"
+
+
+class ImageIntentClassifier:
+    """
+    Решает, стоит ли генерировать картинку к ответу на сообщение
+
+    threshold - порог вероятности модели, выше которого картинка нужна
+    """
+
+    def __init__(self, threshold: float = 0.5,
+                 examples: Iterable[Tuple[str, bool]] = TRAINING_EXAMPLES):
+        self.threshold = threshold
+        self.model = NaiveBayesModel(examples)
+        self.decisions = Counter()
+
+    def decide(self, question: str) -> ImageDecision:
+        """Возвращает решение для сообщения пользователя"""
+        decision = self._decide(question)
+        self.decisions[decision.want_image] += 1
+        return decision
+
+    def _decide(self, question: str) -> ImageDecision:
+        lowered = question.lower().replace("ё", "е")
+
+        if any(keyword in lowered for keyword in SHOW_KEYWORDS):
+            return ImageDecision(True, "просьба показать")
+
+        category = detect_category(question)
+        if not category:
+            if any(keyword in lowered for keyword in SKIP_KEYWORDS):
+                return ImageDecision(False, "служебная тема")
+            if len(tokenize(question)) < 2:
+                return ImageDecision(False, "короткое сообщение")
+
+        score = self.model.probability(question)
+        reason = f"модель, категория {category}" if category else "модель"
+        return ImageDecision(score >= self.threshold, reason, score)
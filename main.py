@@ -3,81 +3,246 @@
 Демонстрирует обработку данных о продуктах с валидацией
 """
 
-from typing import List, Dict
+import sys
+import time
+from typing import List, Dict, Sequence
 from functools import wraps
 from datetime import datetime
 
+from catalog import Catalog
+
+# Допустимый диапазон цены
+MIN_PRICE = 0
+MAX_PRICE = 1000000
+
+
+def check_price_range(low: float, high: float):
+    """Проверяет, что цены от low до high допустимы"""
+    # NaN не меньше и не больше любой границы - проверяем отдельно
+    if low != low or high != high:
+        raise ValueError("Цена должна быть числом")
+    if low < MIN_PRICE:
+        raise ValueError("Цена не может быть отрицательной")
+    if high > MAX_PRICE:
+        raise ValueError("Цена слишком высокая")
+
+
+def check_prices(prices: List[float]):
+    """Проверяет список цен: диапазон - по min/max, NaN - по сумме (min и max его пропускают)"""
+    if not prices:
+        return
+    check_price_range(min(prices), max(prices))
+    total = sum(prices)
+    if total != total:
+        raise ValueError("Цена должна быть числом")
+
+
+def format_price(price: float) -> str:
+    """Цена для вывода: целая - без дробной части (75000), иначе до копеек (12.5)"""
+    price = float(price)
+    return str(int(price)) if price.is_integer() else str(round(price, 2))
+
+
+def check_discount(percent: float):
+    """Проверяет размер скидки в процентах"""
+    if not 0 <= percent <= 100:
+        raise ValueError("Скидка должна быть от 0 до 100%")
+
+
+_last_second = 0
+
+
+def epoch_seconds() -> int:
+    """
+    Текущее время в секундах Unix
+    Продукты, созданные в одну секунду, получают один и тот же объект int,
+    а не по отдельному числу на каждый продукт
+    """
+    global _last_second
+    now = int(time.time())
+    if now != _last_second:
+        _last_second = now
+    return _last_second
+
 
 def validate_price(func):
     """Декоратор для валидации цены продукта"""
     @wraps(func)
     def wrapper(self, price):
-        if price < 0:
-            raise ValueError("Цена не может быть отрицательной")
-        if price > 1000000:
-            raise ValueError("Цена слишком высокая")
+        check_price_range(price, price)
         return func(self, price)
     return wrapper
 
 
 class Product:
-    """Класс для представления продукта"""
+    """
+    Класс для представления продукта
+    После добавления в магазин цена и категория хранятся в его каталоге
+    
+    Продуктов в каталоге сотни тысяч, поэтому объект компактный: __slots__ вместо
+    __dict__, время создания - целое число секунд Unix, а одинаковые названия
+    категорий - одна и та же интернированная строка
+    """
     
-    def __init__(self, name: str, price: float, category: str = "Общее"):
+    __slots__ = ("name", "_price", "_category", "specs", "created_at", "_catalog", "_row")
+    
+    def __init__(self, name: str, price: float, category: str = "Общее", specs: str = ""):
         self.name = name
         self._price = price
-        self.category = category
-        self.created_at = datetime.now()
+        self._category = sys.intern(category)
+        self.specs = specs
+        self.created_at = epoch_seconds()
+        # Каталог магазина и строка в нём (None - продукт ещё не в магазине)
+        self._catalog = None
+        self._row = -1
     
     @property
     def price(self):
+        if self._catalog is not None:
+            return self._catalog.price(self._row)
         return self._price
     
     @price.setter
     @validate_price
     def price(self, value: float):
-        self._price = value
+        self._set_price(value)
+    
+    @property
+    def category(self):
+        if self._catalog is not None:
+            return self._catalog.category(self._row)
+        return self._category
+    
+    @category.setter
+    def category(self, value: str):
+        value = sys.intern(value)
+        if self._catalog is not None:
+            self._catalog.set_category(self._row, value)
+        self._category = value
+    
+    @property
+    def created(self) -> datetime:
+        """Время создания продукта (created_at - секунды Unix)"""
+        return datetime.fromtimestamp(self.created_at)
+    
+    def _set_price(self, value: float):
+        if self._catalog is not None:
+            self._catalog.set_price(self._row, value)
+        else:
+            self._price = value
     
     def apply_discount(self, percent: float) -> float:
         """Применяет скидку к цене"""
-        if not 0 <= percent <= 100:
-            raise ValueError("Скидка должна быть от 0 до 100%")
-        discount_amount = self._price * (percent / 100)
-        self._price = round(self._price - discount_amount, 2)
-        return self._price
+        check_discount(percent)
+        price = self.price
+        discount_amount = price * (percent / 100)
+        self._set_price(round(price - discount_amount, 2))
+        return self.price
     
     def __str__(self):
-        return f"{self.name} ({self.category}): {self._price}₽"
+        return f"{self.name} ({self.category}): {format_price(self.price)}₽"
     
     def __repr__(self):
-        return f"Product('{self.name}', {self._price}, '{self.category}')"
+        return f"Product('{self.name}', {format_price(self.price)}, '{self.category}')"
 
 
 class Store:
-    """Класс для управления магазином продуктов"""
+    """
+    Класс для управления магазином продуктов
+    Продукты хранятся в колоночном каталоге (catalog.py): выборка по категории
+    и общая стоимость не перебирают весь ассортимент
+    """
     
     def __init__(self, name: str):
         self.name = name
-        self.products: List[Product] = []
+        self.catalog = Catalog(validate_range=check_price_range)
+        # Подписчики на изменения ассортимента (например, поисковый индекс):
+        # объекты с методами add(product), remove(product) и update(product)
+        self.watchers = []
+    
+    def watch(self, watcher):
+        """Подписывает watcher на изменения ассортимента и передаёт ему текущие продукты"""
+        self.watchers.append(watcher)
+        for product in self.products:
+            watcher.add(product)
     
-    def add_product(self, product: Product):
+    @property
+    def products(self) -> Sequence[Product]:
+        """
+        Продукты магазина в порядке добавления (удаление меняет порядок)
+        Только для чтения: добавлять и удалять через add_product/remove_product
+        """
+        return self.catalog.items
+    
+    def add_product(self, product: Product, verbose: bool = True):
         """Добавляет продукт в магазин"""
-        self.products.append(product)
-        print(f"✓ Добавлен: {product}")
+        if product._catalog is not None:
+            raise ValueError(f"Продукт '{product.name}' уже добавлен в магазин")
+        check_price_range(product._price, product._price)
+        product._row = self.catalog.add(product, product._price, product._category)
+        product._catalog = self.catalog
+        for watcher in self.watchers:
+            watcher.add(product)
+        if verbose:
+            print(f"✓ Добавлен: {product}")
+    
+    def add_products(self, products: List[Product]):
+        """Добавляет продукты пачкой, без вывода (загрузка каталога из файла)"""
+        for product in products:
+            if product._catalog is not None:
+                raise ValueError(f"Продукт '{product.name}' уже добавлен в магазин")
+        prices = [product._price for product in products]
+        check_prices(prices)
+        start = self.catalog.extend(products, prices, [product._category for product in products])
+        catalog = self.catalog
+        for row, product in enumerate(products, start):
+            product._catalog, product._row = catalog, row
+        for watcher in self.watchers:
+            for product in products:
+                watcher.add(product)
+    
+    def update_product(self, product: Product, **changes):
+        """
+        Меняет поля продукта (name, price, category, specs) и сообщает подписчикам
+        Цена проверяется так же, как при присваивании product.price
+        """
+        for field, value in changes.items():
+            if field not in ("name", "price", "category", "specs"):
+                raise AttributeError(f"У продукта нет поля '{field}'")
+            setattr(product, field, value)
+        if product._catalog is self.catalog:
+            for watcher in self.watchers:
+                watcher.update(product)
+    
+    def remove_product(self, product: Product):
+        """Убирает продукт из магазина"""
+        if product._catalog is not self.catalog:
+            raise ValueError(f"Продукта '{product.name}' нет в магазине")
+        product._price, product._category = product.price, product.category
+        moved = self.catalog.remove(product._row)
+        if moved:
+            moved_product, row = moved
+            moved_product._row = row
+        product._catalog, product._row = None, -1
+        for watcher in self.watchers:
+            watcher.remove(product)
     
     def get_total_value(self) -> float:
         """Возвращает общую стоимость всех продуктов"""
-        return sum(product.price for product in self.products)
+        return self.catalog.total
+    
+    def get_category_value(self, category: str) -> float:
+        """Возвращает общую стоимость продуктов категории"""
+        return self.catalog.category_total(category)
     
     def get_products_by_category(self, category: str) -> List[Product]:
         """Возвращает продукты по категории"""
-        return [p for p in self.products if p.category == category]
+        return self.catalog.items_in(category)
     
     def apply_category_discount(self, category: str, percent: float):
         """Применяет скидку ко всем продуктам категории"""
-        products = self.get_products_by_category(category)
-        for product in products:
-            product.apply_discount(percent)
+        check_discount(percent)
+        self.catalog.apply_discount(category, percent)
         print(f"Скидка {percent}% применена к категории '{category}'")
     
     def print_inventory(self):
@@ -0,0 +1,319 @@
+"""
+Метрики конвейера бота: время стадий, счётчики и экспорт в формате Prometheus
+Каждая стадия (токен GigaChat, запрос ответа, промпт картинки, генерация
+картинки, отправка фото...) замеряется спаном и попадает в гистограмму;
+ошибки и израсходованные токены GigaChat считаются счётчиками, а статистика
+кешей, очередей и политик запросов подключается сборщиками. Идентификатор
+трассировки связывает все стадии одного сообщения в логе
+"""
+
+import asyncio
+import contextvars
+import functools
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# Границы корзин гистограммы, секунды: от быстрых запросов до генерации картинки
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+# Идентификатор трассировки текущего сообщения (наследуется задачами asyncio и
+# задачами пулов, которые копируют контекст)
+_trace_id: contextvars.ContextVar = contextvars.ContextVar("trace_id", default=None)
+
+_Labels = Tuple[Tuple[str, str], ...]
+
+
+def current_trace() -> Optional[str]:
+    """Идентификатор трассировки текущего сообщения или None"""
+    return _trace_id.get()
+
+
+def _labels(labels: Dict[str, Any]) -> _Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(labels: _Labels) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        key + '="' + value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+        for key, value in labels
+    )
+    return "{" + ",".join(escaped) + "}"
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Histogram:
+    """Гистограмма длительностей с фиксированными корзинами (как в Prometheus)"""
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # последняя корзина - +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """Оценка квантиля по корзинам (верхняя граница корзины, где он лежит)"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts[:-1]):
+            seen += count
+            if seen >= rank:
+                return self.buckets[i]
+        return float("inf")
+
+
+class Metrics:
+    """
+    Реестр метрик бота (потокобезопасный)
+
+    prefix - префикс имён метрик в экспорте
+    trace - печатать в лог каждый завершённый спан с идентификатором трассировки
+    """
+
+    def __init__(self, prefix: str = "bot", buckets: Tuple[float, ...] = DEFAULT_BUCKETS,
+                 trace: bool = False):
+        self.prefix = prefix
+        self.buckets = buckets
+        self.trace = trace
+        self._lock = threading.Lock()
+        self._histograms: Dict[Tuple[str, _Labels], Histogram] = {}
+        self._counters: Dict[Tuple[str, _Labels], float] = {}
+        # (имя, функция статистики, имя метки для вложенных словарей)
+        self._collectors: List[Tuple[str, Callable[[], Dict[str, Any]], Optional[str]]] = []
+
+    def observe(self, stage: str, seconds: float):
+        """Записывает длительность стадии"""
+        key = ("stage_duration_seconds", _labels({"stage": stage}))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(self.buckets)
+            histogram.observe(seconds)
+
+    def inc(self, name: str, value: float = 1, **labels: Any):
+        """Увеличивает счётчик name{labels} на value"""
+        key = (name, _labels(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def record_usage(self, usage: Optional[Dict[str, Any]]):
+        """Учитывает токены из поля usage ответа GigaChat"""
+        if not usage:
+            return
+        for kind in ("prompt_tokens", "completion_tokens"):
+            if usage.get(kind):
+                self.inc("gigachat_tokens_total", usage[kind], type=kind[:-len("_tokens")])
+
+    def span(self, stage: str, new_trace: bool = False) -> "_Span":
+        """
+        Замер стадии: with metrics.span('stage'): ...
+        new_trace - начать новую трассировку (обработка нового сообщения)
+        Исключение внутри спана считается ошибкой стадии
+        """
+        return _Span(self, stage, new_trace)
+
+    def timed(self, stage: str, new_trace: bool = False):
+        """Декоратор: замеряет каждый вызов функции (обычной или корутинной) как стадию"""
+        def decorator(fn):
+            if asyncio.iscoroutinefunction(fn):
+                @functools.wraps(fn)
+                async def async_wrapper(*args, **kwargs):
+                    with self.span(stage, new_trace):
+                        return await fn(*args, **kwargs)
+                return async_wrapper
+
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.span(stage, new_trace):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def add_collector(self, name: str, stats: Callable[[], Dict[str, Any]],
+                      label: Optional[str] = None):
+        """
+        Подключает статистику компонента (метод stats() кеша, пула, политики...)
+        Числа экспортируются как name_ключ; если stats возвращает вложенные
+        словари ({вид: {счётчик: число}}), вид становится меткой label
+        """
+        with self._lock:
+            self._collectors.append((name, stats, label))
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        """Сводка по стадиям: число вызовов, среднее, p50/p95 (сек), ошибки"""
+        with self._lock:
+            errors: Dict[str, float] = {}
+            for (name, labels), value in self._counters.items():
+                if name == "stage_errors_total":
+                    stage = dict(labels)["stage"]
+                    errors[stage] = errors.get(stage, 0) + value
+            return {
+                dict(labels)["stage"]: {
+                    "count": histogram.count,
+                    "avg": round(histogram.sum / histogram.count, 3) if histogram.count else 0.0,
+                    "p50": histogram.quantile(0.5),
+                    "p95": histogram.quantile(0.95),
+                    "errors": errors.get(dict(labels)["stage"], 0),
+                }
+                for (_, labels), histogram in sorted(self._histograms.items())
+            }
+
+    def render(self) -> str:
+        """Все метрики в текстовом формате Prometheus"""
+        lines: List[str] = []
+        with self._lock:
+            histograms = sorted(self._histograms.items())
+            counters = sorted(self._counters.items())
+            collectors = list(self._collectors)
+
+        typed = set()
+        for (name, labels), histogram in histograms:
+            full = f"{self.prefix}_{name}"
+            if full not in typed:
+                typed.add(full)
+                lines.append(f"# TYPE {full} histogram")
+            cumulative = 0
+            bounds = [_format_value(b) for b in histogram.buckets] + ["+Inf"]
+            for bound, count in zip(bounds, histogram.counts):
+                cumulative += count
+                lines.append(f"{full}_bucket{_format_labels(labels + (('le', bound),))} {cumulative}")
+            lines.append(f"{full}_sum{_format_labels(labels)} {_format_value(histogram.sum)}")
+            lines.append(f"{full}_count{_format_labels(labels)} {histogram.count}")
+
+        for (name, labels), value in counters:
+            full = f"{self.prefix}_{name}"
+            if full not in typed:
+                typed.add(full)
+                lines.append(f"# TYPE {full} counter")
+            lines.append(f"{full}{_format_labels(labels)} {_format_value(value)}")
+
+        for name, stats, label in collectors:
+            try:
+                values = stats()
+            except Exception as e:
+                print(f"⚠️  Не удалось собрать метрики {name}: {e}")
+                continue
+            for key, value, labels in self._flatten(values, label):
+                lines.append(f"{self.prefix}_{name}_{key}{_format_labels(labels)} "
+                             f"{_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+    def log_summary(self):
+        """Печатает сводку по стадиям в лог"""
+        for stage, values in self.snapshot().items():
+            print(f"📊 {stage}: {values['count']} вызовов, среднее {values['avg'] * 1000:.0f} мс, "
+                  f"p95 ≤ {values['p95'] * 1000:.0f} мс, ошибок {values['errors']:.0f}")
+
+    def _flatten(self, values: Dict[str, Any], label: Optional[str]):
+        """(ключ, число, метки) из словаря статистики; строки - метка state, списки - index"""
+        for key, value in values.items():
+            if isinstance(value, dict):
+                if label is None:
+                    continue
+                for inner_key, inner_value, inner_labels in self._flatten(value, None):
+                    yield inner_key, inner_value, _labels({label: key}) + inner_labels
+            elif isinstance(value, bool):
+                yield key, int(value), ()
+            elif isinstance(value, (int, float)):
+                yield key, value, ()
+            elif isinstance(value, str):
+                yield key, 1, (("state", value),)
+            elif isinstance(value, (list, tuple)):
+                for i, item in enumerate(value):
+                    if isinstance(item, (int, float)):
+                        yield key, item, (("index", str(i)),)
+
+    def _finish_span(self, stage: str, seconds: float, error: Optional[BaseException]):
+        self.observe(stage, seconds)
+        if error is not None:
+            self.inc("stage_errors_total", stage=stage, error=type(error).__name__)
+        if self.trace:
+            status = f" ❌ {type(error).__name__}" if error is not None else ""
+            print(f"⏱  [{current_trace() or '-'}] {stage}: {seconds * 1000:.0f} мс{status}")
+
+
+class _Span:
+    __slots__ = ("metrics", "stage", "new_trace", "started", "token")
+
+    def __init__(self, metrics: Metrics, stage: str, new_trace: bool):
+        self.metrics = metrics
+        self.stage = stage
+        self.new_trace = new_trace
+        self.started = 0.0
+        self.token = None
+
+    def __enter__(self) -> "_Span":
+        if self.new_trace:
+            self.token = _trace_id.set(uuid.uuid4().hex[:8])
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self.started
+        # Отмена задачи asyncio - не ошибка стадии
+        error = exc if exc is not None and not isinstance(exc, asyncio.CancelledError) else None
+        self.metrics._finish_span(self.stage, elapsed, error)
+        if self.token is not None:
+            _trace_id.reset(self.token)
+        return False
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    metrics: Metrics = None
+
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = self.metrics.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Prometheus опрашивает часто - не засоряем лог
+        pass
+
+
+def start_metrics_server(metrics: Metrics, host: str = "127.0.0.1",
+                         port: int = 9100) -> ThreadingHTTPServer:
+    """Запускает в фоновом потоке HTTP-сервер с GET /metrics"""
+    handler = type("MetricsHandler", (_MetricsHandler,), {"metrics": metrics})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    print(f"📊 Метрики: http://{host}:{port}/metrics")
+    return server
+
+
+def start_periodic_dump(metrics: Metrics, interval: float) -> threading.Thread:
+    """Раз в interval секунд печатает сводку по стадиям в лог"""
+    def dump():
+        while True:
+            time.sleep(interval)
+            metrics.log_summary()
+
+    thread = threading.Thread(target=dump, name="metrics-dump", daemon=True)
+    thread.start()
+    return thread
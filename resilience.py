@@ -0,0 +1,382 @@
+"""
+Политика устойчивости запросов к внешним API (GigaChat, ProxyAPI)
+Ограничение частоты (token bucket), повторы с экспоненциальной задержкой и
+джиттером в пределах бюджета времени, дублирующий (hedged) запрос для медленных
+ответов и автоматический выключатель (circuit breaker), который перестаёт
+нагружать сбоящий сервис и позволяет боту сразу перейти на запасной вариант
+"""
+
+import asyncio
+import contextvars
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple, Type
+
+# Коды ответа, при которых запрос имеет смысл повторить
+RETRYABLE_STATUSES = frozenset({408, 429, 500, 502, 503, 504})
+
+
+class UpstreamUnavailable(Exception):
+    """Запрос не отправлен: выключатель разомкнут или не уложились в лимит/бюджет времени"""
+
+
+def upstream_status(error: BaseException) -> Optional[int]:
+    """HTTP-код из исключения requests, aiohttp или openai (если он есть)"""
+    for obj in (error, getattr(error, "response", None)):
+        for attr in ("status_code", "status"):
+            value = getattr(obj, attr, None)
+            if isinstance(value, int):
+                return value
+    return None
+
+
+def retry_after(error: BaseException) -> Optional[float]:
+    """Значение заголовка Retry-After (секунды), если сервис его прислал"""
+    headers = getattr(error, "headers", None) or getattr(getattr(error, "response", None), "headers", None)
+    value = headers.get("Retry-After") if headers else None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """
+    Потокобезопасный token bucket: rate запросов в секунду, всплеск до burst
+    rate <= 0 - без ограничения
+    """
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, max_wait: float) -> Optional[float]:
+        """
+        Резервирует токен; возвращает, сколько секунд подождать перед запросом,
+        или None, если ждать пришлось бы дольше max_wait (токен не резервируется)
+        """
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            delay = (1 - self._tokens) / self.rate
+            if delay > max_wait:
+                return None
+            self._tokens -= 1
+            return delay
+
+    def try_acquire(self) -> bool:
+        """Берёт токен, только если он доступен прямо сейчас"""
+        return self.reserve(0.0) is not None
+
+
+class CircuitBreaker:
+    """
+    Автоматический выключатель: после failure_threshold сбоев подряд размыкается
+    и reset_timeout секунд не пропускает запросы; затем пропускает один пробный
+    запрос и замыкается, если он прошёл успешно
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.opens = 0
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        """True, если запросы сейчас не пропускаются (для выбора запасного варианта)"""
+        with self._lock:
+            return (self.state == self.OPEN
+                    and time.monotonic() - self._opened_at < self.reset_timeout)
+
+    def allow(self) -> bool:
+        """Можно ли отправить запрос"""
+        with self._lock:
+            if self.state == self.OPEN:
+                if time.monotonic() - self._opened_at < self.reset_timeout:
+                    return False
+                self.state = self.HALF_OPEN
+                self._probe_in_flight = False
+            if self.state == self.HALF_OPEN:
+                if self._probe_in_flight:
+                    return False
+                self._probe_in_flight = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self._failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    self.opens += 1
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._probe_in_flight = False
+
+
+class UpstreamPolicy:
+    """
+    Политика запросов к одному внешнему сервису
+
+    name - имя сервиса для логов и метрик
+    bucket - ограничение частоты запросов (общее для всех вызовов сервиса)
+    breaker - автоматический выключатель сервиса
+    transient_errors - исключения сетевого уровня, после которых запрос повторяется
+        (ответы с кодами из RETRYABLE_STATUSES повторяются всегда)
+    max_attempts - сколько раз максимум отправить запрос
+    base_delay / max_delay - задержка перед повтором: случайная от 0 до
+        base_delay * 2^(попытка-1), но не больше max_delay (full jitter)
+    budget - сколько секунд максимум тратить на вызов вместе с ожиданием и повторами
+    retry_ratio - доля повторов от числа вызовов (не даёт повторам умножать
+        нагрузку на сбоящий сервис)
+    hedge_after - через сколько секунд без ответа отправить дублирующий запрос
+        (0 - не дублировать); побеждает первый успешный ответ
+    """
+
+    def __init__(self, name: str, bucket: TokenBucket, breaker: CircuitBreaker,
+                 transient_errors: Tuple[Type[BaseException], ...] = (),
+                 max_attempts: int = 3, base_delay: float = 0.5, max_delay: float = 4.0,
+                 budget: float = 30.0, retry_ratio: float = 0.2, hedge_after: float = 0.0):
+        self.name = name
+        self.bucket = bucket
+        self.breaker = breaker
+        self.transient_errors = transient_errors
+        self.max_attempts = max(max_attempts, 1)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget = budget
+        self.retry_ratio = retry_ratio
+        self.hedge_after = hedge_after
+
+        self._lock = threading.Lock()
+        self._retry_tokens = 10.0
+        self._hedge_pool: Optional[ThreadPoolExecutor] = None
+
+        # Счётчики
+        self.calls = 0
+        self.failures = 0
+        self.retries = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.rejected_open = 0
+        self.rejected_rate = 0
+
+    def with_transient_errors(self, transient_errors: Tuple[Type[BaseException], ...]) -> "UpstreamPolicy":
+        """Та же политика (общие лимит и выключатель) для другого HTTP-клиента"""
+        return UpstreamPolicy(
+            self.name, self.bucket, self.breaker, transient_errors,
+            max_attempts=self.max_attempts, base_delay=self.base_delay,
+            max_delay=self.max_delay, budget=self.budget,
+            retry_ratio=self.retry_ratio, hedge_after=self.hedge_after,
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        """Счётчики вызовов и состояние выключателя"""
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "failures": self.failures,
+                "retries": self.retries,
+                "hedges": self.hedges,
+                "hedge_wins": self.hedge_wins,
+                "rejected_open": self.rejected_open,
+                "rejected_rate": self.rejected_rate,
+                "breaker_state": self.breaker.state,
+                "breaker_opens": self.breaker.opens,
+            }
+
+    def admit(self) -> float:
+        """
+        Разрешение на одну попытку без повторов (например, потоковый ответ):
+        проверяет выключатель и лимит частоты, возвращает задержку перед запросом
+        Исход попытки нужно сообщить через record
+        """
+        self._start_call()
+        return self._admit(time.monotonic() + self.budget)
+
+    def record(self, error: Optional[Exception] = None):
+        """Сообщает исход попытки, разрешённой admit (error=None - успех)"""
+        if error is None:
+            self.breaker.record_success()
+        else:
+            self._after_failure(error, self.max_attempts, 0.0)
+
+    def call(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """Выполняет fn(*args, **kwargs) по политике; исключения последней попытки пробрасываются"""
+        deadline = time.monotonic() + self.budget
+        self._start_call()
+        attempt = 0
+        while True:
+            delay = self._admit(deadline)
+            if delay:
+                time.sleep(delay)
+            attempt += 1
+            try:
+                result = self._attempt(fn, args, kwargs)
+            except Exception as e:
+                delay = self._after_failure(e, attempt, deadline)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                continue
+            self.breaker.record_success()
+            return result
+
+    async def call_async(self, factory: Callable[[], Awaitable[Any]]) -> Any:
+        """Асинхронный аналог call: factory() создаёт корутину одной попытки"""
+        deadline = time.monotonic() + self.budget
+        self._start_call()
+        attempt = 0
+        while True:
+            delay = self._admit(deadline)
+            if delay:
+                await asyncio.sleep(delay)
+            attempt += 1
+            try:
+                result = await self._attempt_async(factory)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                delay = self._after_failure(e, attempt, deadline)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                continue
+            self.breaker.record_success()
+            return result
+
+    def _start_call(self):
+        with self._lock:
+            self.calls += 1
+            # Каждый вызов пополняет бюджет повторов на retry_ratio
+            self._retry_tokens = min(self._retry_tokens + self.retry_ratio, 10.0)
+
+    def _admit(self, deadline: float) -> float:
+        """Проверяет выключатель и лимит частоты; возвращает задержку перед запросом"""
+        if not self.breaker.allow():
+            with self._lock:
+                self.rejected_open += 1
+            raise UpstreamUnavailable(f"{self.name}: сервис временно отключён после серии ошибок")
+        delay = self.bucket.reserve(max(deadline - time.monotonic(), 0.0))
+        if delay is None:
+            with self._lock:
+                self.rejected_rate += 1
+            # Пробный запрос так и не ушёл - выключатель не должен его ждать
+            if self.breaker.state == CircuitBreaker.HALF_OPEN:
+                self.breaker.record_failure()
+            raise UpstreamUnavailable(f"{self.name}: превышен лимит запросов")
+        return delay
+
+    def _after_failure(self, error: Exception, attempt: int, deadline: float) -> Optional[float]:
+        """Учитывает ошибку; возвращает задержку перед повтором или None, если не повторять"""
+        status = upstream_status(error)
+        if status is not None:
+            transient = status in RETRYABLE_STATUSES
+        else:
+            transient = isinstance(error, self.transient_errors)
+        if not transient:
+            # Сервис ответил (например, 400 или 401) - он работает
+            self.breaker.record_success()
+            return None
+
+        self.breaker.record_failure()
+        with self._lock:
+            self.failures += 1
+            if attempt >= self.max_attempts or self._retry_tokens < 1:
+                return None
+            delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+            delay = max(delay, retry_after(error) or 0.0)
+            if time.monotonic() + delay >= deadline:
+                return None
+            self._retry_tokens -= 1
+            self.retries += 1
+        print(f"⚠️  {self.name}: {error}; повтор через {delay:.1f} с (попытка {attempt + 1})")
+        return delay
+
+    def _attempt(self, fn: Callable[..., Any], args: tuple, kwargs: dict) -> Any:
+        """Одна попытка; при hedge_after медленный запрос дублируется"""
+        if not self.hedge_after:
+            return fn(*args, **kwargs)
+
+        with self._lock:
+            if self._hedge_pool is None:
+                self._hedge_pool = ThreadPoolExecutor(max_workers=16, thread_name_prefix=f"hedge-{self.name}")
+        # Попытки выполняются в контексте вызывающего потока (трассировка сообщения);
+        # у каждой своя копия - один контекст нельзя войти в двух потоках сразу
+        primary = self._hedge_pool.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+        done, _ = wait([primary], timeout=self.hedge_after)
+        if done or not self.bucket.try_acquire():
+            return primary.result()
+
+        with self._lock:
+            self.hedges += 1
+        hedge = self._hedge_pool.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+        pending = {primary, hedge}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is hedge:
+                        with self._lock:
+                            self.hedge_wins += 1
+                    # Проигравший запрос в потоке не прервать - его результат просто не нужен
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    async def _attempt_async(self, factory: Callable[[], Awaitable[Any]]) -> Any:
+        """Асинхронная попытка; проигравший дублирующий запрос отменяется"""
+        if not self.hedge_after:
+            return await factory()
+
+        primary = asyncio.ensure_future(factory())
+        pending = {primary}
+        error = None
+        try:
+            done, _ = await asyncio.wait(pending, timeout=self.hedge_after)
+            if done or not self.bucket.try_acquire():
+                return await primary
+
+            with self._lock:
+                self.hedges += 1
+            hedge = asyncio.ensure_future(factory())
+            pending = {primary, hedge}
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            with self._lock:
+                                self.hedge_wins += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
@@ -0,0 +1,215 @@
+"""
+Кеш ответов GigaChat на повторяющиеся вопросы покупателей
+Ключ - нормализованный вопрос и отпечаток истории диалога; кроме точного
+совпадения ищутся похожие вопросы по символьным n-граммам (косинусная мера).
+Похожий вопрос принимается, только если числа и отрицания в нём те же:
+"до 20000" и "до 200000", "до 20000" и "не до 20000" - разные вопросы
+"""
+
+import hashlib
+import math
+import re
+import threading
+import time
+from collections import Counter, OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+_NON_WORD = re.compile(r"[^\w\s]+")
+_SPACES = re.compile(r"\s+")
+_DIGITS = re.compile(r"\d")
+
+# Слова, меняющие смысл вопроса на противоположный
+NEGATION_WORDS = frozenset({"не", "нет", "ни", "без", "кроме"})
+
+
+def normalize_question(text: str) -> str:
+    """Приводит вопрос к каноническому виду: регистр, ё, пунктуация, пробелы"""
+    text = text.lower().replace("ё", "е")
+    text = _NON_WORD.sub(" ", text)
+    return _SPACES.sub(" ", text).strip()
+
+
+def history_fingerprint(history: Optional[List[Dict[str, str]]]) -> str:
+    """Отпечаток истории диалога: ответ из кеша годится только для того же контекста"""
+    if not history:
+        return ""
+    digest = hashlib.sha1()
+    for message in history:
+        digest.update(message.get("role", "").encode("utf-8"))
+        digest.update(b"\x00")
+        digest.update(normalize_question(message.get("content", "")).encode("utf-8"))
+        digest.update(b"\x01")
+    return digest.hexdigest()
+
+
+def guard_tokens(normalized: str) -> Tuple[str, ...]:
+    """Числа и слова-отрицания нормализованного вопроса в порядке появления"""
+    return tuple(word for word in normalized.split()
+                 if word in NEGATION_WORDS or _DIGITS.search(word))
+
+
+def _ngram_vector(text: str, n: int) -> Dict[str, float]:
+    """Нормированный вектор символьных n-грамм (каждое слово дополняется пробелами)"""
+    counts: Counter = Counter()
+    for word in text.split():
+        padded = f" {word} "
+        if len(padded) <= n:
+            counts[padded] += 1
+            continue
+        for i in range(len(padded) - n + 1):
+            counts[padded[i:i + n]] += 1
+    norm = math.sqrt(sum(c * c for c in counts.values()))
+    if not norm:
+        return {}
+    return {gram: c / norm for gram, c in counts.items()}
+
+
+class _Entry:
+    __slots__ = ("answer", "vector", "guard", "created_at")
+
+    def __init__(self, answer: str, vector: Dict[str, float],
+                 guard: Tuple[str, ...], created_at: float):
+        self.answer = answer
+        self.vector = vector
+        self.guard = guard
+        self.created_at = created_at
+
+
+class ResponseCache:
+    """
+    Потокобезопасный кеш ответов с поиском похожих вопросов
+
+    max_entries - сколько ответов хранить (вытесняются давно не использованные)
+    ttl - время жизни ответа в секундах
+    threshold - минимальная косинусная близость для ответа на похожий вопрос
+        (дополнительно должны совпасть числа и отрицания, см. guard_tokens)
+    ngram - длина символьных n-грамм
+    """
+
+    def __init__(self, max_entries: int = 1000, ttl: float = 3600,
+                 threshold: float = 0.95, ngram: int = 3):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.threshold = threshold
+        self.ngram = ngram
+
+        # Ключ - (отпечаток истории, нормализованный вопрос); порядок - LRU
+        self._entries: "OrderedDict[Tuple[str, str], _Entry]" = OrderedDict()
+        # Инвертированный индекс: (отпечаток истории, n-грамма) -> ключи записей
+        self._index: Dict[Tuple[str, str], set] = {}
+        self._lock = threading.Lock()
+
+        # Счётчики
+        self.exact_hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, question: str, history: Optional[List[Dict[str, str]]] = None) -> Optional[str]:
+        """Возвращает сохранённый ответ на такой же или похожий вопрос или None"""
+        normalized = normalize_question(question)
+        if not normalized:
+            return None
+        fingerprint = history_fingerprint(history)
+        key = (fingerprint, normalized)
+
+        with self._lock:
+            now = time.time()
+            entry = self._entries.get(key)
+            if entry is not None and self._alive(key, entry, now):
+                self._entries.move_to_end(key)
+                self.exact_hits += 1
+                return entry.answer
+
+            match = self._find_similar(fingerprint, _ngram_vector(normalized, self.ngram),
+                                       guard_tokens(normalized), now)
+            if match is not None:
+                self._entries.move_to_end(match)
+                self.similar_hits += 1
+                return self._entries[match].answer
+
+            self.misses += 1
+            return None
+
+    def put(self, question: str, history: Optional[List[Dict[str, str]]], answer: str):
+        """Сохраняет ответ на вопрос"""
+        normalized = normalize_question(question)
+        if not normalized:
+            return
+        fingerprint = history_fingerprint(history)
+        key = (fingerprint, normalized)
+        vector = _ngram_vector(normalized, self.ngram)
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = _Entry(answer, vector, guard_tokens(normalized), time.time())
+            for gram in vector:
+                self._index.setdefault((fingerprint, gram), set()).add(key)
+
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def clear(self):
+        """Удаляет все ответы из кеша"""
+        with self._lock:
+            self._entries.clear()
+            self._index.clear()
+
+    @property
+    def hit_rate(self) -> float:
+        """Доля запросов, на которые ответ нашёлся в кеше"""
+        total = self.exact_hits + self.similar_hits + self.misses
+        return (self.exact_hits + self.similar_hits) / total if total else 0.0
+
+    def stats(self) -> Dict[str, float]:
+        """Размер кеша и счётчики попаданий"""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "exact_hits": self.exact_hits,
+                "similar_hits": self.similar_hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hit_rate, 4),
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+    def _alive(self, key: Tuple[str, str], entry: _Entry, now: float) -> bool:
+        if self.ttl and now - entry.created_at > self.ttl:
+            self._remove(key)
+            self.expirations += 1
+            return False
+        return True
+
+    def _find_similar(self, fingerprint: str, vector: Dict[str, float],
+                      guard: Tuple[str, ...], now: float) -> Optional[Tuple[str, str]]:
+        """
+        Ищет запись с максимальной косинусной близостью не ниже порога
+        и с теми же числами и отрицаниями, что в вопросе
+        """
+        scores: Dict[Tuple[str, str], float] = {}
+        for gram, weight in vector.items():
+            for key in self._index.get((fingerprint, gram), ()):
+                scores[key] = scores.get(key, 0.0) + weight * self._entries[key].vector[gram]
+
+        for key, score in sorted(scores.items(), key=lambda item: item[1], reverse=True):
+            if score < self.threshold:
+                break
+            if self._entries[key].guard != guard:
+                continue
+            if self._alive(key, self._entries[key], now):
+                return key
+        return None
+
+    def _remove(self, key: Tuple[str, str]):
+        entry = self._entries.pop(key)
+        fingerprint = key[0]
+        for gram in entry.vector:
+            keys = self._index.get((fingerprint, gram))
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._index[(fingerprint, gram)]
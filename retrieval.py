@@ -0,0 +1,239 @@
+"""
+Поиск товаров каталога для ответов GigaChat
+Инвертированный индекс по названию, категории и характеристикам товаров с
+ранжированием BM25: к вопросу клиента подбираются несколько подходящих товаров,
+их названия и актуальные цены добавляются в system prompt вместо выдумок модели.
+Индекс обновляется по одному товару при добавлении, удалении и изменении
+"""
+
+import heapq
+import math
+import re
+import threading
+from collections import Counter
+from typing import Any, Callable, Dict, Hashable, Iterable, Iterator, List, Tuple
+
+from intent_classifier import STEM_LENGTH
+
+_WORD = re.compile(r"\w+")
+
+# Вес совпадения в каждом поле товара
+FIELD_WEIGHTS = {"name": 3.0, "category": 2.0, "specs": 1.0}
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Основы слов для поиска: слова обрезаются до STEM_LENGTH букв,
+    а артикулы и модели с цифрами (m428fdw, a4) остаются целиком
+    """
+    tokens = []
+    for word in _WORD.findall(text.lower().replace("ё", "е")):
+        tokens.append(word if any(ch.isdigit() for ch in word) else word[:STEM_LENGTH])
+    return tokens
+
+
+class CatalogIndex:
+    """
+    Инвертированный индекс с BM25 (потокобезопасный)
+
+    fields(item) -> {поле: текст} - тексты товара для индексации
+    key(item) - идентификатор товара в индексе (по умолчанию id(item))
+    k1, b - параметры BM25
+
+    Для каждого термина хранятся частоты по товарам и группы товаров с одинаковыми
+    (частота, длина товара): вклад термина в оценку у товаров группы одинаков.
+    Поиск (пороговый алгоритм Фейгина) идёт по товарам терминов в порядке убывания
+    вклада параллельно, оценивает встреченные товары целиком и держит k лучших
+    в куче; он останавливается, как только k-й результат не меньше суммы вкладов
+    на текущих позициях - больше её не наберёт ни один непросмотренный товар.
+    Результат совпадает с полным перебором, а просматриваются обычно первые
+    десятки товаров даже для частых слов вроде «принтер».
+    Вклад зависит от средней длины товара, которая меняется с каждым товаром,
+    поэтому сортируются не товары, а группы: их на порядки меньше, и порядок групп
+    пересчитывается при поиске, только если изменилась средняя длина или состав
+    групп термина. Добавление и удаление товара меняют лишь группы его терминов
+    """
+
+    def __init__(self, fields: Callable[[Any], Dict[str, str]],
+                 key: Callable[[Any], Hashable] = id,
+                 field_weights: Dict[str, float] = None, k1: float = 1.2, b: float = 0.75):
+        self.fields = fields
+        self.key = key
+        self.field_weights = field_weights or FIELD_WEIGHTS
+        self.k1 = k1
+        self.b = b
+
+        self._lock = threading.Lock()
+        # Товары занимают номера (слоты); освободившиеся номера используются повторно
+        self._slots: Dict[Hashable, int] = {}
+        self._items: List[Any] = []
+        self._terms: List[Counter] = []
+        self._lengths: List[float] = []
+        self._free: List[int] = []
+        self._total_length = 0.0
+        # термин -> {слот: взвешенная частота}
+        self._postings: Dict[str, Dict[int, float]] = {}
+        # термин -> {(частота, длина товара): слоты}
+        self._groups: Dict[str, Dict[Tuple[float, float], Dict[int, None]]] = {}
+        # термин -> (norm_scale, [(вклад, группа)] по убыванию вклада)
+        self._ranked: Dict[str, Tuple[float, List[Tuple[float, Tuple[float, float]]]]] = {}
+
+        # Счётчики
+        self.searches = 0
+        self.scored = 0
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    def add(self, item: Any):
+        """Индексирует товар (повторное добавление обновляет его)"""
+        terms = Counter()
+        for field, text in self.fields(item).items():
+            weight = self.field_weights.get(field, 1.0)
+            for token in tokenize(text or ""):
+                terms[token] += weight
+        length = sum(terms.values())
+        doc_key = self.key(item)
+        with self._lock:
+            slot = self._slots.get(doc_key)
+            if slot is not None and self._terms[slot] == terms:
+                # Тексты не изменились (например, поменялась только цена)
+                self._items[slot] = item
+                return
+            self._remove_locked(doc_key)
+            if self._free:
+                slot = self._free.pop()
+                self._items[slot], self._terms[slot], self._lengths[slot] = item, terms, length
+            else:
+                slot = len(self._items)
+                self._items.append(item)
+                self._terms.append(terms)
+                self._lengths.append(length)
+            self._slots[doc_key] = slot
+            self._total_length += length
+            for token, frequency in terms.items():
+                self._postings.setdefault(token, {})[slot] = frequency
+                groups = self._groups.setdefault(token, {})
+                group = groups.get((frequency, length))
+                if group is None:
+                    # Новая группа - порядок групп термина пересчитается при поиске
+                    group = groups[(frequency, length)] = {}
+                    self._ranked.pop(token, None)
+                group[slot] = None
+
+    update = add
+
+    def add_many(self, items: Iterable[Any]):
+        for item in items:
+            self.add(item)
+
+    def remove(self, item: Any):
+        """Удаляет товар из индекса"""
+        with self._lock:
+            self._remove_locked(self.key(item))
+
+    def search(self, query: str, k: int = 5) -> List[Tuple[Any, float]]:
+        """k лучших товаров для запроса: [(товар, оценка BM25)] по убыванию оценки"""
+        tokens = set(tokenize(query))
+        with self._lock:
+            self.searches += 1
+            docs_count = len(self._slots)
+            if not docs_count or k <= 0:
+                return []
+            k1 = self.k1
+            norm_base, norm_scale = self._norm_locked()
+            lengths = self._lengths
+
+            # (idf * (k1 + 1), частоты, (вклад, слот) по убыванию вклада)
+            terms = []
+            for token in tokens:
+                postings = self._postings.get(token)
+                if postings:
+                    df = len(postings)
+                    weight = math.log(1 + (docs_count - df + 0.5) / (df + 0.5)) * (k1 + 1)
+                    terms.append((weight, postings, self._walk_locked(token, norm_base, norm_scale)))
+            if not terms:
+                return []
+
+            heap: List[Tuple[float, int]] = []
+            seen = set()
+            while True:
+                bound = 0.0
+                for weight, postings, walk in terms:
+                    step = next(walk, None)
+                    if step is None:
+                        continue
+                    contribution, slot = step
+                    bound += weight * contribution
+                    if slot in seen:
+                        continue
+                    seen.add(slot)
+                    norm = norm_base + norm_scale * lengths[slot]
+                    score = 0.0
+                    for other_weight, other_postings, _ in terms:
+                        other_frequency = other_postings.get(slot)
+                        if other_frequency:
+                            # Скобки - как в _walk_locked: вклад совпадает с оценкой до бита
+                            score += other_weight * (other_frequency / (other_frequency + norm))
+                    if len(heap) < k:
+                        heapq.heappush(heap, (score, slot))
+                    elif score > heap[0][0]:
+                        heapq.heapreplace(heap, (score, slot))
+                # Непросмотренный товар наберёт не больше суммы вкладов на этой позиции
+                if not bound or (len(heap) >= k and heap[0][0] >= bound):
+                    break
+
+            self.scored += len(seen)
+            best = sorted(heap, reverse=True)
+            return [(self._items[slot], score) for score, slot in best]
+
+    def stats(self) -> Dict[str, float]:
+        """Размер индекса и число поисков"""
+        with self._lock:
+            return {
+                "documents": len(self._slots),
+                "terms": len(self._postings),
+                "searches": self.searches,
+                "avg_scored": round(self.scored / self.searches, 1) if self.searches else 0.0,
+            }
+
+    def _walk_locked(self, token: str, norm_base: float,
+                     norm_scale: float) -> Iterator[Tuple[float, int]]:
+        """(вклад tf / (tf + norm), слот) товаров термина по убыванию вклада"""
+        groups = self._groups[token]
+        ranked = self._ranked.get(token)
+        if ranked is None or ranked[0] != norm_scale:
+            order = sorted(((frequency / (frequency + (norm_base + norm_scale * length)),
+                             (frequency, length)) for frequency, length in groups), reverse=True)
+            ranked = self._ranked[token] = (norm_scale, order)
+        for contribution, group in ranked[1]:
+            for slot in groups[group]:
+                yield contribution, slot
+
+    def _norm_locked(self) -> Tuple[float, float]:
+        """norm товара BM25 = norm_base + norm_scale * длина товара"""
+        avg_length = self._total_length / len(self._slots) or 1.0
+        return self.k1 * (1 - self.b), self.k1 * self.b / avg_length
+
+    def _remove_locked(self, doc_key: Hashable) -> bool:
+        slot = self._slots.pop(doc_key, None)
+        if slot is None:
+            return False
+        length = self._lengths[slot]
+        self._total_length -= length
+        for token, frequency in self._terms[slot].items():
+            postings = self._postings[token]
+            del postings[slot]
+            if not postings:
+                del self._postings[token]
+            groups = self._groups[token]
+            group = groups[(frequency, length)]
+            del group[slot]
+            if not group:
+                del groups[(frequency, length)]
+                self._ranked.pop(token, None)
+                if not groups:
+                    del self._groups[token]
+        self._items[slot], self._terms[slot], self._lengths[slot] = None, None, 0.0
+        self._free.append(slot)
+        return True
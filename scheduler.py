@@ -0,0 +1,212 @@
+"""
+Планировщик задач бота: отдельные очереди и пулы потоков для ответов GigaChat
+и генерации картинок
+Внутри пула задачи берутся по приоритету, а среди задач одного приоритета -
+по кругу между пользователями, так что всплеск сообщений одного клиента не
+задерживает остальных. Переполненная очередь не принимает новые задачи
+(сброс нагрузки): вызывающий код решает, чем их заменить
+"""
+
+import contextvars
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Hashable, List, Optional
+
+# Приоритеты задач: меньше - раньше
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 1
+
+
+class QueueFull(Exception):
+    """Очередь пула переполнена - задача не принята"""
+
+
+class PoolClosed(QueueFull):
+    """Пул останавливается - задача не принята (обрабатывается так же, как переполнение)"""
+
+
+class _Job:
+    __slots__ = ("future", "fn", "args", "kwargs", "enqueued_at", "context")
+
+    def __init__(self, fn: Callable[..., Any], args: tuple, kwargs: dict):
+        self.future: Future = Future()
+        # Задача выполняется в контексте того, кто её поставил (трассировка и т.п.)
+        self.context = contextvars.copy_context()
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.enqueued_at = time.monotonic()
+
+
+class FairQueue:
+    """
+    Очередь с приоритетами и справедливостью между пользователями (без блокировок)
+
+    На каждом уровне приоритета у пользователя своя очередь, а пользователи
+    обслуживаются по кругу: по одной задаче за оборот
+    """
+
+    def __init__(self, levels: int = 2):
+        # Уровень -> {пользователь: очередь задач}; порядок ключей - очередь обслуживания
+        self._levels: List["OrderedDict[Hashable, deque]"] = [OrderedDict() for _ in range(levels)]
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def user_depth(self, user_id: Hashable) -> int:
+        """Сколько задач пользователя ждёт в очереди"""
+        return sum(len(level[user_id]) for level in self._levels if user_id in level)
+
+    def level_depths(self) -> List[int]:
+        """Число ожидающих задач на каждом уровне приоритета"""
+        return [sum(len(jobs) for jobs in level.values()) for level in self._levels]
+
+    def put(self, user_id: Hashable, item: Any, priority: int = 0):
+        level = self._levels[min(max(priority, 0), len(self._levels) - 1)]
+        jobs = level.get(user_id)
+        if jobs is None:
+            jobs = level[user_id] = deque()
+        jobs.append(item)
+        self._size += 1
+
+    def pop(self) -> Any:
+        """Следующая задача: высший приоритет, затем следующий по кругу пользователь"""
+        for level in self._levels:
+            if not level:
+                continue
+            user_id, jobs = next(iter(level.items()))
+            item = jobs.popleft()
+            if jobs:
+                # Пользователь уходит в конец круга
+                level.move_to_end(user_id)
+            else:
+                del level[user_id]
+            self._size -= 1
+            return item
+        raise IndexError("очередь пуста")
+
+
+class WorkerPool:
+    """
+    Пул потоков с общей справедливой очередью
+
+    name - имя пула (для потоков, логов и метрик)
+    workers - число потоков
+    max_depth - сколько задач может ждать в очереди (0 - без ограничения)
+    max_per_user - сколько задач одного пользователя может ждать (0 - без ограничения)
+    """
+
+    def __init__(self, name: str, workers: int, max_depth: int = 0, max_per_user: int = 0):
+        self.name = name
+        self.workers = workers
+        self.max_depth = max_depth
+        self.max_per_user = max_per_user
+
+        self._queue = FairQueue()
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._shutdown = False
+        self._active = 0
+
+        # Счётчики
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.shed = 0
+        self.max_seen_depth = 0
+        self.wait_seconds = 0.0
+
+        self._threads = [
+            threading.Thread(target=self._worker, name=f"{name}-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    @property
+    def depth(self) -> int:
+        """Сколько задач ждёт свободного потока"""
+        return len(self._queue)
+
+    def submit(self, user_id: Hashable, fn: Callable[..., Any], *args: Any,
+               priority: int = PRIORITY_INTERACTIVE, **kwargs: Any) -> Future:
+        """
+        Ставит задачу в очередь; QueueFull, если очередь (или очередь пользователя)
+        полна, PoolClosed - если пул уже останавливается
+        """
+        job = _Job(fn, args, kwargs)
+        with self._lock:
+            if self._shutdown:
+                raise PoolClosed(f"пул {self.name} остановлен")
+            if ((self.max_depth and len(self._queue) >= self.max_depth)
+                    or (self.max_per_user and self._queue.user_depth(user_id) >= self.max_per_user)):
+                self.shed += 1
+                raise QueueFull(f"очередь {self.name} переполнена")
+            self._queue.put(user_id, job, priority)
+            self.submitted += 1
+            self.max_seen_depth = max(self.max_seen_depth, len(self._queue))
+            self._not_empty.notify()
+        return job.future
+
+    def stats(self) -> Dict[str, Any]:
+        """Глубина очереди, занятость потоков и счётчики задач"""
+        with self._lock:
+            started = self.completed + self.failed + self._active
+            return {
+                "workers": self.workers,
+                "active": self._active,
+                "depth": len(self._queue),
+                "depth_by_priority": self._queue.level_depths(),
+                "max_seen_depth": self.max_seen_depth,
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "failed": self.failed,
+                "shed": self.shed,
+                "avg_wait_ms": round(self.wait_seconds / started * 1000, 1) if started else 0.0,
+            }
+
+    def shutdown(self, wait: bool = True, timeout: Optional[float] = None) -> bool:
+        """
+        Останавливает пул: новые задачи не принимаются, очередь дорабатывается
+        timeout - общий срок ожидания всех потоков (None - без ограничения)
+        Возвращает True, если все задачи завершены (при wait=False - False)
+        """
+        with self._lock:
+            self._shutdown = True
+            self._not_empty.notify_all()
+        if not wait:
+            return False
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(None if deadline is None else max(deadline - time.monotonic(), 0))
+        return not any(thread.is_alive() for thread in self._threads)
+
+    def _worker(self):
+        while True:
+            with self._lock:
+                while not len(self._queue) and not self._shutdown:
+                    self._not_empty.wait()
+                if not len(self._queue):
+                    return
+                job = self._queue.pop()
+                self._active += 1
+                self.wait_seconds += time.monotonic() - job.enqueued_at
+
+            failed = False
+            if job.future.set_running_or_notify_cancel():
+                try:
+                    job.future.set_result(job.context.run(job.fn, *job.args, **job.kwargs))
+                except BaseException as e:
+                    failed = True
+                    print(f"❌ Ошибка в задаче пула {self.name}: {e}")
+                    job.future.set_exception(e)
+
+            with self._lock:
+                self._active -= 1
+                if failed:
+                    self.failed += 1
+                else:
+                    self.completed += 1
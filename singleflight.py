@@ -0,0 +1,124 @@
+"""
+Объединение одинаковых запросов к внешним API, выполняющихся одновременно
+Когда много пользователей одновременно задают один и тот же вопрос (например,
+после рассылки с акцией), к GigaChat и ProxyAPI уходит один запрос, а его
+результат получают все, кто ждал; повторные запросы после завершения не кешируются
+"""
+
+import asyncio
+import hashlib
+import json
+import threading
+from collections import Counter
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple
+
+
+def fingerprint(*parts: Any) -> str:
+    """Отпечаток запроса: хеш от его параметров (вопрос, история, промпт...)"""
+    data = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(data.encode("utf-8")).hexdigest()
+
+
+class _Counters:
+    """Счётчики по видам запросов: сколько вызовов, сколько реально выполнено"""
+
+    def __init__(self):
+        self.calls: Counter = Counter()
+        self.executed: Counter = Counter()
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """{вид: {calls, executed, collapsed}}; collapsed - вызовы, получившие чужой результат"""
+        return {
+            kind: {
+                "calls": self.calls[kind],
+                "executed": self.executed[kind],
+                "collapsed": self.calls[kind] - self.executed[kind],
+            }
+            for kind in self.calls
+        }
+
+
+class SingleFlight(_Counters):
+    """
+    Потокобезопасное объединение одновременных одинаковых вызовов
+
+    Первый вызов с ключом выполняет функцию в своём потоке, остальные ждут его
+    результата (или исключения)
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._inflight: Dict[Tuple[str, Hashable], Future] = {}
+        self._lock = threading.Lock()
+
+    def do(self, kind: str, key: Hashable, fn: Callable[..., Any], *args: Any) -> Any:
+        """Возвращает fn(*args), выполняя её не более одного раза для одновременных вызовов"""
+        with self._lock:
+            self.calls[kind] += 1
+            future = self._inflight.get((kind, key))
+            leader = future is None
+            if leader:
+                future = self._inflight[(kind, key)] = Future()
+                self.executed[kind] += 1
+
+        if not leader:
+            return future.result()
+
+        try:
+            result = fn(*args)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._inflight[(kind, key)]
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        with self._lock:
+            return super().stats()
+
+
+class _AsyncFlight:
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class AsyncSingleFlight(_Counters):
+    """
+    Объединение одновременных одинаковых корутин в одном event loop
+
+    Запрос выполняется отдельной задачей: отмена одного из ожидающих не
+    прерывает его для остальных; задача отменяется, только когда её
+    результата больше никто не ждёт
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._inflight: Dict[Tuple[str, Hashable], _AsyncFlight] = {}
+
+    async def do(self, kind: str, key: Hashable, factory: Callable[[], Awaitable[Any]]) -> Any:
+        """Возвращает результат factory(), выполняя её не более одного раза для одновременных вызовов"""
+        self.calls[kind] += 1
+        flight = self._inflight.get((kind, key))
+        if flight is None:
+            task = asyncio.ensure_future(factory())
+            flight = self._inflight[(kind, key)] = _AsyncFlight(task)
+            self.executed[kind] += 1
+            task.add_done_callback(lambda _: self._inflight.pop((kind, key), None))
+
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task)
+        except asyncio.CancelledError:
+            if not flight.task.done() and flight.waiters == 1:
+                flight.task.cancel()
+            raise
+        finally:
+            flight.waiters -= 1
@@ -0,0 +1,349 @@
+"""
+Потоковая статистика для рядов продаж и цен
+Продолжение simple_example.py без материализации списков: число, среднее, минимум,
+максимум и дисперсия считаются за один проход по частям потока, квантили - по
+компактному скетчу, слова - по частям файла. Накопители объединяются через merge(),
+поэтому части можно считать в разных потоках или процессах (объекты сериализуются
+pickle) и сложить результаты. Массивы NumPy обрабатываются векторно
+"""
+
+import math
+from array import array
+from collections import Counter
+from itertools import islice, repeat
+from operator import eq, mul, sub, truediv
+from typing import Iterable, Iterator, Optional
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Сколько значений итератора обрабатывается за раз
+CHUNK_SIZE = 65536
+# Сколько символов файла читается за раз при подсчёте слов
+WORD_CHUNK_CHARS = 1024 * 1024
+
+
+def _is_array(values) -> bool:
+    return np is not None and isinstance(values, (np.ndarray, array))
+
+
+class RunningStats:
+    """
+    Число, сумма, среднее, минимум, максимум и дисперсия за один проход
+
+    Сумма каждой части считается math.fsum (точно округлённая), а суммы частей
+    складываются с компенсацией Ноймайера: total отличается от точной суммы не
+    больше чем на несколько ulp независимо от длины потока. calculate_average
+    (sum()) может расходиться с mean в последних разрядах - порядок и способ
+    сложения у них разные (у sum() он ещё и зависит от версии Python); для целых
+    чисел сумма точная. minimum/maximum совпадают с find_max_min.
+    Дисперсия - по Уэлфорду, объединение частей - формулой Чана
+    """
+
+    def __init__(self, values: Iterable[float] = None):
+        self.count = 0
+        self._total = 0
+        # Накопленная ошибка округления суммы (компенсация Ноймайера)
+        self._total_error = 0.0
+        self.minimum = None
+        self.maximum = None
+        # Сумма квадратов отклонений от среднего
+        self._m2 = 0.0
+        if values is not None:
+            self.update_many(values)
+
+    @property
+    def total(self):
+        """Сумма значений (с компенсацией ошибки округления)"""
+        return self._total + self._total_error if self._total_error else self._total
+
+    @property
+    def mean(self) -> float:
+        """Среднее (0 для пустого потока, как calculate_average)"""
+        return self.total / self.count if self.count else 0
+
+    def variance(self, ddof: int = 0) -> float:
+        """Дисперсия: ddof=0 - генеральная, ddof=1 - выборочная"""
+        if self.count <= ddof:
+            return 0.0
+        return self._m2 / (self.count - ddof)
+
+    def stdev(self, ddof: int = 0) -> float:
+        return math.sqrt(self.variance(ddof))
+
+    def update(self, value: float):
+        """Добавляет одно значение"""
+        old_mean = self.mean
+        self.count += 1
+        self._add_total(value)
+        self._m2 += (value - old_mean) * (value - self.mean)
+        if self.minimum is None or value < self.minimum:
+            self.minimum = value
+        if self.maximum is None or value > self.maximum:
+            self.maximum = value
+
+    def update_many(self, values: Iterable[float]) -> "RunningStats":
+        """
+        Добавляет значения из итерируемого объекта частями по CHUNK_SIZE
+        Массивы NumPy и array.array считаются векторно (update_array)
+        """
+        if _is_array(values):
+            return self.update_array(values)
+        iterator = iter(values)
+        while True:
+            chunk = list(islice(iterator, CHUNK_SIZE))
+            if not chunk:
+                return self
+            total = sum(chunk)
+            if total.__class__ is float:
+                # Точно округлённая сумма части (целые sum() складывает точно)
+                total = math.fsum(chunk)
+            chunk_mean = total / len(chunk)
+            deltas = list(map(sub, chunk, repeat(chunk_mean)))
+            m2 = sum(map(mul, deltas, deltas))
+            self._combine(len(chunk), chunk_mean, m2, min(chunk), max(chunk))
+            self._add_total(total)
+
+    def update_array(self, values) -> "RunningStats":
+        """
+        Векторное добавление массива NumPy (или array.array) - нужен NumPy
+        Сумма массива - попарная (numpy.sum), не fsum: при взаимно сокращающихся
+        слагаемых разного порядка ошибка больше, чем у update_many
+        """
+        if np is None:
+            raise RuntimeError("для update_array нужен NumPy")
+        values = np.asarray(values).ravel()
+        if not values.size:
+            return self
+        total = values.sum().item()
+        chunk_mean = total / values.size
+        m2 = float(np.square(values - chunk_mean).sum())
+        self._combine(values.size, chunk_mean, m2, values.min().item(), values.max().item())
+        self._add_total(total)
+        return self
+
+    def merge(self, other: "RunningStats") -> "RunningStats":
+        """Добавляет накопитель другой части потока"""
+        if other.count:
+            self._combine(other.count, other.mean, other._m2, other.minimum, other.maximum)
+            self._add_total(other._total)
+            self._add_total(other._total_error)
+        return self
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "mean": self.mean,
+            "min": self.minimum,
+            "max": self.maximum,
+            "variance": self.variance(),
+            "stdev": self.stdev(),
+        }
+
+    def _add_total(self, value):
+        """Прибавляет value к сумме; ошибка округления копится в _total_error (Ноймайер)"""
+        total = self._total + value
+        if total.__class__ is float:
+            if abs(self._total) >= abs(value):
+                self._total_error += (self._total - total) + value
+            else:
+                self._total_error += (value - total) + self._total
+        self._total = total
+
+    def _combine(self, count: int, mean: float, m2: float, minimum: float, maximum: float):
+        """Формула Чана: объединение (count, mean, m2) с накопленными значениями (total - снаружи)"""
+        if self.count:
+            delta = mean - self.mean
+            new_count = self.count + count
+            self._m2 += m2 + delta * delta * self.count * count / new_count
+            self.count = new_count
+            self.minimum = min(self.minimum, minimum)
+            self.maximum = max(self.maximum, maximum)
+        else:
+            self.count, self._m2 = count, m2
+            self.minimum, self.maximum = minimum, maximum
+
+
+class QuantileSketch:
+    """
+    Скетч квантилей с относительной ошибкой (DDSketch)
+
+    Значения раскладываются по логарифмическим корзинам: любая квантиль
+    возвращается с относительной ошибкой не больше relative_accuracy, память -
+    несколько сотен корзин на диапазон цен от копеек до миллионов независимо от
+    длины потока. Скетчи с одинаковой точностью объединяются сложением корзин.
+    NaN не попадает ни в корзины, ни в count: такие значения считаются в nan_count
+    """
+
+    def __init__(self, relative_accuracy: float = 0.01, values: Iterable[float] = None):
+        if not 0 < relative_accuracy < 1:
+            raise ValueError("relative_accuracy должна быть от 0 до 1")
+        self.relative_accuracy = relative_accuracy
+        self._gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self._gamma)
+        # Индекс корзины -> число значений; отрицательные значения - по модулю
+        self._positive = Counter()
+        self._negative = Counter()
+        self.zero_count = 0
+        self.nan_count = 0
+        self.count = 0
+        self.minimum = None
+        self.maximum = None
+        if values is not None:
+            self.update_many(values)
+
+    def update(self, value: float):
+        if value != value:
+            self.nan_count += 1
+            return
+        self._add_bounds(1, value, value)
+        if value > 0:
+            key = math.ceil(math.log(value) / self._log_gamma)
+            self._positive[key] += 1
+        elif value < 0:
+            key = math.ceil(math.log(-value) / self._log_gamma)
+            self._negative[key] += 1
+        else:
+            self.zero_count += 1
+
+    def update_many(self, values: Iterable[float]) -> "QuantileSketch":
+        """Добавляет значения; массивы NumPy и array.array - векторно"""
+        if _is_array(values):
+            return self.update_array(values)
+        log, ceil, log_gamma = math.log, math.ceil, self._log_gamma
+        positive, negative = self._positive, self._negative
+        iterator = iter(values)
+        while True:
+            chunk = list(islice(iterator, CHUNK_SIZE))
+            if not chunk:
+                return self
+            # NaN не равен сам себе; min() и log() с ним работают неверно
+            nans = len(chunk) - sum(map(eq, chunk, chunk))
+            if nans:
+                self.nan_count += nans
+                chunk = [value for value in chunk if value == value]
+                if not chunk:
+                    continue
+            minimum = min(chunk)
+            self._add_bounds(len(chunk), minimum, max(chunk))
+            if minimum > 0:
+                # Только положительные значения (цены): индексы корзин считаются через map
+                positive.update(map(ceil, map(truediv, map(log, chunk), repeat(log_gamma))))
+                continue
+            for value in chunk:
+                if value > 0:
+                    key = ceil(log(value) / log_gamma)
+                    positive[key] += 1
+                elif value < 0:
+                    key = ceil(log(-value) / log_gamma)
+                    negative[key] += 1
+                else:
+                    self.zero_count += 1
+
+    def update_array(self, values) -> "QuantileSketch":
+        """Векторное добавление массива NumPy (или array.array) - нужен NumPy"""
+        if np is None:
+            raise RuntimeError("для update_array нужен NumPy")
+        values = np.asarray(values, dtype=np.float64).ravel()
+        nans = np.isnan(values)
+        if nans.any():
+            self.nan_count += int(nans.sum())
+            values = values[~nans]
+        if not values.size:
+            return self
+        self._add_bounds(values.size, values.min().item(), values.max().item())
+        for bins, part in ((self._positive, values[values > 0]), (self._negative, -values[values < 0])):
+            keys, counts = np.unique(np.ceil(np.log(part) / self._log_gamma), return_counts=True)
+            bins.update(dict(zip(keys.astype(np.int64).tolist(), counts.tolist())))
+        self.zero_count += int(np.count_nonzero(values == 0))
+        return self
+
+    def merge(self, other: "QuantileSketch") -> "QuantileSketch":
+        """Добавляет скетч другой части потока (точность должна совпадать)"""
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("нельзя объединить скетчи с разной точностью")
+        if other.count:
+            self._add_bounds(other.count, other.minimum, other.maximum)
+            self._positive.update(other._positive)
+            self._negative.update(other._negative)
+            self.zero_count += other.zero_count
+        self.nan_count += other.nan_count
+        return self
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Квантиль q (0..1) или None для пустого скетча"""
+        if not 0 <= q <= 1:
+            raise ValueError("q должно быть от 0 до 1")
+        if not self.count:
+            return None
+        if q == 0:
+            return self.minimum
+        if q == 1:
+            return self.maximum
+        rank = q * (self.count - 1)
+        seen = 0
+        # От самых больших по модулю отрицательных значений к нулю и положительным
+        for key in sorted(self._negative, reverse=True):
+            seen += self._negative[key]
+            if seen > rank:
+                return self._clamp(-self._bucket_value(key))
+        seen += self.zero_count
+        if seen > rank:
+            return self._clamp(0.0)
+        for key in sorted(self._positive):
+            seen += self._positive[key]
+            if seen > rank:
+                return self._clamp(self._bucket_value(key))
+        return self.maximum
+
+    def quantiles(self, qs: Iterable[float]) -> list:
+        return [self.quantile(q) for q in qs]
+
+    @property
+    def buckets(self) -> int:
+        """Число занятых корзин (объём памяти скетча)"""
+        return len(self._positive) + len(self._negative)
+
+    def _bucket_value(self, key: int) -> float:
+        # Середина корзины (gamma^(key-1), gamma^key] с относительной ошибкой не больше relative_accuracy
+        return 2 * self._gamma ** key / (self._gamma + 1)
+
+    def _clamp(self, value: float) -> float:
+        return min(max(value, self.minimum), self.maximum)
+
+    def _add_bounds(self, count: int, minimum: float, maximum: float):
+        self.count += count
+        if self.minimum is None or minimum < self.minimum:
+            self.minimum = minimum
+        if self.maximum is None or maximum > self.maximum:
+            self.maximum = maximum
+
+
+def iter_even_numbers(numbers: Iterable[int]) -> Iterator[int]:
+    """Чётные числа потока по одному (потоковый filter_even_numbers)"""
+    return (number for number in numbers if number % 2 == 0)
+
+
+def count_words_in_chunks(chunks: Iterable[str]) -> int:
+    """
+    Число слов в тексте, поданном частями (совпадает с simple_example.count_words
+    для склеенного текста): слово, разрезанное границей частей, считается один раз
+    """
+    count = 0
+    inside_word = False
+    for chunk in chunks:
+        if not chunk:
+            continue
+        count += len(chunk.split())
+        if inside_word and not chunk[0].isspace():
+            count -= 1
+        inside_word = not chunk[-1].isspace()
+    return count
+
+
+def count_words_in_file(path: str, encoding: str = "utf-8", chunk_chars: int = WORD_CHUNK_CHARS) -> int:
+    """Число слов в файле; в памяти одновременно только одна часть файла"""
+    with open(path, encoding=encoding) as f:
+        return count_words_in_chunks(iter(lambda: f.read(chunk_chars), ""))
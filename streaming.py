@@ -0,0 +1,76 @@
+"""
+Потоковые ответы GigaChat
+Разбор SSE-фрагментов (stream: true) и троттлинг правок сообщения в Telegram
+"""
+
+import json
+import time
+from typing import Optional, Union
+
+# Маркер конца потока (data: [DONE])
+STREAM_DONE = object()
+
+# Максимальная длина текста сообщения Telegram
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+
+def parse_sse_line(line: Union[bytes, str]) -> Optional[object]:
+    """
+    Разбирает строку SSE-потока GigaChat
+    Возвращает фрагмент текста ответа, STREAM_DONE или None (служебная строка)
+    """
+    if isinstance(line, bytes):
+        line = line.decode("utf-8", errors="replace")
+    line = line.strip()
+    if not line.startswith("data:"):
+        return None
+
+    data = line[5:].strip()
+    if data == "[DONE]":
+        return STREAM_DONE
+    try:
+        chunk = json.loads(data)
+    except ValueError:
+        return None
+
+    choices = chunk.get("choices") or []
+    if not choices:
+        return None
+    return choices[0].get("delta", {}).get("content") or None
+
+
+class EditThrottle:
+    """
+    Накопитель потокового ответа, решающий, когда править сообщение
+
+    Telegram ограничивает частоту правок одного сообщения, поэтому новый текст
+    отдаётся не чаще, чем раз в interval секунд и не меньше чем на min_chars символов
+    """
+
+    def __init__(self, interval: float = 1.0, min_chars: int = 20,
+                 cursor: str = " ▌", max_length: int = TELEGRAM_MESSAGE_LIMIT):
+        self.interval = interval
+        self.min_chars = min_chars
+        self.cursor = cursor
+        self.max_length = max_length
+
+        self.text = ""
+        self.edits = 0
+        self._shown_length = 0
+        self._last_edit = 0.0
+
+    def feed(self, delta: str) -> Optional[str]:
+        """Добавляет фрагмент; возвращает текст для правки сообщения, если пора"""
+        self.text += delta
+        now = time.monotonic()
+        if now - self._last_edit < self.interval:
+            return None
+        if len(self.text) - self._shown_length < self.min_chars:
+            return None
+
+        self._last_edit = now
+        self._shown_length = len(self.text)
+        self.edits += 1
+        # Пока ответ дописывается, показываем хвост-курсор
+        limit = self.max_length - len(self.cursor)
+        return self.text[:limit] + self.cursor
@@ -0,0 +1,62 @@
+"""
+Проверки загрузки каталога: обновление цен файлом name,price не трогает
+категории и характеристики товаров
+"""
+
+from catalog_io import DEFAULT_CATEGORY, import_catalog
+from main import Product, Store
+
+
+def _store() -> Store:
+    store = Store("Тест")
+    store.add_product(Product("Ноутбук", 75000, "Электроника", "16 ГБ, SSD 512 ГБ"), verbose=False)
+    store.add_product(Product("Кресло", 12000, "Мебель", "сетка, подлокотники"), verbose=False)
+    return store
+
+
+def _by_name(store: Store) -> dict:
+    return {p.name: (p.price, p.category, p.specs) for p in store.products}
+
+
+def test_price_only_csv_keeps_category_and_specs(tmp_path):
+    store = _store()
+    feed = tmp_path / "prices.csv"
+    feed.write_text("name,price\nНоутбук,70000\nКресло,11000\nМонитор,15000\n", encoding="utf-8")
+
+    report = import_catalog(store, str(feed), upsert=True)
+
+    assert (report.updated, report.loaded, report.failed) == (2, 1, 0)
+    assert _by_name(store) == {
+        "Ноутбук": (70000, "Электроника", "16 ГБ, SSD 512 ГБ"),
+        "Кресло": (11000, "Мебель", "сетка, подлокотники"),
+        "Монитор": (15000, DEFAULT_CATEGORY, ""),
+    }
+    assert store.get_category_value("Электроника") == 70000
+    assert store.get_category_value(DEFAULT_CATEGORY) == 15000
+
+
+def test_price_only_jsonl_keeps_category_and_specs(tmp_path):
+    store = _store()
+    feed = tmp_path / "prices.jsonl"
+    feed.write_text('{"name": "Ноутбук", "price": 70000}\n'
+                    '{"name": "Кресло", "price": 11000, "specs": "без подлокотников"}\n',
+                    encoding="utf-8")
+
+    report = import_catalog(store, str(feed), upsert=True)
+
+    assert report.updated == 2
+    assert _by_name(store) == {
+        "Ноутбук": (70000, "Электроника", "16 ГБ, SSD 512 ГБ"),
+        "Кресло": (11000, "Мебель", "без подлокотников"),
+    }
+
+
+def test_present_columns_are_updated(tmp_path):
+    store = _store()
+    feed = tmp_path / "feed.csv"
+    feed.write_text("name,price,category,specs\nНоутбук,70000,Ноутбуки,\n", encoding="utf-8")
+
+    import_catalog(store, str(feed), upsert=True)
+
+    assert _by_name(store)["Ноутбук"] == (70000, "Ноутбуки", "")
+    assert store.get_category_value("Электроника") == 0
@@ -0,0 +1,36 @@
+"""
+Проверки кеша ответов: похожий вопрос с другим числом или отрицанием
+не должен получать чужой ответ
+"""
+
+import pytest
+
+from response_cache import ResponseCache, guard_tokens
+
+
+@pytest.mark.parametrize("cached, asked", [
+    ("Есть ноутбуки до 20000 рублей?", "Есть ноутбуки до 200000 рублей?"),
+    ("Есть ноутбуки до 20000 рублей?", "Есть ноутбуки не до 20000 рублей?"),
+    ("Нужен стол на 5 человек", "Нужен стол на 50 человек"),
+    ("Нужен стол на 5 человек", "Нужен стол на 15 человек"),
+    ("Комплект с мышкой", "Комплект без мышки"),
+])
+def test_near_miss_is_not_served(cached, asked):
+    cache = ResponseCache()
+    cache.put(cached, None, "ответ")
+    assert cache.get(asked) is None
+    assert cache.get(cached) == "ответ"
+
+
+def test_similar_question_with_same_numbers_is_served():
+    cache = ResponseCache(threshold=0.8)
+    cache.put("Есть ноутбуки до 20000 рублей?", None, "ответ")
+    assert cache.get("есть ноутбуки до 20000 рублей!!") == "ответ"
+    assert cache.get("Есть ноутбуки до 20000 рубля?") == "ответ"
+    assert cache.stats()["similar_hits"] == 1
+
+
+def test_guard_tokens():
+    assert guard_tokens("не до 20000 рублей") == ("не", "20000")
+    assert guard_tokens("стол на 5 человек") == ("5",)
+    assert guard_tokens("комплект без мышки") == ("без",)
@@ -0,0 +1,35 @@
+"""
+Проверки магазина: вывод цен из колоночного каталога и отказ от NaN
+"""
+
+import pytest
+
+from main import Product, Store
+
+
+def test_price_presentation():
+    store = Store("Тест")
+    laptop = Product("Ноутбук", 75000, "Электроника")
+    store.add_product(laptop, verbose=False)
+    store.add_product(Product("Ручка", 12.5), verbose=False)
+    assert str(laptop) == "Ноутбук (Электроника): 75000₽"
+    assert repr(laptop) == "Product('Ноутбук', 75000, 'Электроника')"
+    assert str(store.products[1]) == "Ручка (Общее): 12.5₽"
+
+
+@pytest.mark.parametrize("add", [
+    lambda store, product: store.add_product(product, verbose=False),
+    lambda store, product: store.add_products([product]),
+])
+def test_nan_price_is_rejected(add):
+    store = Store("Тест")
+    with pytest.raises(ValueError, match="Цена должна быть числом"):
+        add(store, Product("Ноутбук", float("nan")))
+    assert len(store.products) == 0
+    assert store.get_total_value() == 0
+
+    product = Product("Мышь", 1500)
+    add(store, product)
+    with pytest.raises(ValueError, match="Цена должна быть числом"):
+        product.price = float("nan")
+    assert product.price == 1500
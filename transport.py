@@ -0,0 +1,99 @@
+"""
+HTTP-транспорт для внешних API бота
+Пулы keep-alive соединений по хостам для GigaChat и долгоживущий клиент ProxyAPI
+"""
+
+import threading
+from typing import Dict
+from urllib.parse import urlsplit
+
+import httpx
+import requests
+from openai import AsyncOpenAI, OpenAI
+from requests.adapters import HTTPAdapter
+
+
+class HttpTransport:
+    """
+    Пул HTTP-сессий: по одной requests.Session на хост
+    Соединения переиспользуются (keep-alive), поэтому TCP+TLS рукопожатие
+    выполняется один раз, а не на каждый запрос
+    """
+
+    def __init__(self, pool_size: int = 10, connect_timeout: float = 5.0,
+                 read_timeout: float = 60.0):
+        self.pool_size = pool_size
+        self.timeout = (connect_timeout, read_timeout)
+        self._sessions: Dict[str, requests.Session] = {}
+        self._lock = threading.Lock()
+
+    def session(self, url: str) -> requests.Session:
+        """Возвращает сессию для хоста из url, создавая её при первом обращении"""
+        parts = urlsplit(url)
+        key = f"{parts.scheme}://{parts.netloc}"
+        session = self._sessions.get(key)
+        if session is None:
+            with self._lock:
+                session = self._sessions.get(key)
+                if session is None:
+                    session = self._create_session()
+                    self._sessions[key] = session
+        return session
+
+    def _create_session(self) -> requests.Session:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        session.headers["Connection"] = "keep-alive"
+        return session
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        """POST-запрос через пул соединений хоста (с таймаутами по умолчанию)"""
+        kwargs.setdefault("timeout", self.timeout)
+        return self.session(url).post(url, **kwargs)
+
+    def close(self):
+        """Закрывает все соединения"""
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+
+
+def create_proxyapi_client(api_key: str, base_url: str, pool_size: int = 10,
+                           connect_timeout: float = 5.0, read_timeout: float = 120.0,
+                           keepalive_expiry: float = 60.0, max_retries: int = 2) -> OpenAI:
+    """
+    Создаёт долгоживущий клиент OpenAI для ProxyAPI с пулом keep-alive соединений
+    Клиент потокобезопасен и создаётся один раз на процесс
+    """
+    http_client = httpx.Client(
+        limits=httpx.Limits(
+            max_connections=pool_size,
+            max_keepalive_connections=pool_size,
+            keepalive_expiry=keepalive_expiry,
+        ),
+        timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+    )
+    return OpenAI(api_key=api_key, base_url=base_url, http_client=http_client,
+                  max_retries=max_retries)
+
+
+def create_async_proxyapi_client(api_key: str, base_url: str, pool_size: int = 10,
+                                 connect_timeout: float = 5.0, read_timeout: float = 120.0,
+                                 keepalive_expiry: float = 60.0, max_retries: int = 2) -> AsyncOpenAI:
+    """
+    Создаёт асинхронный клиент ProxyAPI для asyncio-движка бота
+    Должен создаваться внутри работающего event loop
+    """
+    http_client = httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=pool_size,
+            max_keepalive_connections=pool_size,
+            keepalive_expiry=keepalive_expiry,
+        ),
+        timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+    )
+    return AsyncOpenAI(api_key=api_key, base_url=base_url, http_client=http_client,
+                       max_retries=max_retries)
@@ -0,0 +1,183 @@
+"""
+Приём обновлений Telegram через webhook
+Встроенный HTTP-сервер складывает обновления во внутреннюю очередь,
+которую разбирает пул рабочих потоков; при остановке очередь дорабатывается
+"""
+
+import hmac
+import json
+import queue
+import signal
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, List, Optional
+
+# Заголовок, в котором Telegram передаёт secret_token из setWebhook
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+# Маркер остановки рабочего потока
+_STOP = object()
+
+
+class WebhookServer:
+    """
+    HTTP-эндпоинт для webhook Telegram с очередью и пулом обработчиков
+
+    process_update - функция, которая обрабатывает одно обновление (dict из JSON)
+    Эндпоинт сразу отвечает 200, а обработка идёт в рабочих потоках.
+    Если очередь заполнена, отвечает 503 - Telegram повторит доставку позже.
+    GET /healthz возвращает состояние для балансировщика нагрузки.
+    """
+
+    def __init__(self, process_update: Callable[[dict], None], host: str = "0.0.0.0",
+                 port: int = 8080, path: str = "/telegram/webhook",
+                 secret_token: Optional[str] = None, workers: int = 8,
+                 queue_size: int = 1000):
+        self.process_update = process_update
+        self.host = host
+        self.port = port
+        self.path = path
+        self.secret_token = secret_token
+        self.workers = workers
+
+        self.updates: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._accepting = False
+        self._httpd: Optional[ThreadingHTTPServer] = None
+        self._server_thread: Optional[threading.Thread] = None
+        self._worker_threads: List[threading.Thread] = []
+
+    def start(self):
+        """Запускает рабочие потоки и HTTP-сервер в фоне"""
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"webhook-worker-{i}", daemon=True)
+            thread.start()
+            self._worker_threads.append(thread)
+
+        self._httpd = ThreadingHTTPServer((self.host, self.port), self._make_handler())
+        self._httpd.daemon_threads = True
+        # При порте 0 ОС выбирает свободный порт (удобно для тестов)
+        self.port = self._httpd.server_address[1]
+        self._accepting = True
+        self._server_thread = threading.Thread(target=self._httpd.serve_forever,
+                                               name="webhook-http", daemon=True)
+        self._server_thread.start()
+
+    def stop(self, drain_timeout: float = 30.0) -> bool:
+        """
+        Плавная остановка: перестаёт принимать обновления, дорабатывает очередь
+        (не дольше drain_timeout секунд) и останавливает рабочие потоки
+        Возвращает True, если очередь удалось разобрать полностью
+        """
+        self._accepting = False
+        if self._httpd:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+
+        drained = self._wait_drained(drain_timeout)
+        if not drained:
+            print(f"⚠️  Webhook: не обработано обновлений при остановке: {self.updates.unfinished_tasks}")
+
+        for _ in self._worker_threads:
+            self.updates.put(_STOP)
+        for thread in self._worker_threads:
+            thread.join(timeout=1)
+        self._worker_threads = []
+        return drained
+
+    def serve_until_signal(self, drain_timeout: float = 30.0):
+        """Запускает сервер и работает до Ctrl+C или SIGTERM, затем плавно останавливается"""
+        stop_event = threading.Event()
+        signal.signal(signal.SIGTERM, lambda signum, frame: stop_event.set())
+
+        self.start()
+        try:
+            while not stop_event.wait(0.5):
+                pass
+        except KeyboardInterrupt:
+            pass
+
+        print("⏳ Webhook: остановка, дорабатываем очередь...")
+        self.stop(drain_timeout)
+        print("✓ Webhook остановлен")
+
+    def _wait_drained(self, timeout: float) -> bool:
+        deadline = time.monotonic() + timeout
+        with self.updates.all_tasks_done:
+            while self.updates.unfinished_tasks:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self.updates.all_tasks_done.wait(remaining)
+        return True
+
+    def _worker(self):
+        while True:
+            update = self.updates.get()
+            try:
+                if update is _STOP:
+                    return
+                self.process_update(update)
+            except Exception as e:
+                print(f"❌ Ошибка при обработке обновления: {e}")
+            finally:
+                self.updates.task_done()
+
+    def _enqueue(self, update: dict) -> bool:
+        if not self._accepting:
+            return False
+        try:
+            self.updates.put_nowait(update)
+            return True
+        except queue.Full:
+            return False
+
+    def _check_secret(self, received: Optional[str]) -> bool:
+        if not self.secret_token:
+            return True
+        return hmac.compare_digest(received or "", self.secret_token)
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                if self.path != server.path:
+                    self._respond(404)
+                    return
+                if not server._check_secret(self.headers.get(SECRET_HEADER)):
+                    self._respond(403)
+                    return
+
+                length = int(self.headers.get("Content-Length") or 0)
+                try:
+                    update = json.loads(self.rfile.read(length))
+                except ValueError:
+                    self._respond(400)
+                    return
+
+                self._respond(200 if server._enqueue(update) else 503)
+
+            def do_GET(self):
+                if self.path != "/healthz":
+                    self._respond(404)
+                    return
+                status = 200 if server._accepting else 503
+                body = json.dumps({
+                    "accepting": server._accepting,
+                    "queue_depth": server.updates.qsize(),
+                }).encode("utf-8")
+                self._respond(status, body, "application/json")
+
+            def _respond(self, status, body=b"", content_type="text/plain"):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                # Не засоряем вывод строкой на каждое обновление
+                pass
+
+        return Handler
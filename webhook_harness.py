@@ -0,0 +1,106 @@
+"""
+Локальная проверка webhook-режима
+Отправляет синтетические обновления Telegram на запущенный эндпоинт бота
+
+Пример:
+    python webhook_harness.py --count 100 --users 10 --rate 20
+"""
+
+import argparse
+import itertools
+import json
+import random
+import time
+import urllib.error
+import urllib.request
+
+from webhook import SECRET_HEADER
+
+# Типичные вопросы покупателей для синтетических сообщений
+SAMPLE_QUESTIONS = [
+    "Какое МФУ выбрать для небольшого офиса?",
+    "Нужен лазерный принтер до 20000 рублей",
+    "Сколько стоит доставка?",
+    "Какая гарантия на сканеры?",
+    "Посоветуйте копир для печати 5000 страниц в месяц",
+    "Спасибо!",
+]
+
+_update_ids = itertools.count(1)
+_message_ids = itertools.count(1)
+
+
+def make_update(user_id, text, update_id=None):
+    """Формирует синтетическое обновление Telegram с текстовым сообщением"""
+    return {
+        "update_id": update_id if update_id is not None else next(_update_ids),
+        "message": {
+            "message_id": next(_message_ids),
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private", "first_name": f"User{user_id}"},
+            "from": {"id": user_id, "is_bot": False, "first_name": f"User{user_id}"},
+            "text": text,
+        },
+    }
+
+
+def post_update(url, update, secret_token=None, timeout=10):
+    """
+    Отправляет обновление на эндпоинт, возвращает HTTP-статус ответа
+    или описание сетевой ошибки (сервер не запущен, таймаут) - доставка не удалась
+    """
+    headers = {"Content-Type": "application/json"}
+    if secret_token:
+        headers[SECRET_HEADER] = secret_token
+    request = urllib.request.Request(url, data=json.dumps(update).encode("utf-8"),
+                                     headers=headers, method="POST")
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+    except urllib.error.URLError as e:
+        return f"ошибка: {e.reason}"
+    except OSError as e:
+        return f"ошибка: {e}"
+
+
+def main():
+    """Отправляет пачку синтетических обновлений и печатает сводку"""
+    parser = argparse.ArgumentParser(description="Синтетические обновления Telegram для webhook")
+    parser.add_argument("--url", default="http://127.0.0.1:8080/telegram/webhook")
+    parser.add_argument("--secret", default=None, help="WEBHOOK_SECRET бота")
+    parser.add_argument("--count", type=int, default=20, help="сколько обновлений отправить")
+    parser.add_argument("--users", type=int, default=5, help="число разных пользователей")
+    parser.add_argument("--rate", type=float, default=10.0, help="обновлений в секунду")
+    args = parser.parse_args()
+
+    statuses = {}
+    latencies = []
+    interval = 1.0 / args.rate if args.rate > 0 else 0
+
+    for i in range(args.count):
+        user_id = 100000 + i % args.users
+        update = make_update(user_id, random.choice(SAMPLE_QUESTIONS))
+        started = time.perf_counter()
+        status = post_update(args.url, update, args.secret)
+        latencies.append(time.perf_counter() - started)
+        statuses[status] = statuses.get(status, 0) + 1
+        if interval:
+            time.sleep(interval)
+
+    latencies.sort()
+    print(f"Отправлено обновлений: {args.count}")
+    print(f"Статусы ответов: {statuses}")
+    failed = sum(count for status, count in statuses.items() if not isinstance(status, int))
+    if failed:
+        print(f"Не доставлено (нет соединения с эндпоинтом): {failed}")
+    if not latencies:
+        print("Обновления не отправлялись (--count 0)")
+        return
+    print(f"Время ответа эндпоинта: медиана {latencies[len(latencies) // 2] * 1000:.1f} мс, "
+          f"максимум {latencies[-1] * 1000:.1f} мс")
+
+
+if __name__ == "__main__":
+    main()